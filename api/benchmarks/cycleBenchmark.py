@@ -0,0 +1,77 @@
+"""
+Time of a trade cycle search on the in-memory has/wants graph, needs no
+database. Every user owns and wants a few random games of a catalogue ten
+times smaller than the user base. A full search starts from every user, an
+incremental one only from the users changed since the previous run, which
+is what the scheduled matcher does:
+
+    python -m benchmarks.cycleBenchmark --sizes 1000 10000 100000
+"""
+from services.matchService import TradeGraph
+import argparse
+import random
+import time
+
+GAMES_PER_USER = 3
+WISHES_PER_USER = 3
+CHANGED_SHARE = 0.01  # users changing their library between two runs
+
+
+def random_library(rng: random.Random, catalogue: int, firstCopy: int) -> list:
+    return [
+        (firstCopy + number, rng.randrange(catalogue))
+        for number in range(GAMES_PER_USER)
+    ]
+
+
+def random_wishes(rng: random.Random, catalogue: int) -> set:
+    return {rng.randrange(catalogue) for _ in range(WISHES_PER_USER)}
+
+
+def build(size: int, rng: random.Random) -> tuple[TradeGraph, float]:
+    graph = TradeGraph()
+    catalogue = max(size // 10, 1)
+    start = time.perf_counter()
+    for user in range(size):
+        graph.set_library(user, random_library(rng, catalogue, user * GAMES_PER_USER))
+        graph.set_wishlist(user, random_wishes(rng, catalogue))
+    return graph, time.perf_counter() - start
+
+
+def timed_search(graph: TradeGraph, starts=None) -> tuple[list, float]:
+    start = time.perf_counter()
+    cycles = graph.find_cycles(set(), starts)
+    return cycles, time.perf_counter() - start
+
+
+def main(sizes: list[int]):
+    rng = random.Random(42)
+    for size in sizes:
+        graph, seconds = build(size, rng)
+        print(f"{size} users, graph built in {seconds:.2f}s")
+        cycles, seconds = timed_search(graph)
+        lengths = sorted(len(cycle) for cycle in cycles)
+        print(
+            f"  full search         {seconds * 1000:9.1f} ms  {len(cycles)} cycles,"
+            f" {sum(lengths)} users matched, longest {lengths[-1] if lengths else 0}"
+        )
+
+        catalogue = max(size // 10, 1)
+        changed = rng.sample(range(size), max(int(size * CHANGED_SHARE), 1))
+        start = time.perf_counter()
+        for user in changed:
+            graph.set_library(user, random_library(rng, catalogue, (size + user) * 10))
+            graph.set_wishlist(user, random_wishes(rng, catalogue))
+        seconds = time.perf_counter() - start
+        print(f"  update {len(changed)} users   {seconds * 1000:9.1f} ms")
+        cycles, seconds = timed_search(graph, set(changed))
+        print(f"  incremental search  {seconds * 1000:9.1f} ms  {len(cycles)} cycles")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    args = parser.parse_args()
+    main(args.sizes)
@@ -0,0 +1,483 @@
+"""
+Load test, drives a mix of requests through the whole FastAPI app in process
+and reports throughput and p50/p95/p99 per operation.
+
+The app runs against a throwaway database, either mongomock (pure python,
+no server needed) or a mongod started on a free port for the run:
+
+    python -m benchmarks.loadTest --backend mongomock --users 200 --games 2000
+    python -m benchmarks.loadTest --backend mongod --compare old-results.json
+
+Results are written as json, --compare prints the difference with an earlier
+run and exits with 1 when the p95 or the throughput of an operation got worse
+than --tolerance allows. The extra packages are in benchmarks/requirements.txt.
+"""
+from collections import defaultdict
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PASSWORD = "l33tH4x0r"
+ADDRESS = {
+    "street": "1234 Main",
+    "city": "Anytown",
+    "state": "CA",
+    "zipcode": "12345",
+    "country": "USA",
+}
+# relative weight of every operation in the mix
+WORKLOAD = {
+    "login": 5,
+    "games": 20,
+    "search": 15,
+    "library": 20,
+    "myTrades": 15,
+    "tradeRequest": 5,
+    "tradeAccept": 5,
+}
+BATCH_SIZE = 1000
+
+
+# ------------------------- BACKENDS ------------------------- #
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mongod(binary: str):
+    """Starts a mongod on a temporary data directory, returns (process, uri, dir)"""
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    dbPath = tempfile.mkdtemp(prefix="retrogames-load-")
+    port = free_port()
+    process = subprocess.Popen(
+        [binary, "--dbpath", dbPath, "--port", str(port), "--bind_ip", "127.0.0.1"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    uri = f"mongodb://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            MongoClient(uri, serverSelectionTimeoutMS=500).admin.command("ping")
+            return process, uri, dbPath
+        except PyMongoError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                shutil.rmtree(dbPath, ignore_errors=True)
+                raise SystemExit(f"{binary} didn't start on port {port}")
+
+
+def configure(backend: str, uri: str, bcryptRounds: int):
+    # decouple reads the environment before the .env file, and everything
+    # below has to be set before the app modules are first imported
+    os.environ["MONGO_URI"] = uri
+    os.environ["INVALIDATION_TRANSPORT"] = "memory"
+    # every simulated client comes from the same address
+    os.environ["RATE_LIMIT_STORE"] = "off"
+    os.environ["BCRYPT_ROUNDS"] = str(bcryptRounds)
+    os.environ.setdefault("SECRET_KEY", "load-test-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+    if backend == "mongomock":
+        import mongomock_motor
+        import motor.motor_asyncio
+
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+        os.environ["INDEX_CHECK"] = "False"  # mongomock can't explain()
+
+
+# ------------------------- SEEDING ------------------------- #
+
+
+class State:
+    """What the load generator knows of the database, kept up to date locally"""
+
+    def __init__(self):
+        self.users: list[dict] = []  # id, email, token
+        self.libraries: dict[str, list[str]] = {}  # user id -> owned game ids
+        self.pending: dict[str, list[dict]] = defaultdict(list)  # by receiver
+
+
+async def seed(users: int, games: int, library: int, trades: int) -> State:
+    from beanie import PydanticObjectId
+    from datetime import timedelta
+    from models.userModel import User, Address
+    from models.gameModel import GameAbstract, OwnedGame, OwnedGameOut
+    from models.tradeModel import TradeOffer
+    from services.passwordService import passwordHasher
+    from dependencies import create_access_token
+    from benchmarks.searchBenchmark import fake_game
+
+    state = State()
+    passwordHash = await passwordHasher.hash(PASSWORD)
+    userDocuments = []
+    for index in range(users):
+        user = User(
+            id=PydanticObjectId(),
+            username=f"loadtest{index}",
+            email=f"loadtest{index}@retro.games",
+            password=passwordHash,
+            street_address=Address(**ADDRESS),
+        )
+        userDocuments.append(user)
+        token = create_access_token({"sub": user.email}, timedelta(hours=2))
+        state.users.append({"id": str(user.id), "email": user.email, "token": token})
+    gameDocuments = [
+        GameAbstract(id=PydanticObjectId(), **fake_game(index))
+        for index in range(games)
+    ]
+    copies = []
+    snapshots = {}
+    for user in userDocuments:
+        state.libraries[str(user.id)] = []
+        for game in random.sample(gameDocuments, min(library, games)):
+            copy = OwnedGame(
+                id=PydanticObjectId(),
+                game=game.id,
+                name=game.name,
+                condition=random.choice(["mint", "good", "fair", "poor"]),
+                owner=user.id,
+                ownerHistory=[user.id],
+            )
+            copies.append(copy)
+            snapshots[str(copy.id)] = OwnedGameOut(**copy.dict())
+            state.libraries[str(user.id)].append(str(copy.id))
+    tradeDocuments = []
+    for _ in range(trades):
+        offerer, receiver = random.sample(state.users, 2)
+        offered = random.choice(state.libraries[offerer["id"]])
+        wanted = random.choice(state.libraries[receiver["id"]])
+        trade = TradeOffer(
+            id=PydanticObjectId(),
+            offerer=offerer["id"],
+            receiver=receiver["id"],
+            offererMessage="load test",
+            offererGames=[snapshots[offered]],
+            receiverGames=[snapshots[wanted]],
+        )
+        tradeDocuments.append(trade)
+        state.pending[receiver["id"]].append(
+            {
+                "id": str(trade.id),
+                "offerer": offerer["id"],
+                "give": offered,
+                "get": wanted,
+            }
+        )
+    # insert_many skips the after_event hooks, the caches are still empty
+    for model, documents in [
+        (User, userDocuments),
+        (GameAbstract, gameDocuments),
+        (OwnedGame, copies),
+        (TradeOffer, tradeDocuments),
+    ]:
+        for start in range(0, len(documents), BATCH_SIZE):
+            await model.insert_many(documents[start : start + BATCH_SIZE])
+    return state
+
+
+# ------------------------- WORKLOAD ------------------------- #
+
+
+class Workload:
+    def __init__(self, client, state: State, searchTerms: list[str]):
+        self.client = client
+        self.state = state
+        self.searchTerms = searchTerms
+
+    @staticmethod
+    def auth(user: dict) -> dict:
+        return {"Authorization": f"Bearer {user['token']}"}
+
+    async def login(self, user):
+        form = {"username": user["email"], "password": PASSWORD}
+        return await self.client.post("/users/token", data=form), ()
+
+    async def games(self, user):
+        params = {"limit": 25, "sort": random.choice(["_id", "name"])}
+        return await self.client.get("/games", params=params), ()
+
+    async def search(self, user):
+        term = random.choice(self.searchTerms)
+        url = f"/games/search/{term}"
+        return await self.client.get(url, headers=self.auth(user)), ()
+
+    async def library(self, user):
+        return await self.client.get("/users/library", headers=self.auth(user)), ()
+
+    async def myTrades(self, user):
+        return await self.client.get("/trades/myTrades", headers=self.auth(user)), ()
+
+    async def tradeRequest(self, user):
+        receiver = random.choice(self.state.users)
+        offered = self.state.libraries[user["id"]]
+        wanted = self.state.libraries[receiver["id"]]
+        if receiver is user or not offered or not wanted:
+            return None, ()
+        give, get = random.choice(offered), random.choice(wanted)
+        body = {
+            "offererMessage": "load test",
+            "offererGames": [{"id": give}],
+            "receiverGames": [{"id": get}],
+        }
+        response = await self.client.post(
+            f"/trades/request/{receiver['id']}", json=body, headers=self.auth(user)
+        )
+        if response.status_code == 201:
+            self.state.pending[receiver["id"]].append(
+                {
+                    "id": response.json()["_id"],
+                    "offerer": user["id"],
+                    "give": give,
+                    "get": get,
+                }
+            )
+        # the local view of the libraries can be behind a concurrent accept
+        return response, (400,)
+
+    async def tradeAccept(self, user):
+        pending = self.state.pending[user["id"]]
+        if not pending:
+            return None, ()
+        trade = pending.pop(random.randrange(len(pending)))
+        response = await self.client.post(
+            f"/trades/accept/{trade['id']}", headers=self.auth(user)
+        )
+        if response.status_code == 200:
+            libraries = self.state.libraries
+            libraries[trade["offerer"]].remove(trade["give"])
+            libraries[user["id"]].remove(trade["get"])
+            libraries[user["id"]].append(trade["give"])
+            libraries[trade["offerer"]].append(trade["get"])
+        # games already moved by an earlier accept
+        return response, (409,)
+
+
+async def drive(workload: Workload, requests: int, concurrency: int):
+    operations = list(WORKLOAD)
+    weights = [WORKLOAD[operation] for operation in operations]
+    timings = defaultdict(list)
+    outcomes = defaultdict(lambda: defaultdict(int))
+    remaining = [requests]
+
+    async def worker():
+        while remaining[0] > 0:
+            operation = random.choices(operations, weights)[0]
+            user = random.choice(workload.state.users)
+            start = time.perf_counter()
+            response, expected = await getattr(workload, operation)(user)
+            if response is None:
+                continue  # nothing to do for this user, draw again
+            remaining[0] -= 1
+            timings[operation].append((time.perf_counter() - start) * 1000)
+            if response.status_code < 400:
+                outcomes[operation]["ok"] += 1
+            elif response.status_code in expected:
+                outcomes[operation]["conflicts"] += 1
+            else:
+                outcomes[operation]["errors"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return timings, outcomes, time.perf_counter() - start
+
+
+def summarize(timings: list[float], elapsed: float) -> dict:
+    if len(timings) < 2:
+        timings = timings * 2 or [0.0, 0.0]
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "requests": len(timings),
+        "throughput": round(len(timings) / elapsed, 2),
+        "mean": round(statistics.mean(timings), 3),
+        "p50": round(cuts[49], 3),
+        "p95": round(cuts[94], 3),
+        "p99": round(cuts[98], 3),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    import httpx
+    import main
+    from benchmarks.searchBenchmark import SEARCH_TERMS
+
+    operations = dict(WORKLOAD)
+    skipped = {}
+    if args.backend == "mongomock":
+        WORKLOAD.pop("search")
+        skipped["search"] = "mongomock doesn't implement $text"
+
+    await main.app.router.startup()
+    try:
+        seedStart = time.perf_counter()
+        state = await seed(args.users, args.games, args.library, args.trades)
+        seedSeconds = time.perf_counter() - seedStart
+        client = httpx.AsyncClient(app=main.app, base_url="http://loadtest")
+        async with client:
+            workload = Workload(client, state, SEARCH_TERMS)
+            timings, outcomes, elapsed = await drive(
+                workload, args.requests, args.concurrency
+            )
+    finally:
+        await main.app.router.shutdown()
+
+    everything = [timing for values in timings.values() for timing in values]
+    return {
+        "commit": git_commit(),
+        "time": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "backend": args.backend,
+            "users": args.users,
+            "games": args.games,
+            "library": args.library,
+            "trades": args.trades,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "bcryptRounds": args.bcrypt_rounds,
+            "seed": args.seed,
+            "workload": operations,
+        },
+        "skipped": skipped,
+        "seedSeconds": round(seedSeconds, 2),
+        "seconds": round(elapsed, 2),
+        "total": summarize(everything, elapsed),
+        "operations": {
+            operation: {**summarize(values, elapsed), **outcomes[operation]}
+            for operation, values in sorted(timings.items())
+        },
+    }
+
+
+# ------------------------- REPORTING ------------------------- #
+
+
+def print_results(results: dict):
+    print(
+        f"{results['config']['requests']} requests in {results['seconds']}s "
+        f"against {results['config']['backend']} (commit {results['commit']})"
+    )
+    print(
+        f"{'operation':<14}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        "  outcomes"
+    )
+    rows = list(results["operations"].items()) + [("total", results["total"])]
+    for operation, stats in rows:
+        outcomes = {
+            key: stats[key] for key in ("ok", "conflicts", "errors") if key in stats
+        }
+        print(
+            f"{operation:<14}{stats['throughput']:>9}{stats['p50']:>9}"
+            f"{stats['p95']:>9}{stats['p99']:>9}  {outcomes}"
+        )
+    for operation, reason in results["skipped"].items():
+        print(f"{operation} skipped, {reason}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Operations that got slower than the tolerance allows"""
+    regressions = []
+    print(f"compared with {baseline['commit']} ({baseline['time']})")
+    rows = [*results["operations"].items(), ("total", results["total"])]
+    for operation, stats in rows:
+        before = baseline["operations"].get(operation) or (
+            baseline["total"] if operation == "total" else None
+        )
+        if before is None:
+            continue
+        p95Change = (stats["p95"] - before["p95"]) / (before["p95"] or 1)
+        throughputChange = (stats["throughput"] - before["throughput"]) / (
+            before["throughput"] or 1
+        )
+        print(f"{operation:<14} p95 {p95Change:+7.1%}   req/s {throughputChange:+7.1%}")
+        if p95Change > tolerance or throughputChange < -tolerance:
+            regressions.append(operation)
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend", choices=["mongomock", "mongod"], default="mongomock"
+    )
+    parser.add_argument("--mongod", default="mongod", help="mongod binary to start")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--library", type=int, default=10, help="games per user")
+    parser.add_argument("--trades", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--bcrypt-rounds",
+        type=int,
+        default=4,
+        help="cost used for the login operation, 12 in production",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="json file, benchmarks/results/ by default")
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    mongod = None
+    uri = "mongodb://loadtest"  # mongomock ignores it
+    if args.backend == "mongod":
+        mongod = start_mongod(args.mongod)
+        uri = mongod[1]
+    configure(args.backend, uri, args.bcrypt_rounds)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if mongod is not None:
+            mongod[0].terminate()
+            mongod[0].wait()
+            shutil.rmtree(mongod[2], ignore_errors=True)
+
+    print_results(results)
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"loadTest-{results['commit']}-{args.backend}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,100 @@
+"""
+Measures what the metrics cost on the hot path, needs no database.
+
+Calls a one route FastAPI app directly through ASGI with and without the
+metrics middleware, then times the Mongo command listener on its own:
+
+    python -m benchmarks.metricsOverhead --requests 20000
+"""
+from fastapi import FastAPI
+from services.metricsService import MetricsMiddleware, commandMetrics
+from types import SimpleNamespace
+import argparse
+import asyncio
+import time
+
+
+def build_app(withMetrics: bool) -> FastAPI:
+    app = FastAPI()
+    if withMetrics:
+        app.add_middleware(MetricsMiddleware)
+
+    @app.get("/games/{game_id}")
+    async def get_game(game_id: str):
+        return {"id": game_id}
+
+    return app
+
+
+async def call(app, path: str):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "server": ("bench", 80),
+        "client": ("bench", 1234),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure_requests(app, requests: int) -> float:
+    """Microseconds per request"""
+    for index in range(1000):  # warm up, builds the middleware stack
+        await call(app, f"/games/{index}")
+    start = time.perf_counter()
+    for index in range(requests):
+        await call(app, f"/games/{index}")
+    return (time.perf_counter() - start) / requests * 1_000_000
+
+
+def measure_listener(commands: int) -> float:
+    """Microseconds per started + succeeded pair"""
+    connection = ("mongodb", 27017)
+    started = [
+        SimpleNamespace(
+            command_name="find",
+            command={"find": "Games"},
+            connection_id=connection,
+            request_id=index,
+        )
+        for index in range(commands)
+    ]
+    succeeded = [
+        SimpleNamespace(duration_micros=800, connection_id=connection, request_id=index)
+        for index in range(commands)
+    ]
+    start = time.perf_counter()
+    for startedEvent, succeededEvent in zip(started, succeeded):
+        commandMetrics.started(startedEvent)
+        commandMetrics.succeeded(succeededEvent)
+    return (time.perf_counter() - start) / commands * 1_000_000
+
+
+async def main(requests: int):
+    plain = await measure_requests(build_app(False), requests)
+    measured = await measure_requests(build_app(True), requests)
+    print(f"request without metrics {plain:8.2f} us")
+    print(f"request with metrics    {measured:8.2f} us")
+    print(f"middleware overhead     {measured - plain:8.2f} us per request")
+    print(f"command listener        {measure_listener(requests):8.2f} us per command")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
@@ -0,0 +1,97 @@
+"""
+Compares the text index search with the old four $regex scans.
+
+Run from the api directory against a throwaway database:
+
+    python -m benchmarks.searchBenchmark --sizes 10000 100000 1000000
+
+Every size reseeds the RetroGamesBench database on MONGO_URI.
+"""
+from beanie import init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient
+from decouple import config
+from models.gameModel import GameAbstract, Tags
+from services import searchService
+import argparse
+import asyncio
+import datetime
+import random
+import statistics
+import time
+
+SEARCH_TERMS = ["mario", "Nintendo", "RPG", "SNES", "zelda", "Pokémon", "sega"]
+WORDS = ["super", "mario", "zelda", "sonic", "pokémon", "metroid", "castle", "quest",
+         "dragon", "kart", "fantasy", "street", "fighter", "mega", "man", "star", "fox"]
+PUBLISHERS = ["Nintendo", "Sega", "Capcom", "Konami", "Square", "Namco", "Atari"]
+PLATFORMS = ["NES", "SNES", "N64", "Genesis", "Game Boy", "PS1", "Saturn", "Atari 2600"]
+BATCH_SIZE = 10_000
+
+
+def fake_game(index: int) -> dict:
+    return {
+        "name": " ".join(random.sample(WORDS, 3)) + f" {index}",
+        "publisher": random.choice(PUBLISHERS),
+        "release_date": datetime.date(
+            random.randint(1975, 2005), random.randint(1, 12), 1
+        ).isoformat(),
+        "platforms": random.sample(PLATFORMS, 2),
+        "tags": [tag.value for tag in random.sample(list(Tags), 3)],
+    }
+
+
+async def seed(size: int):
+    collection = GameAbstract.get_motor_collection()
+    await collection.delete_many({})
+    for start in range(0, size, BATCH_SIZE):
+        await collection.insert_many(
+            [fake_game(index) for index in range(start, min(start + BATCH_SIZE, size))]
+        )
+
+
+async def legacy_search(search_term: str):
+    """The implementation the text index replaced"""
+    results = []
+    for field in ["name", "tags", "platforms", "publisher"]:
+        results.append(
+            await GameAbstract.find({field: {"$regex": search_term}})
+            .limit(25)
+            .to_list()
+        )
+    return results
+
+
+async def measure(search, rounds: int) -> list[float]:
+    timings = []
+    for _ in range(rounds):
+        for term in SEARCH_TERMS:
+            start = time.perf_counter()
+            await search(term)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def describe(timings: list[float]) -> str:
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    return f"mean {statistics.mean(timings):8.2f} ms   p95 {p95:8.2f} ms"
+
+
+async def main(sizes: list[int], rounds: int):
+    client = AsyncIOMotorClient(config("MONGO_URI"))
+    await init_beanie(database=client.RetroGamesBench, document_models=[GameAbstract])
+    for size in sizes:
+        print(f"seeding {size} games...")
+        await seed(size)
+        legacy = await measure(legacy_search, rounds)
+        indexed = await measure(searchService.search_games, rounds)
+        print(f"{size:>9} games  legacy  {describe(legacy)}")
+        print(f"{size:>9} games  indexed {describe(indexed)}")
+    await client.RetroGamesBench.Games.drop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.rounds))
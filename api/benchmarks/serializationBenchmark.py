@@ -0,0 +1,113 @@
+"""
+Cost of turning 1000 documents into a json page, the way handlers used to do
+it (copy the model, let FastAPI validate it against the response_model, run
+jsonable_encoder and json.dumps) against the FastJSONResponse path. Needs no
+database server, beanie is initialised on mongomock (benchmarks/requirements.txt):
+
+    python -m benchmarks.serializationBenchmark --rounds 20
+"""
+from beanie import PydanticObjectId, init_beanie
+from mongomock_motor import AsyncMongoMockClient
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from models.userModel import User, UserOut, Address
+from models.gameModel import GameAbstract, OwnedGame, OwnedGameOut
+from models.pageModel import Page
+from services.responseService import FastJSONResponse, output
+from benchmarks.searchBenchmark import fake_game
+import argparse
+import asyncio
+import statistics
+import time
+
+DOCUMENTS = 1000
+
+
+def users() -> list[User]:
+    return [
+        User(
+            id=PydanticObjectId(),
+            username=f"gamer{index}",
+            email=f"gamer{index}@retro.games",
+            password="$2b$12$" + "x" * 53,
+            street_address=Address(
+                street="1234 Main",
+                city="Anytown",
+                state="CA",
+                zipcode="12345",
+                country="USA",
+            ),
+            tradeHistory=[PydanticObjectId()],
+        )
+        for index in range(DOCUMENTS)
+    ]
+
+
+def games() -> list[GameAbstract]:
+    return [
+        GameAbstract(id=PydanticObjectId(), **fake_game(index))
+        for index in range(DOCUMENTS)
+    ]
+
+
+def owned_games() -> list[OwnedGame]:
+    owner = PydanticObjectId()
+    return [
+        OwnedGame(
+            id=PydanticObjectId(),
+            game=PydanticObjectId(),
+            name="Super Mario Bros",
+            condition="good",
+            owner=owner,
+            ownerHistory=[owner],
+        )
+        for _ in range(DOCUMENTS)
+    ]
+
+
+async def before(documents, outModel) -> bytes:
+    items = [outModel(**document.dict()) for document in documents]
+    page = Page[outModel](items=items, count=len(items), next=None)
+    field = create_response_field(name="Response", type_=Page[outModel])
+    content = await serialize_response(field=field, response_content=page)
+    return JSONResponse(content).body
+
+
+async def after(documents, outModel) -> bytes:
+    items = [output(outModel, document) for document in documents]
+    page = Page[outModel].construct(items=items, count=len(items), next=None)
+    return FastJSONResponse(page).body
+
+
+async def measure(function, documents, outModel, rounds: int) -> float:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await function(documents, outModel)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def main(rounds: int):
+    await init_beanie(
+        database=AsyncMongoMockClient().RetroGamesBench,
+        document_models=[User, GameAbstract, OwnedGame],
+    )
+    cases = [
+        ("users", users(), UserOut),
+        ("games", games(), GameAbstract),
+        ("library", owned_games(), OwnedGameOut),
+    ]
+    print(f"median ms per {DOCUMENTS} documents")
+    for name, documents, outModel in cases:
+        old = await measure(before, documents, outModel, rounds)
+        new = await measure(after, documents, outModel, rounds)
+        print(f"{name:<8} before {old:8.2f}   after {new:8.2f}   {old / new:5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds))
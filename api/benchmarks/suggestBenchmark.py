@@ -0,0 +1,75 @@
+"""
+Time per /games/suggest lookup on the in-memory prefix index, needs no
+database. Queries are the prefixes a user types, one keystroke at a time.
+Cold lookups compute the ranking of the prefix, warm ones reuse it, and the
+cost of adding a game to a warm index is measured last:
+
+    python -m benchmarks.suggestBenchmark --sizes 10000 100000
+"""
+from beanie import PydanticObjectId
+from types import SimpleNamespace
+from services.suggestService import SuggestIndex
+from benchmarks.searchBenchmark import fake_game, WORDS, PUBLISHERS
+import argparse
+import random
+import statistics
+import time
+
+ADDED_GAMES = 200
+
+
+def build(size: int) -> tuple[SuggestIndex, float]:
+    index = SuggestIndex()
+    games = {}
+    for number in range(size):
+        game = fake_game(number)
+        games[str(PydanticObjectId())] = (game["name"], game["publisher"])
+    index.copies = {gameId: random.randint(0, 50) for gameId in games}
+    start = time.perf_counter()
+    index.load(games)
+    return index, time.perf_counter() - start
+
+
+def lookups(index: SuggestIndex) -> list[float]:
+    """Microseconds per lookup"""
+    timings = []
+    for word in WORDS + PUBLISHERS:
+        for length in range(1, len(word) + 1):
+            start = time.perf_counter()
+            index.suggest(word[:length], 10)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+    return sorted(timings)
+
+
+def additions(index: SuggestIndex) -> float:
+    """Microseconds per game added"""
+    games = [
+        SimpleNamespace(id=PydanticObjectId(), **fake_game(number))
+        for number in range(ADDED_GAMES)
+    ]
+    start = time.perf_counter()
+    for game in games:
+        index.add(game)
+    return (time.perf_counter() - start) / len(games) * 1_000_000
+
+
+def summary(timings: list[float]) -> str:
+    p99 = timings[int(len(timings) * 0.99)]
+    return f"p50 {statistics.median(timings):8.1f} us  p99 {p99:8.1f} us"
+
+
+def main(sizes: list[int]):
+    for size in sizes:
+        index, seconds = build(size)
+        print(f"{size} games, index built in {seconds:.2f}s")
+        print(f"  cold lookup  {summary(lookups(index))}")
+        print(f"  warm lookup  {summary(lookups(index))}")
+        print(f"  add a game   {additions(index):8.1f} us")
+        print(f"  after adds   {summary(lookups(index))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+    main(args.sizes)
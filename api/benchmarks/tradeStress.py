@@ -0,0 +1,149 @@
+"""
+Fires hundreds of simultaneous accepts and declines at overlapping trades and
+checks that no game was lost, duplicated or left half transferred.
+
+Run from the api directory against a throwaway database:
+
+    python -m benchmarks.tradeStress --users 50 --games 4 --trades 500
+
+Use --processes 2 to race two processes, like the two API replicas do.
+"""
+from beanie import init_beanie, PydanticObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from decouple import config
+from fastapi import HTTPException
+from collections import Counter
+from models.gameModel import OwnedGame, OwnedGameOut
+from models.tradeModel import TradeOffer, TradeStatus
+from services import tradeService
+import argparse
+import asyncio
+import multiprocessing
+import random
+import time
+
+
+async def connect():
+    client = AsyncIOMotorClient(config("MONGO_URI"))
+    await init_beanie(
+        database=client.RetroGamesBench, document_models=[OwnedGame, TradeOffer]
+    )
+    return client
+
+
+async def seed(users: int, gamesPerUser: int, trades: int) -> list[PydanticObjectId]:
+    await OwnedGame.delete_all()
+    await TradeOffer.delete_all()
+    userIDs = [PydanticObjectId() for _ in range(users)]
+    library = {userID: [] for userID in userIDs}
+    for userID in userIDs:
+        for _ in range(gamesPerUser):
+            game = OwnedGame(
+                id=PydanticObjectId(),
+                game=PydanticObjectId(),
+                name="Stress Test",
+                condition="Good",
+                owner=userID,
+                ownerHistory=[userID],
+            )
+            library[userID].append(OwnedGameOut(**game.dict()))
+            await game.insert()
+    # trades are drawn from the initial libraries so many of them overlap
+    tradeIDs = []
+    for _ in range(trades):
+        offerer, receiver = random.sample(userIDs, 2)
+        offer = await TradeOffer(
+            id=PydanticObjectId(),
+            offerer=offerer,
+            receiver=receiver,
+            offererMessage="stress",
+            offererGames=random.sample(library[offerer], 2),
+            receiverGames=random.sample(library[receiver], 1),
+        ).create()
+        tradeIDs.append(offer.id)
+    return tradeIDs
+
+
+async def settle(tradeIDs: list[PydanticObjectId]) -> Counter:
+    outcomes = Counter()
+
+    async def one(tradeID):
+        trade = await TradeOffer.get(tradeID)
+        try:
+            if random.random() < 0.8:
+                await tradeService.accept_trade(tradeID, trade.receiver)
+                outcomes["accepted"] += 1
+            else:
+                await tradeService.decline_trade(tradeID, trade.receiver)
+                outcomes["declined"] += 1
+        except HTTPException as exception:
+            outcomes[f"rejected {exception.status_code}"] += 1
+
+    await asyncio.gather(*(one(tradeID) for tradeID in tradeIDs))
+    return outcomes
+
+
+def settle_in_process(tradeIDs):
+    async def run():
+        client = await connect()
+        outcomes = await settle(tradeIDs)
+        client.close()
+        return outcomes
+
+    return asyncio.run(run())
+
+
+async def verify(totalGames: int) -> list[str]:
+    problems = []
+    games = await OwnedGame.find_all().to_list()
+    if len(games) != totalGames:
+        problems.append(f"expected {totalGames} games, found {len(games)}")
+    moves = Counter()
+    async for trade in TradeOffer.find(TradeOffer.status == TradeStatus.accepted):
+        for game in trade.offererGames + trade.receiverGames:
+            moves[game.id] += 1
+    for game in games:
+        if game.tradeLock is not None:
+            problems.append(f"game {game.id} is still locked by {game.tradeLock}")
+        if game.ownerHistory[-1] != game.owner:
+            problems.append(f"game {game.id} owner doesn't match its history")
+        if len(game.ownerHistory) - 1 != moves[game.id]:
+            problems.append(
+                f"game {game.id} moved {len(game.ownerHistory) - 1} times "
+                f"but is in {moves[game.id]} accepted trades"
+            )
+    if await TradeOffer.find({"settlingSince": {"$ne": None}}).count():
+        problems.append("some trades were left settling")
+    return problems
+
+
+async def main(users: int, gamesPerUser: int, trades: int, processes: int):
+    client = await connect()
+    tradeIDs = await seed(users, gamesPerUser, trades)
+    start = time.perf_counter()
+    if processes == 1:
+        outcomes = await settle(tradeIDs)
+    else:
+        # every process races on every trade
+        with multiprocessing.Pool(processes) as pool:
+            outcomes = sum(pool.map(settle_in_process, [tradeIDs] * processes), Counter())
+    elapsed = time.perf_counter() - start
+    print(f"{sum(outcomes.values())} settle calls in {elapsed:.2f}s: {dict(outcomes)}")
+    problems = await verify(users * gamesPerUser)
+    for problem in problems:
+        print(problem)
+    print("FAILED" if problems else "OK, no game lost or duplicated")
+    await client.RetroGamesBench.OwnedGames.drop()
+    await client.RetroGamesBench.Trades.drop()
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--games", type=int, default=4, help="games per user")
+    parser.add_argument("--trades", type=int, default=500)
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.games, args.trades, args.processes))
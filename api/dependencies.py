@@ -1,12 +1,34 @@
 from fastapi.security import OAuth2PasswordBearer
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from pydantic import BaseModel
 from beanie import PydanticObjectId
-from datetime import datetime, timedelta
-from typing import Optional
+from beanie.odm.enums import SortDirection
+from beanie.odm.queries.find import FindMany
+from datetime import date, datetime, timedelta
+from typing import Any, Optional
+from enum import Enum
 from decouple import config
 from jose import jwt, JWTError
 from models.userModel import User
+from models.gameModel import GameAbstract
+from models.pageModel import SortOrder
+from services.cacheService import (
+    userCache,
+    user_generation,
+    cache_user,
+    gameCache,
+    render_json,
+)
+from services.linkService import generate_url
+from services.expandService import Expander
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+SECRET_KEY = config("SECRET_KEY")
+ALGORITHM = config("ALGORITHM")
 
 oath2_scheme = OAuth2PasswordBearer(tokenUrl="/users/token")
 
@@ -27,21 +49,79 @@ async def get_current_user(token: str = Depends(oath2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(
-            token, config("SECRET_KEY"), algorithms=[config("ALGORITHM")]
-        )
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = await User.find_one(User.email == token_data.email)
+    user = await get_user_by_email(token_data.email)
     if user is None:
         raise credentials_exception
     return user
 
 
+async def get_current_admin(user: User = Depends(get_current_user)):
+    if not user.isAdmin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="This endpoint is only available to admins",
+        )
+    return user
+
+
+# Cached lookups, the returned users are copies that may be stale, so write
+# only the changed fields with user.set(...), a full save() would overwrite
+# concurrent updates like trade history entries
+async def get_user(id: PydanticObjectId) -> Optional[User]:
+    user = userCache.get(("id", str(id)))
+    if user is None:
+        generation = user_generation()
+        user = await User.get(id)
+        if user is None:
+            return None
+        cache_user(user, generation)
+    return user.copy(deep=True)
+
+
+async def get_game_entry(id: PydanticObjectId) -> Optional[tuple]:
+    """Cached (game, etag, rendered json) of a game, None if it doesn't exist"""
+    entry = gameCache.get(("game", str(id)))
+    if entry is None:
+        game = await GameAbstract.get(id)
+        if game is None:
+            return None
+        entry = (game, *render_json(game))
+        gameCache.set(("game", str(id)), entry)
+    return entry
+
+
+async def get_game(id: PydanticObjectId) -> Optional[GameAbstract]:
+    entry = await get_game_entry(id)
+    return entry[0].copy(deep=True) if entry is not None else None
+
+
+async def warm_game_cache(count: int):
+    async for game in GameAbstract.find_all().limit(count):
+        gameCache.set(("game", str(game.id)), (game, *render_json(game)))
+
+
+async def get_user_by_email(email: str) -> Optional[User]:
+    userId = userCache.get(("email", email))
+    if userId is not None:
+        user = await get_user(PydanticObjectId(userId))
+        if user is not None and user.email == email:
+            return user
+        userCache.invalidate(("email", email))  # the user was deleted
+    generation = user_generation()
+    user = await User.find_one(User.email == email)
+    if user is None:
+        return None
+    cache_user(user, generation)
+    return user.copy(deep=True)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -49,12 +129,114 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(
-        to_encode, config("SECRET_KEY"), algorithm=config("ALGORITHM")
-    )
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
-def generate_url(resource: str, id: PydanticObjectId):
-    urlStart = "http://127.0.0.1:8000"
-    return f"{urlStart}/{resource}/{id}"
+def expand_params(*allowed: str):
+    """Dependency reading ?expand=, only the given references can be expanded"""
+
+    def dependency(
+        expand: Optional[str] = Query(
+            None,
+            description="Comma separated references to inline in the response "
+            f"instead of their link: {', '.join(allowed)}",
+        )
+    ) -> Expander:
+        fields = {field.strip() for field in (expand or "").split(",")} - {""}
+        unknown = fields - set(allowed)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Can't expand {', '.join(sorted(unknown))}",
+            )
+        return Expander(fields)
+
+    return dependency
+
+
+# ------------------------- PAGINATION ------------------------- #
+
+
+class PageParams:
+    """Query parameters shared by every keyset paginated listing"""
+
+    def __init__(
+        self,
+        after: Optional[str] = Query(
+            None, description="Opaque cursor taken from the `next` link of a page"
+        ),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    ):
+        self.after = after
+        self.limit = limit
+
+
+def encode_cursor(value: Any, id: PydanticObjectId) -> str:
+    # dates are stored as ISO strings (see the bson_encoders on the models),
+    # datetimes are stored natively so they need to be tagged to survive json
+    if isinstance(value, datetime):
+        payload = {"v": value.isoformat(), "t": "datetime"}
+    elif isinstance(value, date):
+        payload = {"v": value.isoformat()}
+    elif isinstance(value, Enum):
+        payload = {"v": value.value}
+    else:
+        payload = {"v": value}
+    payload["id"] = str(id)
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[Any, PydanticObjectId]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+        value = payload["v"]
+        if payload.get("t") == "datetime":
+            value = datetime.fromisoformat(value)
+        return value, PydanticObjectId(payload["id"])
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor",
+        )
+
+
+def keyset_filter(sortField: str, order: SortOrder, cursor: str) -> dict:
+    """Mongo filter selecting every document that sorts after the cursor"""
+    value, id = decode_cursor(cursor)
+    operator = "$gt" if order == SortOrder.asc else "$lt"
+    if sortField == "_id":
+        return {"_id": {operator: id}}
+    return {
+        "$or": [
+            {sortField: {operator: value}},
+            {sortField: value, "_id": {operator: id}},
+        ]
+    }
+
+
+async def paginate(
+    query: FindMany, page: PageParams, sortField: str = "_id", order=SortOrder.asc
+):
+    """
+    Runs a keyset paginated query, returns the page of documents and the cursor
+    of the next page (None when there are no more documents)
+    """
+    if page.after is not None:
+        query = query.find(keyset_filter(sortField, order, page.after))
+    direction = (
+        SortDirection.ASCENDING if order == SortOrder.asc else SortDirection.DESCENDING
+    )
+    sort = [(sortField, direction)]
+    if sortField != "_id":
+        sort.append(("_id", direction))  # tie breaker, keeps the order total
+    # fetch one extra document to know whether there is a next page
+    documents = await query.sort(sort).limit(page.limit + 1).to_list()
+    nextCursor = None
+    if len(documents) > page.limit:
+        documents = documents[: page.limit]
+        last = documents[-1]
+        # the id is already part of every cursor
+        value = None if sortField == "_id" else getattr(last, sortField)
+        nextCursor = encode_cursor(value, last.id)
+    return documents, nextCursor
@@ -1,27 +1,95 @@
 from fastapi import FastAPI, Depends
 from beanie import init_beanie
-from motor.motor_asyncio import AsyncIOMotorClient
-from routers import usersRouter, gamesRouter, tradesRouter
-from models.userModel import User
-from models.gameModel import GameAbstract, OwnedGame
-from models.tradeModel import TradeOffer
+from routers import usersRouter, libraryRouter, wishlistRouter
+from routers import gamesRouter, tradesRouter
+from routers import healthRouter, metricsRouter
+from services.passwordService import passwordHasher
+from services.migrationService import run_once, migrate_embedded_libraries
+from services.migrationService import migrate_references, drop_cycle_key_index
+from services.tradeService import recover_stalled_trades, tradeRecovery
+from services.indexService import verify_indexes
+from dependencies import warm_game_cache
+from services.invalidationBus import invalidationBus, MongoTransport, MemoryTransport
+from services.databaseService import create_client, warm_up, DOCUMENT_MODELS
+from services.metricsService import MetricsMiddleware
+from services.linkService import BaseUrlMiddleware
+from services.rateLimitService import AdmissionMiddleware, admissionControl
+from services.rateLimitService import MongoBucketStore, MemoryBucketStore
+from services.suggestService import suggestIndex
+from services.matchService import tradeGraph
+from services.jobService import jobQueue
+from services.lifecycleService import tradeSweeper
+from services.responseService import FastJSONResponse
 from decouple import config
 
-app = FastAPI()
+# handlers return FastJSONResponse themselves, this covers the few that don't
+app = FastAPI(default_response_class=FastJSONResponse)
+app.status = "starting"  # reported by /healthz and /readyz
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(BaseUrlMiddleware)
+app.add_middleware(MetricsMiddleware)
 
+# the library and wishlist routes have to be matched before /users/{userID}
+app.include_router(libraryRouter.router)
+app.include_router(wishlistRouter.router)
 app.include_router(usersRouter.router)
 app.include_router(gamesRouter.router)
 app.include_router(tradesRouter.router)
+app.include_router(healthRouter.router)
+app.include_router(metricsRouter.router)
 
 
 @app.on_event("startup")
 async def app_init():
     """Initialize application services"""
-    app.databaseClient = AsyncIOMotorClient(config("MONGO_URI"))
+    app.databaseClient = create_client()
+    await warm_up(app.databaseClient)
     await init_beanie(
-        database=app.databaseClient.RetroGames,
-        document_models=[User, GameAbstract, TradeOffer],
+        database=app.databaseClient.RetroGames, document_models=DOCUMENT_MODELS
     )
+    # init_beanie creates the indexes declared on the models, refuse to serve
+    # requests if a hot query would still scan a whole collection
+    if config("INDEX_CHECK", default=True, cast=bool):
+        await verify_indexes()
+    await run_once("embedded_libraries", migrate_embedded_libraries)
+    await run_once("references", migrate_references)
+    await run_once("cycle_key_index", drop_cycle_key_index)
+    await recover_stalled_trades()
+    # "memory" keeps invalidations inside this process, for a single replica
+    if config("INVALIDATION_TRANSPORT", default="mongo") == "mongo":
+        await invalidationBus.start(MongoTransport(app.databaseClient.RetroGames))
+    else:
+        await invalidationBus.start(MemoryTransport())
+    # "mongo" shares the rate limits between replicas, "off" disables them
+    rateLimitStore = config("RATE_LIMIT_STORE", default="memory")
+    if rateLimitStore == "mongo":
+        await admissionControl.start(MongoBucketStore(app.databaseClient.RetroGames))
+    elif rateLimitStore == "memory":
+        await admissionControl.start(MemoryBucketStore())
+    await jobQueue.start()
+    await warm_game_cache(config("GAME_CACHE_WARM", default=1000, cast=int))
+    await suggestIndex.start()
+    await tradeGraph.start()
+    await tradeSweeper.start()
+    await tradeRecovery.start()
+    app.status = "ok"
+
+
+@app.on_event("shutdown")
+async def app_shutdown():
+    """Release application services"""
+    # uvicorn has already stopped accepting requests and waited for the ones
+    # in flight, /readyz answers 503 from here on
+    app.status = "stopping"
+    await tradeSweeper.stop()
+    await tradeRecovery.stop()
+    await jobQueue.stop()
+    await invalidationBus.stop()
+    await admissionControl.stop()
+    await suggestIndex.stop()
+    await tradeGraph.stop()
+    passwordHasher.shutdown()
+    app.databaseClient.close()
 
 
 if __name__ == "__main__":
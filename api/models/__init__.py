@@ -8,5 +8,7 @@ class Tags(Enum):
     Games = "Games"
     Trades = "Trades"
     Library = "Library"
+    Wishlist = "Wishlist"
     Auth = "Auth"
     Test = "Test"
+    Health = "Health"
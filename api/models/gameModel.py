@@ -1,8 +1,12 @@
 import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from pymongo import IndexModel, ASCENDING, TEXT
 from typing import Optional
-from beanie import PydanticObjectId, Document
+from beanie import PydanticObjectId, Document, after_event
+from beanie import Insert, Replace, SaveChanges, Update, Delete
 from enum import Enum
+from services.invalidationBus import invalidationBus
+from .referenceModel import GameRef, UserRef
 
 
 class Tags(Enum):
@@ -78,15 +82,92 @@ class GameAbstract(Document):
         bson_encoders = {
             datetime.date: lambda v: v.isoformat(),  # Copilot gave me this and idk what its doing, ask a python expert
         }
+        indexes = [
+            # backs /games/search, language "none" turns off stemming and
+            # stop words so game titles are matched token for token
+            IndexModel(
+                [
+                    ("name", TEXT),
+                    ("publisher", TEXT),
+                    ("tags", TEXT),
+                    ("platforms", TEXT),
+                ],
+                name="game_text_search",
+                weights={"name": 10, "publisher": 5, "tags": 3, "platforms": 3},
+                default_language="none",
+            ),
+            # GET /games filters and sort orders, _id is the pagination
+            # tie breaker so it closes every sortable index
+            IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="game_name"),
+            IndexModel(
+                [("publisher", ASCENDING), ("_id", ASCENDING)], name="game_publisher"
+            ),
+            IndexModel(
+                [("release_date", ASCENDING), ("_id", ASCENDING)],
+                name="game_release_date",
+            ),
+            IndexModel([("platforms", ASCENDING)], name="game_platforms"),
+            IndexModel([("tags", ASCENDING)], name="game_tags"),
+        ]
 
+    @after_event(Insert, Replace, SaveChanges, Update, Delete)
+    async def invalidate_cache(self):
+        await invalidationBus.publish("GameAbstract", self.id)
+
+
+class GameSortField(str, Enum):
+    """Fields GET /games can be sorted by"""
+
+    id = "_id"
+    name = "name"
+    publisher = "publisher"
+    release_date = "release_date"
+
+
+class OwnedGameIn(BaseModel):
+    """Owned game fields sent by the client"""
 
-class OwnedGame(BaseModel):
     id: Optional[PydanticObjectId]
-    game: Optional[str]  # link to the abstract version of the game
+    game: Optional[str]  # id of the abstract version of the game
     name: Optional[str]
     condition: Optional[str]
-    owner: Optional[str]  # link to the user who owns the game
-    ownerHistory: Optional[list[str]] = []  # list of users who have owned the game
+
+
+class OwnedGameOut(OwnedGameIn):
+    """Owned game fields returned to the client, also used for trade snapshots"""
+
+    game: Optional[GameRef]  # the abstract version of the game
+    owner: Optional[UserRef]  # the user who owns the game
+    ownerHistory: Optional[list[UserRef]] = []  # users who have owned the game
+
+
+class OwnedGameOutProjection(OwnedGameOut):
+    """OwnedGameOut read straight from Mongo with find().project()"""
+
+    id: PydanticObjectId = Field(alias="_id")
+
+
+class OwnedGame(Document, OwnedGameOut):
+    """Owned game DB representation, one document per copy"""
+
+    id: PydanticObjectId = Field(default_factory=PydanticObjectId)
+    # id of the trade currently moving this copy, see services/tradeService.py
+    tradeLock: Optional[PydanticObjectId] = Field(None, hidden=True)
+
+    class Settings:
+        name = "OwnedGames"
+        indexes = [
+            IndexModel(
+                [("owner", ASCENDING), ("_id", ASCENDING)], name="owner_library"
+            ),
+            # GET /games/{id}/owners, with and without the condition filter
+            IndexModel([("game", ASCENDING), ("_id", ASCENDING)], name="game_owners"),
+            IndexModel(
+                [("game", ASCENDING), ("condition", ASCENDING), ("_id", ASCENDING)],
+                name="game_condition_owners",
+            ),
+            IndexModel([("tradeLock", ASCENDING)], name="trade_lock"),
+        ]
 
 
 # I need hypermedia functionality
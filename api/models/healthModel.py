@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+class PoolStats(BaseModel):
+    open: int
+    checkedOut: int
+    waiting: int
+    checkoutFailures: int
+    maxPoolSize: int
+    minPoolSize: int
+    utilisation: float  # share of maxPoolSize checked out right now
+
+
+class HealthReport(BaseModel):
+    status: str  # "ok", "starting", "stopping" or "unavailable"
+    ready: bool
+    databaseLatencyMs: Optional[float]
+    databaseError: Optional[str]
+    pool: PoolStats
@@ -0,0 +1,45 @@
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+from beanie import PydanticObjectId, Document
+from decouple import config
+from datetime import datetime
+from typing import Optional
+from enum import Enum
+
+# finished jobs are dropped after this long, their key can then be used again
+RETENTION_SECONDS = config("JOB_RETENTION", default=7 * 24 * 3600, cast=int)
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"  # gave up after the last attempt
+
+
+class Job(Document):
+    """Background job, see services/jobService.py"""
+
+    id: PydanticObjectId = Field(default_factory=PydanticObjectId)
+    kind: str  # name of the handler
+    key: str  # a job is only enqueued once per key
+    payload: dict = {}
+    status: JobStatus = JobStatus.queued
+    attempts: int = 0
+    # when a queued job is due, when a running one is given to another worker
+    runAt: datetime = Field(default_factory=datetime.utcnow)
+    lastError: Optional[str] = None
+    createdAt: datetime = Field(default_factory=datetime.utcnow)
+    finishedAt: Optional[datetime] = None
+
+    class Settings:
+        name = "Jobs"
+        indexes = [
+            IndexModel([("key", ASCENDING)], name="job_key", unique=True),
+            IndexModel([("status", ASCENDING), ("runAt", ASCENDING)], name="job_due"),
+            IndexModel(
+                [("finishedAt", ASCENDING)],
+                name="job_retention",
+                expireAfterSeconds=RETENTION_SECONDS,
+            ),
+        ]
@@ -0,0 +1,54 @@
+from pydantic import BaseModel
+from beanie import PydanticObjectId
+from typing import Optional
+from enum import Enum
+
+
+class LibraryOperationType(str, Enum):
+    add = "add"
+    update = "update"
+    remove = "remove"
+
+
+class LibraryOperation(BaseModel):
+    """One change in a batch library request"""
+
+    op: LibraryOperationType
+    id: Optional[PydanticObjectId]  # owned copy to update or remove
+    game: Optional[PydanticObjectId]  # abstract game to add a copy of
+    condition: Optional[str]
+
+
+class LibraryOperationResult(BaseModel):
+    index: int  # position of the operation in the request
+    op: LibraryOperationType
+    status: int  # http status the same single operation would have returned
+    id: Optional[PydanticObjectId]
+    detail: Optional[str]
+
+
+class LibraryBatchSummary(BaseModel):
+    added: int = 0
+    updated: int = 0
+    removed: int = 0
+    failed: int = 0
+
+
+class LibraryBatchResult(BaseModel):
+    results: list[LibraryOperationResult]
+    summary: LibraryBatchSummary
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "results": [
+                    {
+                        "index": 0,
+                        "op": "add",
+                        "status": 201,
+                        "id": "63a1f0c2e4b0a1b2c3d4e5f6",
+                    }
+                ],
+                "summary": {"added": 1, "updated": 0, "removed": 0, "failed": 0},
+            }
+        }
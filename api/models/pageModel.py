@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+from pydantic.generics import GenericModel
+from beanie import PydanticObjectId
+from typing import Generic, Optional, TypeVar
+from enum import Enum
+
+T = TypeVar("T")
+
+
+class SortOrder(str, Enum):
+    asc = "asc"
+    desc = "desc"
+
+
+class Page(GenericModel, Generic[T]):
+    """A single page of a keyset paginated listing"""
+
+    items: list[T]
+    count: int
+    next: Optional[str] = None  # link to the following page, None on the last one
+
+
+class DeleteConfirmation(BaseModel):
+    """Returned by the delete endpoints instead of the remaining collection"""
+
+    id: PydanticObjectId
+    deleted: bool = True
+    collection: str  # link to the first page of what is left
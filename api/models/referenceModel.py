@@ -0,0 +1,44 @@
+from beanie import PydanticObjectId
+from typing import ClassVar
+
+
+class Reference(PydanticObjectId):
+    """
+    ObjectId of a document in another collection. Stored and queried as a
+    plain ObjectId, rendered as a link to the document in responses
+    (services/responseService.py).
+    """
+
+    resource: ClassVar[str]
+
+    @classmethod
+    def validate(cls, v):
+        # full links were stored before migrate_references, see
+        # services/migrationService.py
+        if isinstance(v, str) and "/" in v:
+            v = v.rstrip("/").rsplit("/", 1)[-1]
+        return cls(super().validate(v))
+
+    @classmethod
+    def __modify_schema__(cls, field_schema):
+        field_schema.update(
+            type="string",
+            format="uri",
+            example=f"http://127.0.0.1:8000/{cls.resource}/5eb7cf5a86d9755df3a6c593",
+        )
+
+
+class UserRef(Reference):
+    resource = "users"
+
+
+class GameRef(Reference):
+    resource = "games"
+
+
+class TradeRef(Reference):
+    resource = "trades"
+
+
+class CycleRef(Reference):
+    resource = "trades/cycles"
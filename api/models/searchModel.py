@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from models.gameModel import GameAbstract
+from models.referenceModel import GameRef
 
 
 class SearchResults(BaseModel):
@@ -8,3 +9,12 @@ class SearchResults(BaseModel):
     platformResults: list[GameAbstract]
     publisherResults: list[GameAbstract]
     total: int
+
+
+class GameSuggestion(BaseModel):
+    """Typeahead match, see services/suggestService.py"""
+
+    game: GameRef
+    name: str
+    publisher: str
+    copies: int  # owned copies, what suggestions are ranked by
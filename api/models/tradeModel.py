@@ -1,8 +1,10 @@
 from pydantic import BaseModel, Field
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from beanie import PydanticObjectId, Document
 from typing import Optional
 from enum import Enum
-from .gameModel import OwnedGame
+from .gameModel import OwnedGameIn, OwnedGameOut
+from .referenceModel import CycleRef, TradeRef, UserRef
 from datetime import datetime
 
 
@@ -10,21 +12,137 @@ class TradeStatus(str, Enum):
     pending = "pending"
     accepted = "accepted"
     declined = "declined"
+    expired = "expired"  # left pending for too long, see services/lifecycleService.py
+
+
+CLOSED_STATUSES = (TradeStatus.accepted, TradeStatus.declined, TradeStatus.expired)
+
+
+class TradeRole(str, Enum):
+    """Side of a trade the current user is on"""
+
+    offerer = "offerer"
+    receiver = "receiver"
 
 
 class TradeOfferIn(BaseModel):
     offererMessage: str
-    offererGames: list[OwnedGame]
-    receiverGames: list[OwnedGame]
+    offererGames: list[OwnedGameIn]
+    receiverGames: list[OwnedGameIn]
 
 
 # https://i.kym-cdn.com/entries/icons/original/000/036/928/cover1.jpg
 class TradeOffer(Document, TradeOfferIn):
     id: PydanticObjectId
+    offererGames: list[OwnedGameOut]  # snapshots of the games at request time
+    receiverGames: list[OwnedGameOut]
     status: TradeStatus = TradeStatus.pending
-    offerer: str
-    receiver: str
+    offerer: UserRef
+    receiver: UserRef
     timeOfRequest: datetime = Field(default_factory=datetime.utcnow)
+    # when it was accepted, declined or expired, unset on older closed trades
+    timeOfClosing: Optional[datetime] = None
+    # set while an accept is moving the games, see services/tradeService.py
+    settlingSince: Optional[datetime] = Field(None, hidden=True)
+    # legs of a trade cycle only settle together, see services/matchService.py
+    cycle: Optional[CycleRef] = None
 
     class Settings:
         name = "Trades"
+        indexes = [
+            # back the myTrades listings, newest first, optionally by status
+            IndexModel(
+                [
+                    ("offerer", ASCENDING),
+                    ("status", ASCENDING),
+                    ("timeOfRequest", DESCENDING),
+                ],
+                name="offerer_status_time",
+            ),
+            IndexModel(
+                [
+                    ("receiver", ASCENDING),
+                    ("status", ASCENDING),
+                    ("timeOfRequest", DESCENDING),
+                ],
+                name="receiver_status_time",
+            ),
+            # startup recovery of interrupted accepts
+            IndexModel([("settlingSince", ASCENDING)], name="trade_settling"),
+            IndexModel([("cycle", ASCENDING)], name="trade_cycle"),
+            # expiry of old pending trades and archival of old closed ones
+            IndexModel(
+                [
+                    ("status", ASCENDING),
+                    ("timeOfClosing", ASCENDING),
+                    ("timeOfRequest", ASCENDING),
+                ],
+                name="trade_lifecycle",
+            ),
+        ]
+
+
+class ArchivedTrade(TradeOffer):
+    """
+    Closed trade moved out of the Trades collection once it is old enough,
+    so that Trades only holds the trades still in play
+    """
+
+    class Settings:
+        name = "TradesArchive"
+        indexes = [
+            IndexModel(
+                [
+                    ("offerer", ASCENDING),
+                    ("status", ASCENDING),
+                    ("timeOfRequest", DESCENDING),
+                ],
+                name="archived_offerer_status_time",
+            ),
+            IndexModel(
+                [
+                    ("receiver", ASCENDING),
+                    ("status", ASCENDING),
+                    ("timeOfRequest", DESCENDING),
+                ],
+                name="archived_receiver_status_time",
+            ),
+        ]
+
+
+class TradeCycle(Document):
+    """
+    Trade between two or more users proposed by the matching engine. Every
+    participant gives one game to the next one, each gift is a TradeOffer
+    (leg) the participant receiving it accepts or declines. The games only
+    move once every participant accepted, a single decline declines them all.
+    """
+
+    id: PydanticObjectId = Field(default_factory=PydanticObjectId)
+    key: str = Field(hidden=True)  # sorted ids of the copies, unique per cycle
+    participants: list[UserRef]
+    trades: list[TradeRef]  # the legs, trades[i] is given by participants[i]
+    accepted: list[UserRef] = []
+    status: TradeStatus = TradeStatus.pending
+    timeOfProposal: datetime = Field(default_factory=datetime.utcnow)
+    settlingSince: Optional[datetime] = Field(None, hidden=True)
+
+    class Settings:
+        name = "TradeCycles"
+        indexes = [
+            # a set of copies is in one pending cycle at a time
+            IndexModel(
+                [("key", ASCENDING)],
+                name="pending_cycle_key",
+                unique=True,
+                partialFilterExpression={"status": TradeStatus.pending.value},
+            ),
+            # a declined cycle is never proposed again
+            IndexModel(
+                [("key", ASCENDING), ("status", ASCENDING)], name="cycle_key_status"
+            ),
+            IndexModel(
+                [("status", ASCENDING), ("settlingSince", ASCENDING)],
+                name="cycle_status_settling",
+            ),
+        ]
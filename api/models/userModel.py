@@ -1,9 +1,14 @@
 import datetime
-from pydantic import BaseModel
-from beanie import PydanticObjectId, Document
+from pydantic import BaseModel, Field
+from pymongo import IndexModel, ASCENDING
+from enum import Enum
+from beanie import PydanticObjectId, Document, after_event
+from beanie import Insert, Replace, SaveChanges, Update, Delete
 from typing import Optional
-from .gameModel import Tags, OwnedGame
+from .gameModel import Tags
 from .tradeModel import TradeOffer
+from .referenceModel import TradeRef
+from services.invalidationBus import invalidationBus
 
 # I need hypermedia functionality
 # idea, users have a different form of the game class
@@ -26,19 +31,33 @@ class UserOut(BaseModel):
     id: PydanticObjectId
     username: str
     email: str
-    games: list[OwnedGame] = []
-    tradeHistory: list[str] = []
+    tradeHistory: list[TradeRef] = []
 
     class Config:
         schema_extra = {
             "example": {
                 "username": "XxX_The_Gamer_XxX",
                 "email": "GamerGod@gmail.com",
-                "games": [],
             }
         }
 
 
+class UserOutProjection(UserOut):
+    """
+    UserOut read straight from Mongo, find().project() only fetches these
+    fields instead of the whole user with its password hash and address
+    """
+
+    id: PydanticObjectId = Field(alias="_id")
+
+
+class UserSortField(str, Enum):
+    """Fields GET /users can be sorted by"""
+
+    id = "_id"
+    username = "username"
+
+
 class UserUpdate(BaseModel):
 
     username: Optional[str]
@@ -47,7 +66,6 @@ class UserUpdate(BaseModel):
     password: Optional[str]
     date_of_birth: Optional[datetime.date]
     street_address: Optional[Address]
-    games: Optional[list[OwnedGame]]
 
 
 class User(Document, UserOut):
@@ -59,6 +77,7 @@ class User(Document, UserOut):
     last_name: str = "Doe"
     date_of_birth: Optional[datetime.date]
     street_address: Address
+    isAdmin: bool = False  # set directly in the database
     # disabled: bool = False # This would be instead of deleting the user
 
     class Settings:
@@ -66,6 +85,19 @@ class User(Document, UserOut):
         bson_encoders = {
             datetime.date: lambda v: v.isoformat(),
         }
+        indexes = [
+            # every authenticated request looks the user up by email
+            IndexModel([("email", ASCENDING)], name="user_email", unique=True),
+            IndexModel(
+                [("username", ASCENDING), ("_id", ASCENDING)], name="username_sort"
+            ),
+        ]
+
+    @after_event(Insert, Replace, SaveChanges, Update, Delete)
+    async def invalidate_cache(self):
+        # write-through, the next read goes to the database again on every
+        # replica (bulk updates like User.find(...).update(...) don't fire this)
+        await invalidationBus.publish("User", self.id)
 
 
 class UserRegister(BaseModel):
@@ -96,3 +128,7 @@ class UserRegister(BaseModel):
 class UserNewPassword(BaseModel):
     oldPassword: str
     newPassword: str
+
+
+class UserPasswordReset(BaseModel):
+    email: str
@@ -0,0 +1,29 @@
+from pydantic import BaseModel, Field
+from pymongo import IndexModel, ASCENDING
+from beanie import PydanticObjectId, Document
+from datetime import datetime
+from .referenceModel import GameRef, UserRef
+
+
+class WishlistEntryIn(BaseModel):
+    game: PydanticObjectId  # id of the abstract game wanted
+
+
+class WishlistEntry(Document):
+    """A game a user wants, one document per user and game"""
+
+    id: PydanticObjectId = Field(default_factory=PydanticObjectId)
+    user: UserRef
+    game: GameRef
+    added: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "Wishlists"
+        indexes = [
+            IndexModel(
+                [("user", ASCENDING), ("game", ASCENDING)],
+                name="wishlist_user_game",
+                unique=True,
+            ),
+            IndexModel([("user", ASCENDING), ("_id", ASCENDING)], name="wishlist_user"),
+        ]
@@ -1,10 +1,40 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Body
+from fastapi import APIRouter, HTTPException, status, Depends, Body, Query, Request
+from fastapi.responses import StreamingResponse
 from beanie import PydanticObjectId
-from dependencies import oath2_scheme, get_current_user, generate_url
+from datetime import date
+from typing import Optional
+from dependencies import (
+    oath2_scheme,
+    get_current_user,
+    get_game_entry,
+    generate_url,
+    expand_params,
+    PageParams,
+    paginate,
+)
 from models.userModel import User, UserOut
-from models.gameModel import GameAbstract, OwnedGame
-from models.searchModel import SearchResults
+from models.gameModel import (
+    GameAbstract,
+    OwnedGame,
+    OwnedGameOut,
+    OwnedGameOutProjection,
+    GameSortField,
+)
+from models.gameModel import Tags as GameTags
+from models.pageModel import Page, SortOrder, DeleteConfirmation
+from models.searchModel import SearchResults, GameSuggestion
 from models import Tags
+from services import searchService
+from services.suggestService import suggestIndex, MAX_SUGGESTIONS
+from services.exportService import ndjson_export
+from services.responseService import FastJSONResponse, output
+from services.expandService import Expander
+from services.cacheService import (
+    gameCache,
+    game_list_key,
+    render_json,
+    conditional_response,
+)
 
 router = APIRouter(
     prefix="/games",
@@ -36,7 +66,7 @@ async def create_game(
         }
     )
 ):
-    return await GameAbstract(
+    game = await GameAbstract(
         id=PydanticObjectId(),
         name=gameIn.name,
         publisher=gameIn.publisher,
@@ -44,21 +74,99 @@ async def create_game(
         platforms=gameIn.platforms,
         tags=gameIn.tags,
     ).create()
+    suggestIndex.add(game)
+    return FastJSONResponse(game, status_code=status.HTTP_201_CREATED)
 
 
 # Read
 @router.get(
     "",
-    response_model=list[GameAbstract],
+    response_model=Page[GameAbstract],
     status_code=status.HTTP_200_OK,
     summary="Get all games",
-    description="This endpoint is used to get all games",
+    description="This endpoint is used to get all games, one page at a time. Follow the `next` link to get the following page",
+)
+async def get_games(
+    request: Request,
+    page: PageParams = Depends(),
+    sort: GameSortField = GameSortField.id,
+    order: SortOrder = SortOrder.asc,
+    publisher: Optional[str] = None,
+    platform: Optional[str] = None,
+    tags: Optional[list[GameTags]] = Query(None),
+    released_after: Optional[date] = None,
+    released_before: Optional[date] = None,
+):
+    cacheKey = game_list_key("games", tuple(sorted(request.query_params.multi_items())))
+    cached = gameCache.get(cacheKey)
+    if cached is not None:
+        return conditional_response(request, *cached)
+
+    filters = {}
+    if publisher is not None:
+        filters["publisher"] = publisher
+    if platform is not None:
+        filters["platforms"] = platform
+    if tags:
+        filters["tags"] = {"$all": [tag.value for tag in tags]}
+    # release dates are stored as ISO strings, which compare in date order
+    releaseRange = {}
+    if released_after is not None:
+        releaseRange["$gte"] = released_after.isoformat()
+    if released_before is not None:
+        releaseRange["$lte"] = released_before.isoformat()
+    if releaseRange:
+        filters["release_date"] = releaseRange
+
+    games, nextCursor = await paginate(
+        GameAbstract.find(filters), page, sort.value, order
+    )
+    nextLink = None
+    if nextCursor is not None:
+        nextLink = generate_url(
+            "games",
+            query={
+                "after": nextCursor,
+                "limit": page.limit,
+                "sort": sort.value,
+                "order": order.value,
+                "publisher": publisher,
+                "platform": platform,
+                "tags": [tag.value for tag in tags] if tags else None,
+                "released_after": released_after,
+                "released_before": released_before,
+            },
+        )
+    rendered = render_json(
+        Page[GameAbstract](items=games, count=len(games), next=nextLink)
+    )
+    gameCache.set(cacheKey, rendered)
+    return conditional_response(request, *rendered)
+
+
+@router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    summary="Export all games",
+    description="This endpoint streams every game as newline delimited json, ordered by id. Pass the id of the last game received as `after` to resume an interrupted export, and `gzip=true` to get a compressed stream",
+    response_class=StreamingResponse,
+)
+async def export_games(after: Optional[PydanticObjectId] = None, gzip: bool = False):
+    return ndjson_export(GameAbstract.get_motor_collection(), after=after, gzip=gzip)
+
+
+@router.get(
+    "/suggest",
+    response_model=list[GameSuggestion],
+    status_code=status.HTTP_200_OK,
+    summary="Suggest games while typing",
+    description="This endpoint is used for search-as-you-type, it returns the games with a word of their name or publisher starting with `q`, the most owned first. Answered from memory without querying the database",
 )
-async def get_games():
-    gameList: list[GameAbstract] = []
-    async for game in GameAbstract.find_all():
-        gameList.append(GameAbstract(**game.dict()))
-    return gameList
+async def suggest_games(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
+):
+    return FastJSONResponse(suggestIndex.suggest(q, limit))
 
 
 @router.get(
@@ -68,8 +176,56 @@ async def get_games():
     summary="Get a game",
     description="This endpoint is used to get a game by ID",
 )
-async def get_game(game_id: PydanticObjectId):
-    return await GameAbstract.get(game_id)
+async def get_game(game_id: PydanticObjectId, request: Request):
+    entry = await get_game_entry(game_id)
+    if entry is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Game not found",
+        )
+    game, etag, body = entry
+    return conditional_response(request, etag, body)
+
+
+@router.get(
+    "/{game_id}/owners",
+    response_model=Page[OwnedGameOut],
+    status_code=status.HTTP_200_OK,
+    summary="Get the copies of a game",
+    description="This endpoint is used to find who owns a game before offering them a trade. It returns the owned copies of the game one page at a time, `condition` only returns the copies in that condition and `expand=owner` inlines the owners instead of their links",
+)
+async def get_game_owners(
+    game_id: PydanticObjectId,
+    condition: Optional[str] = None,
+    page: PageParams = Depends(),
+    expander: Expander = Depends(expand_params("owner")),
+):
+    if await get_game_entry(game_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Game not found",
+        )
+    # served by the game_owners and game_condition_owners indexes
+    query = OwnedGame.find(OwnedGame.game == game_id)
+    if condition is not None:
+        query = query.find(OwnedGame.condition == condition)
+    copies, nextCursor = await paginate(query.project(OwnedGameOutProjection), page)
+    nextLink = None
+    if nextCursor is not None:
+        nextLink = generate_url(
+            f"games/{game_id}/owners",
+            query={
+                "after": nextCursor,
+                "limit": page.limit,
+                "condition": condition,
+                "expand": expander.query(),
+            },
+        )
+    copyList = [output(OwnedGameOut, copy) for copy in copies]
+    await expander.owned_games(copyList)
+    return FastJSONResponse(
+        Page[OwnedGameOut].construct(items=copyList, count=len(copyList), next=nextLink)
+    )
 
 
 # Update
@@ -93,29 +249,42 @@ async def update_game(
     ),
 ):
     game = await GameAbstract.get(game_id)
+    if game is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Game not found",
+        )
     game.name = gameIn.name
     game.publisher = gameIn.publisher
     game.release_date = gameIn.release_date
     game.platforms = gameIn.platforms
     game.tags = gameIn.tags
-    return await game.save()
+    await game.save()
+    suggestIndex.add(game)
+    return FastJSONResponse(game, status_code=status.HTTP_202_ACCEPTED)
 
 
 # Delete
 @router.delete(
     "/{game_id}",
-    response_model=list[GameAbstract],
+    response_model=DeleteConfirmation,
     status_code=status.HTTP_202_ACCEPTED,
     summary="Delete a game",
-    description="This endpoint is used to delete a game by ID",
+    description="This endpoint is used to delete a game by ID, it returns a confirmation with a link to the remaining games",
 )
 async def delete_game(game_id: PydanticObjectId):
     game = await GameAbstract.get(game_id)
+    if game is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Game not found",
+        )
     await game.delete()
-    gameList: list[GameAbstract] = []
-    async for game in GameAbstract.find_all():
-        gameList.append(GameAbstract(**game.dict()))
-    return gameList
+    suggestIndex.remove(str(game_id))
+    return FastJSONResponse(
+        DeleteConfirmation(id=game_id, collection=generate_url("games")),
+        status_code=status.HTTP_202_ACCEPTED,
+    )
 
 
 # Search
@@ -124,41 +293,16 @@ async def delete_game(game_id: PydanticObjectId):
     response_model=SearchResults,
     status_code=status.HTTP_200_OK,
     summary="Search for a game",
-    description="This endpoint is used to search for a game by name, tag, platform, or publisher",
+    description="This endpoint is used to search for a game by name, tag, platform, or publisher. Matching ignores case and accents, results are ordered by relevance",
 )
-async def search_games(search_term: str, user: User = Depends(oath2_scheme)):
-    totalResults = 0
-    nameSearch = []
-    async for game in GameAbstract.find({"name": {"$regex": search_term}}).limit(25):
-        nameSearch.append(game)
-        totalResults += 1
-
-    tagSearch = []
-    async for game in GameAbstract.find({"tags": {"$regex": search_term}}).limit(25):
-        tagSearch.append(game)
-        totalResults += 1
-
-    platformSearch = []
-    async for game in GameAbstract.find({"platforms": {"$regex": search_term}}).limit(
-        25
-    ):
-        platformSearch.append(game)
-        totalResults += 1
-
-    publisherSearch = []
-    async for game in GameAbstract.find({"publisher": {"$regex": search_term}}).limit(
-        25
-    ):
-        publisherSearch.append(game)
-        totalResults += 1
-
-    results = SearchResults(
-        nameResults=nameSearch,
-        tagResults=tagSearch,
-        platformResults=platformSearch,
-        publisherResults=publisherSearch,
-        total=totalResults,
-    )
+async def search_games(
+    search_term: str, request: Request, user: User = Depends(oath2_scheme)
+):
     # Searches on multiple fields
     # Title, Tags, Platform, Publisher, Etc.
-    return results
+    cacheKey = game_list_key("search", search_term)
+    rendered = gameCache.get(cacheKey)
+    if rendered is None:
+        rendered = render_json(await searchService.search_games(search_term))
+        gameCache.set(cacheKey, rendered)
+    return conditional_response(request, *rendered)
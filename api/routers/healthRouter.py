@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Request, Response, status
+from pymongo.errors import PyMongoError
+from models.healthModel import HealthReport
+from models import Tags
+from services.databaseService import poolMonitor, ping
+import asyncio
+
+router = APIRouter(tags=[Tags.Health])
+
+
+async def health_report(request: Request) -> HealthReport:
+    # app.status is "starting" until app_init finished warming up and
+    # "stopping" once the shutdown began, see main.py
+    appStatus = getattr(request.app, "status", "starting")
+    latency, error = None, None
+    client = getattr(request.app, "databaseClient", None)
+    if client is not None:
+        try:
+            latency = await ping(client)
+        except (PyMongoError, asyncio.TimeoutError) as exception:
+            error = str(exception) or type(exception).__name__
+    if appStatus == "ok" and latency is None:
+        appStatus = "unavailable"
+    return HealthReport(
+        status=appStatus,
+        ready=appStatus == "ok",
+        databaseLatencyMs=latency,
+        databaseError=error,
+        pool=poolMonitor.stats(),
+    )
+
+
+@router.get(
+    "/healthz",
+    response_model=HealthReport,
+    status_code=status.HTTP_200_OK,
+    summary="Liveness check",
+    description="This endpoint answers as long as the process is alive, the body reports the database round trip and the connection pool",
+)
+async def healthz(request: Request):
+    return await health_report(request)
+
+
+@router.get(
+    "/readyz",
+    response_model=HealthReport,
+    status_code=status.HTTP_200_OK,
+    responses={503: {"description": "Not ready to serve requests"}},
+    summary="Readiness check",
+    description="This endpoint answers 200 once the replica is warmed up and can reach the database, and 503 while it is starting, stopping or lost the database",
+)
+async def readyz(request: Request, response: Response):
+    report = await health_report(request)
+    if not report.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return report
@@ -0,0 +1,344 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Body
+from beanie import PydanticObjectId, BulkWriter
+from beanie.operators import In
+from pymongo import ReturnDocument
+from dependencies import (
+    get_current_user,
+    get_user,
+    get_game,
+    generate_url,
+    expand_params,
+    PageParams,
+    paginate,
+)
+from models.userModel import User
+from models.gameModel import (
+    GameAbstract,
+    OwnedGame,
+    OwnedGameIn,
+    OwnedGameOut,
+    OwnedGameOutProjection,
+)
+from models.pageModel import Page
+from models.libraryModel import (
+    LibraryOperation,
+    LibraryOperationType,
+    LibraryOperationResult,
+    LibraryBatchSummary,
+    LibraryBatchResult,
+)
+from models import Tags
+from services.responseService import FastJSONResponse, output
+from services.expandService import Expander
+from services.matchService import holdings_changed
+
+# Every library operation is a single write on the OwnedGames collection,
+# the user document is never rewritten
+MAX_BATCH_SIZE = 1000
+
+router = APIRouter(
+    prefix="/users",
+    responses={
+        404: {"description": "Not found"},
+        500: {"description": "Server Error"},
+    },
+    tags=[Tags.Library],
+)
+
+
+async def library_page(
+    owner: User, page: PageParams, resource: str, expander: Expander
+):
+    games, nextCursor = await paginate(
+        OwnedGame.find(OwnedGame.owner == owner.id).project(OwnedGameOutProjection),
+        page,
+    )
+    nextLink = None
+    if nextCursor is not None:
+        nextLink = generate_url(
+            resource,
+            query={
+                "after": nextCursor,
+                "limit": page.limit,
+                "expand": expander.query(),
+            },
+        )
+    gameList = [output(OwnedGameOut, game) for game in games]
+    await expander.owned_games(gameList)
+    return FastJSONResponse(
+        Page[OwnedGameOut].construct(items=gameList, count=len(gameList), next=nextLink)
+    )
+
+
+async def raise_missing_or_locked(gameID: PydanticObjectId, owner: User):
+    """Explains a write on a copy that matched nothing"""
+    copy = await OwnedGame.find_one(OwnedGame.id == gameID, OwnedGame.owner == owner.id)
+    if copy is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Game is being traded",
+        )
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Game not found",
+    )
+
+
+@router.post(
+    "/library",
+    response_model=OwnedGameOut,
+    status_code=status.HTTP_201_CREATED,
+    summary="Add game to library",
+    description="This endpoint is used to add a game to the current user's library",
+)
+async def add_game(
+    gameIn: OwnedGameIn = Body(
+        example={"game": PydanticObjectId(), "name": "Game Name", "condition": "Good"}
+    ),
+    currentUser: User = Depends(get_current_user),
+):
+    gameAbstract = await get_game(gameIn.game)
+    if gameAbstract is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Game not found",
+        )
+    newGameObject = await OwnedGame(
+        id=PydanticObjectId(),
+        game=gameAbstract.id,
+        name=gameAbstract.name,
+        condition=gameIn.condition,
+        owner=currentUser.id,
+        ownerHistory=[currentUser.id],
+    ).create()
+    await holdings_changed(currentUser.id)
+    return FastJSONResponse(
+        output(OwnedGameOut, newGameObject), status_code=status.HTTP_201_CREATED
+    )
+
+
+@router.get(
+    "/library",
+    response_model=Page[OwnedGameOut],
+    status_code=status.HTTP_200_OK,
+    summary="Get library",
+    description="This endpoint is used to get the current user's library, one page at a time. Use `expand` to get the games and owner inlined instead of their links",
+)
+async def get_library(
+    page: PageParams = Depends(),
+    expander: Expander = Depends(expand_params("games", "owner")),
+    currentUser: User = Depends(get_current_user),
+):
+    return await library_page(currentUser, page, "users/library", expander)
+
+
+@router.delete(
+    "/library/{gameID}",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=OwnedGameOut,
+    summary="Delete game from library",
+    description="This endpoint is used to delete a game from the current user's library, it returns the deleted game",
+)
+async def delete_game(
+    gameID: PydanticObjectId, currentUser: User = Depends(get_current_user)
+):
+    # copies locked by a trade that is being accepted can't be deleted
+    deleted = await OwnedGame.get_motor_collection().find_one_and_delete(
+        {
+            "_id": gameID,
+            "owner": currentUser.id,
+            "tradeLock": None,
+        }
+    )
+    if deleted is None:
+        await raise_missing_or_locked(gameID, currentUser)
+    await holdings_changed(currentUser.id)
+    return FastJSONResponse(
+        output(OwnedGameOut, OwnedGame.parse_obj(deleted)),
+        status_code=status.HTTP_202_ACCEPTED,
+    )
+
+
+@router.put(
+    "/library/{gameID}",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=OwnedGameOut,
+    summary="Update game in library",
+    description="This endpoint is used to update a game in the current user's library (the only editible data is the condition)",
+)
+async def update_game(
+    gameID: PydanticObjectId,
+    gameIn: OwnedGameIn = Body(example={"condition": "Good"}),
+    currentUser: User = Depends(get_current_user),
+):
+    # copies locked by a trade that is being accepted can't be changed
+    updated = await OwnedGame.get_motor_collection().find_one_and_update(
+        {"_id": gameID, "owner": currentUser.id, "tradeLock": None},
+        {"$set": {"condition": gameIn.condition}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        await raise_missing_or_locked(gameID, currentUser)
+    return FastJSONResponse(
+        output(OwnedGameOut, OwnedGame.parse_obj(updated)),
+        status_code=status.HTTP_202_ACCEPTED,
+    )
+
+
+async def report_skipped(
+    operations: list[LibraryOperation],
+    results: list[LibraryOperationResult],
+    summary: LibraryBatchSummary,
+    owner: User,
+):
+    """
+    Marks 409 the updates and removals skipped by the bulk write because a
+    trade locked their copy after it was read
+    """
+    written = [
+        result
+        for result in results
+        if result.op != LibraryOperationType.add
+        and result.status == status.HTTP_202_ACCEPTED
+    ]
+    if not written:
+        return
+    locked = {
+        game.id: game
+        for game in await OwnedGame.find(
+            In(OwnedGame.id, [result.id for result in written]),
+            OwnedGame.owner == owner.id,
+            OwnedGame.tradeLock != None,
+        ).to_list()
+    }
+    for result in written:
+        game = locked.get(result.id)
+        if game is None:
+            continue
+        if result.op == LibraryOperationType.update:
+            # applied before the lock if the copy has the new condition
+            if game.condition == operations[result.index].condition:
+                continue
+            summary.updated -= 1
+        else:
+            summary.removed -= 1
+        result.status = status.HTTP_409_CONFLICT
+        result.detail = "Game is being traded"
+        summary.failed += 1
+
+
+@router.post(
+    "/library/batch",
+    response_model=LibraryBatchResult,
+    status_code=status.HTTP_200_OK,
+    summary="Change many games in the library",
+    description=f"This endpoint is used to add, update and remove up to {MAX_BATCH_SIZE} games of the current user's library in one request. Every operation gets its own result, the status is the one the single game endpoint would have returned",
+)
+async def batch_library(
+    operations: list[LibraryOperation] = Body(
+        example=[
+            {"op": "add", "game": PydanticObjectId(), "condition": "Good"},
+            {"op": "update", "id": PydanticObjectId(), "condition": "Fair"},
+            {"op": "remove", "id": PydanticObjectId()},
+        ]
+    ),
+    currentUser: User = Depends(get_current_user),
+):
+    if len(operations) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch can't have more than {MAX_BATCH_SIZE} operations",
+        )
+    # resolve every reference up front with one query per collection
+    gameIds = {op.game for op in operations if op.op == LibraryOperationType.add}
+    gameAbstracts = {
+        game.id: game
+        for game in await GameAbstract.find(
+            In(GameAbstract.id, list(gameIds))
+        ).to_list()
+    }
+    copyIds = {op.id for op in operations if op.op != LibraryOperationType.add}
+    copies = await OwnedGame.find(
+        In(OwnedGame.id, list(copyIds)), OwnedGame.owner == currentUser.id
+    ).to_list()
+    ownedCopies = {game.id for game in copies if game.tradeLock is None}
+    # copies locked by a trade that is being accepted can't be changed
+    lockedCopies = {game.id for game in copies if game.tradeLock is not None}
+
+    results: list[LibraryOperationResult] = []
+    summary = LibraryBatchSummary()
+    bulkWriter = BulkWriter()
+    for index, op in enumerate(operations):
+        result = LibraryOperationResult(index=index, op=op.op, status=0, id=op.id)
+        if op.op == LibraryOperationType.add:
+            gameAbstract = gameAbstracts.get(op.game)
+            if gameAbstract is None:
+                result.status = status.HTTP_404_NOT_FOUND
+                result.detail = "Game not found"
+            else:
+                newGameObject = OwnedGame(
+                    id=PydanticObjectId(),
+                    game=op.game,
+                    name=gameAbstract.name,
+                    condition=op.condition,
+                    owner=currentUser.id,
+                    ownerHistory=[currentUser.id],
+                )
+                await OwnedGame.insert_one(newGameObject, bulk_writer=bulkWriter)
+                result.status = status.HTTP_201_CREATED
+                result.id = newGameObject.id
+                summary.added += 1
+        elif op.id in lockedCopies:
+            result.status = status.HTTP_409_CONFLICT
+            result.detail = "Game is being traded"
+        elif op.id not in ownedCopies:
+            result.status = status.HTTP_404_NOT_FOUND
+            result.detail = "Game not found"
+        elif op.op == LibraryOperationType.update:
+            await OwnedGame.find_one(
+                OwnedGame.id == op.id,
+                OwnedGame.owner == currentUser.id,
+                OwnedGame.tradeLock == None,
+            ).update({"$set": {"condition": op.condition}}, bulk_writer=bulkWriter)
+            result.status = status.HTTP_202_ACCEPTED
+            summary.updated += 1
+        else:
+            await OwnedGame.find_one(
+                OwnedGame.id == op.id,
+                OwnedGame.owner == currentUser.id,
+                OwnedGame.tradeLock == None,
+            ).delete(bulk_writer=bulkWriter)
+            ownedCopies.discard(op.id)  # later operations on it are 404
+            result.status = status.HTTP_202_ACCEPTED
+            summary.removed += 1
+        if result.status >= 400:
+            summary.failed += 1
+        results.append(result)
+
+    # everything above is sent to Mongo as a single bulk write
+    await bulkWriter.commit()
+    await report_skipped(operations, results, summary, currentUser)
+    if summary.added or summary.removed:
+        await holdings_changed(currentUser.id)
+    return FastJSONResponse(LibraryBatchResult(results=results, summary=summary))
+
+
+@router.get(
+    "/{userID}/library",
+    response_model=Page[OwnedGameOut],
+    status_code=status.HTTP_200_OK,
+    summary="Get a user's library",
+    description="This endpoint is used to get the library of any user, one page at a time. Use `expand` to get the games and owner inlined instead of their links",
+)
+async def get_user_library(
+    userID: PydanticObjectId,
+    page: PageParams = Depends(),
+    expander: Expander = Depends(expand_params("games", "owner")),
+):
+    user = await get_user(userID)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    return await library_page(user, page, f"users/{userID}/library", expander)
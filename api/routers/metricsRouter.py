@@ -0,0 +1,88 @@
+from fastapi import APIRouter, Response, status
+from models import Tags
+from services.metricsService import registry, CallbackMetric
+from services.cacheService import userCache, gameCache
+from services.passwordService import passwordHasher
+from services.invalidationBus import invalidationBus
+from services.databaseService import poolMonitor
+from services.jobService import jobQueue
+
+router = APIRouter(tags=[Tags.Health])
+
+# numbers the other services already keep, read when /metrics is scraped
+CACHES = {"user": userCache, "game": gameCache}
+for field, type in [("hits", "counter"), ("misses", "counter"), ("size", "gauge")]:
+    registry.register(
+        CallbackMetric(
+            f"cache_{field}" + ("_total" if type == "counter" else ""),
+            f"Cache {field}",
+            type,
+            ("cache",),
+            lambda field=field: {
+                (name,): cache.stats()[field] for name, cache in CACHES.items()
+            },
+        )
+    )
+registry.register(
+    CallbackMetric(
+        "password_hash_queue_depth",
+        "Password hashes waiting for a worker",
+        "gauge",
+        (),
+        lambda: {(): passwordHasher.stats()["queueDepth"]},
+    )
+)
+registry.register(
+    CallbackMetric(
+        "password_hash_rejected_total",
+        "Password hashes answered with 429 because the queue was full",
+        "counter",
+        (),
+        lambda: {(): passwordHasher.stats()["rejected"]},
+    )
+)
+registry.register(
+    CallbackMetric(
+        "invalidation_events_total",
+        "Cache invalidations published, received from other replicas and dropped",
+        "counter",
+        ("direction",),
+        lambda: {
+            (direction,): invalidationBus.stats()[direction]
+            for direction in ("published", "received", "dropped")
+        },
+    )
+)
+registry.register(
+    CallbackMetric(
+        "mongo_pool_connections",
+        "Connections of the Mongo pool",
+        "gauge",
+        ("state",),
+        lambda: {
+            (state,): poolMonitor.stats()[state]
+            for state in ("open", "checkedOut", "waiting")
+        },
+    )
+)
+
+registry.register(
+    CallbackMetric(
+        "job_queue_depth",
+        "Jobs waiting or running, counted every few seconds",
+        "gauge",
+        ("kind", "status"),
+        lambda: dict(jobQueue.depth),
+    )
+)
+
+
+@router.get(
+    "/metrics",
+    status_code=status.HTTP_200_OK,
+    summary="Prometheus metrics",
+    description="This endpoint exposes the request, Mongo, cache, password hashing and job queue metrics of this replica in the Prometheus text format",
+    response_class=Response,
+)
+async def metrics():
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,11 +1,43 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Body
+from fastapi import APIRouter, HTTPException, status, Depends, Body, Query
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.responses import StreamingResponse
 from beanie import PydanticObjectId
-from dependencies import oath2_scheme, get_current_user, generate_url
+from beanie.operators import In, Or
+from typing import Optional
+from dependencies import (
+    oath2_scheme,
+    get_current_user,
+    get_current_admin,
+    get_user,
+    generate_url,
+    expand_params,
+    PageParams,
+    paginate,
+)
 from models.userModel import User, UserOut
-from models.gameModel import GameAbstract, OwnedGame
-from models.tradeModel import TradeOffer, TradeStatus, TradeOfferIn
+from models.gameModel import (
+    GameAbstract,
+    OwnedGame,
+    OwnedGameIn,
+    OwnedGameOut,
+    OwnedGameOutProjection,
+)
+from models.tradeModel import (
+    ArchivedTrade,
+    TradeOffer,
+    TradeCycle,
+    TradeStatus,
+    TradeRole,
+    TradeOfferIn,
+)
+from models.pageModel import Page, SortOrder
 from models import Tags
+from services import tradeService, notificationService
+from services.exportService import ndjson_export
+from services.responseService import FastJSONResponse, output
+from services.expandService import Expander
+from services.matchService import tradeGraph
+from services.lifecycleService import find_trade
 
 router = APIRouter(
     prefix="/trades",
@@ -16,6 +48,25 @@ router = APIRouter(
     tags=[Tags.Trades],
 )
 
+
+async def owned_games(
+    games: list[OwnedGameIn], owner: User
+) -> Optional[list[OwnedGameOut]]:
+    """Snapshots of the requested games, None unless the owner has all of them"""
+    ids = {game.id for game in games}
+    found = (
+        await OwnedGame.find(
+            In(OwnedGame.id, list(ids)),
+            OwnedGame.owner == owner.id,
+        )
+        .project(OwnedGameOutProjection)
+        .to_list()
+    )
+    if not ids or len(found) != len(ids):
+        return None
+    return [output(OwnedGameOut, game) for game in found]
+
+
 # REQUIRES AUTH FIRST, THATS HOW WE GET CURRENT USER
 # Create
 @router.post(
@@ -50,31 +101,17 @@ async def create_trade(
     ),
     currentUser: User = Depends(get_current_user),
 ):
-    user = await User.get(userID)
-
-    foundGame: bool = False
-    formattedOffererGames: list[OwnedGame] = []
-    for game in tradeIn.offererGames:
-        for OwnedGameIn in currentUser.games:
-            if OwnedGameIn.id == game.id:
-                formattedOffererGames.append(OwnedGameIn)
-                foundGame = True
+    user = await get_user(userID)
 
-    if not foundGame:
+    formattedOffererGames = await owned_games(tradeIn.offererGames, currentUser)
+    if formattedOffererGames is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="You don't own the game you're trying to trade",
         )
 
-    foundGame: bool = False
-    formattedReceiverGames: list[OwnedGame] = []
-    for game in tradeIn.receiverGames:
-        for OwnedGameIn in user.games:
-            if OwnedGameIn.id == game.id:
-                formattedReceiverGames.append(OwnedGameIn)
-                foundGame = True
-
-    if not foundGame:
+    formattedReceiverGames = await owned_games(tradeIn.receiverGames, user)
+    if formattedReceiverGames is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="The user you're trying to trade with doesn't own that game",
@@ -83,83 +120,162 @@ async def create_trade(
     offer = await TradeOffer(
         id=PydanticObjectId(),
         status=TradeStatus.pending,
-        offerer=generate_url("users", currentUser.id),
-        receiver=generate_url("users", user.id),
+        offerer=currentUser.id,
+        receiver=user.id,
         offererMessage=tradeIn.offererMessage,
         offererGames=formattedOffererGames,
         receiverGames=formattedReceiverGames,
     ).create()
-    user.tradeHistory.append(generate_url("trades", offer.id))
-    currentUser.tradeHistory.append(generate_url("trades", offer.id))
-    await currentUser.save()
-    await user.save()
-    return offer
+    # adds it to the trade history of both users and mails the receiver
+    await notificationService.trade_offered(offer.id)
+    return FastJSONResponse(offer, status_code=status.HTTP_201_CREATED)
+
+
+async def list_user_trades(
+    user: User,
+    page: PageParams,
+    tradeStatus: Optional[TradeStatus] = None,
+    role: Optional[TradeRole] = None,
+    expander: Optional[Expander] = None,
+    archived: bool = False,
+) -> FastJSONResponse:
+    """
+    Newest first listing of the trades a user is part of, answered by a single
+    query on the offerer/receiver indexes with the status filter pushed to Mongo
+    """
+    expander = expander or Expander(set())
+    model = ArchivedTrade if archived else TradeOffer
+    if role == TradeRole.offerer:
+        query = model.find(model.offerer == user.id)
+    elif role == TradeRole.receiver:
+        query = model.find(model.receiver == user.id)
+    else:
+        query = model.find(Or(model.offerer == user.id, model.receiver == user.id))
+    if tradeStatus is not None:
+        query = query.find(model.status == tradeStatus)
+    trades, nextCursor = await paginate(query, page, "timeOfRequest", SortOrder.desc)
+    nextLink = None
+    if nextCursor is not None:
+        nextLink = generate_url(
+            "trades/myTrades",
+            query={
+                "after": nextCursor,
+                "limit": page.limit,
+                "status": tradeStatus.value if tradeStatus else None,
+                "role": role.value if role else None,
+                "expand": expander.query(),
+                "archived": "true" if archived else None,
+            },
+        )
+    await expander.trades(trades)
+    return FastJSONResponse(
+        Page[TradeOffer].construct(items=trades, count=len(trades), next=nextLink)
+    )
 
 
 @router.get(
     "/myTrades",
-    response_model=list[TradeOffer],
+    response_model=Page[TradeOffer],
     status_code=status.HTTP_200_OK,
     summary="Get all trades for a user",
-    description="This endpoint is used to get all trades for a user",
+    description="This endpoint is used to get all trades for a user. Use `status` to filter by the state of the trade, `role` to only get the offers the user made (offerer) or received (receiver) and `expand` to get the users and games inlined instead of their links. Trades closed long ago are moved to the archive, `archived=true` lists those instead",
 )
-async def get_user_trades(user: User = Depends(get_current_user)):
-    trades: list[TradeOffer] = []
-    for link in user.tradeHistory:
-        id = link.split("/")[-1]
-        trades.append(await TradeOffer.get(id))
-    return trades
+async def get_user_trades(
+    tradeStatus: Optional[TradeStatus] = Query(None, alias="status"),
+    role: Optional[TradeRole] = None,
+    archived: bool = False,
+    page: PageParams = Depends(),
+    expander: Expander = Depends(expand_params("offerer", "receiver", "games")),
+    user: User = Depends(get_current_user),
+):
+    return await list_user_trades(user, page, tradeStatus, role, expander, archived)
 
 
 @router.get(
     "/myTrades/pending",
-    response_model=list[TradeOffer],
+    response_model=Page[TradeOffer],
     status_code=status.HTTP_200_OK,
     summary="Get all pending trades for a user",
-    description="This endpoint is used to get all pending trades for a user",
+    description="Same as /trades/myTrades?status=pending",
+    deprecated=True,
 )
-async def get_user_pending_trades(user: User = Depends(get_current_user)):
-    trades: list[TradeOffer] = []
-    for link in user.tradeHistory:
-        id = link.split("/")[-1]
-        trade = await TradeOffer.get(id)
-        if trade.status == TradeStatus.pending:
-            trades.append(trade)
-    return trades
+async def get_user_pending_trades(
+    page: PageParams = Depends(), user: User = Depends(get_current_user)
+):
+    return await list_user_trades(user, page, TradeStatus.pending)
 
 
 @router.get(
     "/myTrades/accepted",
-    response_model=list[TradeOffer],
+    response_model=Page[TradeOffer],
     status_code=status.HTTP_200_OK,
     summary="Get all accepted trades for a user",
-    description="This endpoint is used to get all accepted trades for a user",
+    description="Same as /trades/myTrades?status=accepted",
+    deprecated=True,
 )
-async def get_user_accepted_trades(user: User = Depends(get_current_user)):
-    trades: list[TradeOffer] = []
-    for link in user.tradeHistory:
-        id = link.split("/")[-1]
-        trade = await TradeOffer.get(id)
-        if trade.status == TradeStatus.accepted:
-            trades.append(trade)
-    return trades
+async def get_user_accepted_trades(
+    page: PageParams = Depends(), user: User = Depends(get_current_user)
+):
+    return await list_user_trades(user, page, TradeStatus.accepted)
 
 
 @router.get(
     "/myTrades/declined",
-    response_model=list[TradeOffer],
+    response_model=Page[TradeOffer],
     status_code=status.HTTP_200_OK,
     summary="Get all declined trades for a user",
-    description="This endpoint is used to get all declined trades for a user",
+    description="Same as /trades/myTrades?status=declined",
+    deprecated=True,
 )
-async def get_user_declined_trades(user: User = Depends(get_current_user)):
-    trades: list[TradeOffer] = []
-    for link in user.tradeHistory:
-        id = link.split("/")[-1]
-        trade = await TradeOffer.get(id)
-        if trade.status == TradeStatus.declined:
-            trades.append(trade)
-    return trades
+async def get_user_declined_trades(
+    page: PageParams = Depends(), user: User = Depends(get_current_user)
+):
+    return await list_user_trades(user, page, TradeStatus.declined)
+
+
+@router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    summary="Export all trades",
+    description="Admin only. This endpoint streams every trade as newline delimited json, ordered by id. Pass the id of the last trade received as `after` to resume an interrupted export, `gzip=true` to get a compressed stream and `archived=true` to export the archived trades instead",
+    response_class=StreamingResponse,
+)
+async def export_trades(
+    after: Optional[PydanticObjectId] = None,
+    gzip: bool = False,
+    archived: bool = False,
+    admin: User = Depends(get_current_admin),
+):
+    model = ArchivedTrade if archived else TradeOffer
+    return ndjson_export(model.get_motor_collection(), after=after, gzip=gzip)
+
+
+@router.post(
+    "/cycles/match",
+    response_model=list[TradeCycle],
+    status_code=status.HTTP_200_OK,
+    summary="Match trade cycles",
+    description="Admin only. This endpoint runs the trade matcher now instead of waiting for its next scheduled run and returns the cycles it proposed. With `full=true` every user is searched from, not only the ones whose library or wishlist changed since the last run",
+)
+async def match_cycles(full: bool = False, admin: User = Depends(get_current_admin)):
+    return FastJSONResponse(await tradeGraph.match(full=full))
+
+
+@router.get(
+    "/cycles/{cycleID}",
+    response_model=TradeCycle,
+    status_code=status.HTTP_200_OK,
+    summary="Get a trade cycle",
+    description="This endpoint is used to get a trade cycle proposed by the trade matcher. Every participant accepts or declines the leg of the cycle they receive, the games move once everyone accepted",
+)
+async def get_cycle(cycleID: PydanticObjectId):
+    cycle = await TradeCycle.get(cycleID)
+    if cycle is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Trade cycle not found",
+        )
+    return FastJSONResponse(cycle)
 
 
 @router.get(
@@ -167,10 +283,20 @@ async def get_user_declined_trades(user: User = Depends(get_current_user)):
     response_model=TradeOffer,
     status_code=status.HTTP_200_OK,
     summary="Get a trade",
-    description="This endpoint is used to get a trade by ID",
+    description="This endpoint is used to get a trade by ID, archived trades included. Use `expand` to get the users and games inlined instead of their links",
 )
-async def get_trade(tradeID: PydanticObjectId):
-    return await TradeOffer.get(tradeID)
+async def get_trade(
+    tradeID: PydanticObjectId,
+    expander: Expander = Depends(expand_params("offerer", "receiver", "games")),
+):
+    trade = await find_trade(tradeID)
+    if trade is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Trade not found",
+        )
+    await expander.trades([trade])
+    return FastJSONResponse(trade)
 
 
 @router.post(
@@ -178,38 +304,15 @@ async def get_trade(tradeID: PydanticObjectId):
     response_model=TradeOffer,
     status_code=status.HTTP_200_OK,
     summary="Accept a trade",
-    description="This endpoint is used to accept a trade by ID",
+    description="This endpoint is used to accept a trade by ID. Either every game in the trade changes owner or none does, 409 is returned if the games changed owner since the offer was made. Accepting a leg of a trade cycle accepts the whole cycle, its games move once every participant accepted",
 )
 async def accept_trade(
     tradeID: PydanticObjectId, user: User = Depends(get_current_user)
 ):
-    trade = await TradeOffer.get(tradeID)
-    if trade.status != TradeStatus.pending:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="This trade is not pending",
-        )
-    if trade.receiver != generate_url("users", user.id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not the receiver of this trade",
-        )
-    offerer = await User.get(trade.offerer.split("/")[-1])
-    trade.status = TradeStatus.accepted
-    for game in trade.offererGames:
-        user.games.append(game)
-        for userGame in offerer.games:
-            if userGame.id == game.id:
-                offerer.games.remove(userGame)
-    for game in trade.receiverGames:
-        offerer.games.append(game)
-        for userGame in user.games:
-            if userGame.id == game.id:
-                user.games.remove(userGame)
-    await user.save()
-    await offerer.save()
-    await trade.save()
-    return trade
+    trade = await tradeService.accept_trade(tradeID, user.id)
+    if trade.status == TradeStatus.accepted:
+        await notificationService.trade_answered(trade)
+    return FastJSONResponse(trade)
 
 
 @router.post(
@@ -217,22 +320,11 @@ async def accept_trade(
     response_model=TradeOffer,
     status_code=status.HTTP_200_OK,
     summary="Decline a trade",
-    description="This endpoint is used to decline a trade by ID",
+    description="This endpoint is used to decline a trade by ID. Declining a leg of a trade cycle declines every leg of it",
 )
 async def decline_trade(
     tradeID: PydanticObjectId, user: User = Depends(get_current_user)
 ):
-    trade = await TradeOffer.get(tradeID)
-    if trade.status != TradeStatus.pending:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="This trade is not pending",
-        )
-    if trade.receiver != generate_url("users", user.id):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not the receiver of this trade",
-        )
-    trade.status = TradeStatus.declined
-    await trade.save()
-    return trade
+    trade = await tradeService.decline_trade(tradeID, user.id)
+    await notificationService.trade_answered(trade)
+    return FastJSONResponse(trade)
@@ -1,13 +1,40 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Body
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import StreamingResponse
 from beanie import PydanticObjectId
-from models.userModel import User, UserOut, UserRegister, UserUpdate, UserNewPassword
-from models.gameModel import OwnedGame, GameAbstract
+from pymongo.errors import DuplicateKeyError
+from models.userModel import (
+    User,
+    UserOut,
+    UserOutProjection,
+    UserRegister,
+    UserUpdate,
+    UserNewPassword,
+    UserPasswordReset,
+    UserSortField,
+)
+from models.gameModel import OwnedGame
+from models.wishlistModel import WishlistEntry
+from models.pageModel import Page, SortOrder, DeleteConfirmation
 from models import Tags
 from decouple import config
 from datetime import timedelta
-from dependencies import create_access_token, get_current_user, generate_url
-import bcrypt
+from typing import Optional
+from dependencies import (
+    create_access_token,
+    get_current_user,
+    get_current_admin,
+    get_user,
+    get_user_by_email,
+    generate_url,
+    PageParams,
+    paginate,
+)
+from services.passwordService import passwordHasher
+from services.notificationService import request_password_reset
+from services.exportService import ndjson_export
+from services.matchService import holdings_changed
+from services.responseService import FastJSONResponse, output
 
 router = APIRouter(
     prefix="/users",
@@ -33,11 +60,14 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    user = await User.find_one(User.email == form_data.username)
+    user = await get_user_by_email(form_data.username)
     if user:
-        if bcrypt.checkpw(
-            form_data.password.encode("utf-8"), user.password.encode("utf-8")
-        ):
+        if await passwordHasher.verify(form_data.password, user.password):
+            if passwordHasher.needs_rehash(user.password):
+                # the configured cost changed since this hash was made
+                await user.set(
+                    {User.password: await passwordHasher.hash(form_data.password)}
+                )
             access_token_expires = timedelta(
                 minutes=int(config("ACCESS_TOKEN_EXPIRE_MINUTES"))
             )
@@ -60,7 +90,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     description="This endpoint is used to test the authentication, returns the current full user object",
 )
 async def test(user: User = Depends(get_current_user)):
-    return user
+    return FastJSONResponse(user)
 
 
 # Create
@@ -73,33 +103,53 @@ async def test(user: User = Depends(get_current_user)):
     tags=[Tags.Auth],
 )
 async def create_user(newUser: UserRegister):
-    user = await User(
-        id=PydanticObjectId(),
-        username=newUser.username,
-        email=newUser.email,
-        password=bcrypt.hashpw(
-            newUser.password.encode("utf-8"),
-            bcrypt.gensalt(),
-        ),
-        street_address=newUser.street_address,
-    ).create()
-    # TODO: Hash password
-    return UserOut(**user.dict())
+    try:
+        user = await User(
+            id=PydanticObjectId(),
+            username=newUser.username,
+            email=newUser.email,
+            password=await passwordHasher.hash(newUser.password),
+            street_address=newUser.street_address,
+        ).create()
+    except DuplicateKeyError:  # unique index on email
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Email already registered",
+        )
+    return FastJSONResponse(output(UserOut, user), status_code=status.HTTP_201_CREATED)
 
 
 @router.get(
     "",
-    response_model=list[UserOut],
+    response_model=Page[UserOut],
     status_code=status.HTTP_200_OK,
     summary="Get all users",
-    description="This endpoint is used to get all users",
+    description="This endpoint is used to get all users, one page at a time. Follow the `next` link to get the following page",
     tags=[Tags.Users],
 )
-async def get_users():
-    userList: list[UserOut] = []
-    async for user in User.find_all():
-        userList.append(UserOut(**user.dict()))
-    return userList
+async def get_users(
+    page: PageParams = Depends(),
+    sort: UserSortField = UserSortField.id,
+    order: SortOrder = SortOrder.asc,
+):
+    users, nextCursor = await paginate(
+        User.find_all().project(UserOutProjection), page, sort.value, order
+    )
+    nextLink = None
+    if nextCursor is not None:
+        nextLink = generate_url(
+            "users",
+            query={
+                "after": nextCursor,
+                "limit": page.limit,
+                "sort": sort.value,
+                "order": order.value,
+            },
+        )
+    userList = [output(UserOut, user) for user in users]
+    return FastJSONResponse(
+        Page[UserOut].construct(items=userList, count=len(userList), next=nextLink)
+    )
 
 
 @router.patch(
@@ -112,13 +162,10 @@ async def get_users():
 async def change_password(
     body: UserNewPassword, currentUser: User = Depends(get_current_user)
 ):
-    if bcrypt.checkpw(
-        body.oldPassword.encode("utf-8"), currentUser.password.encode("utf-8")
-    ):
-        currentUser.password = bcrypt.hashpw(
-            body.newPassword.encode("utf-8"), bcrypt.gensalt()
+    if await passwordHasher.verify(body.oldPassword, currentUser.password):
+        await currentUser.set(
+            {User.password: await passwordHasher.hash(body.newPassword)}
         )
-        await currentUser.save()
     else:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -126,95 +173,42 @@ async def change_password(
         )
 
 
-# LIBRARY FUNCTIONS
 @router.post(
-    "/library",
-    response_model=list[OwnedGame],
-    status_code=status.HTTP_201_CREATED,
-    tags=[Tags.Library],
-    summary="Add game to library",
-    description="This endpoint is used to add a game to the current user's library",
+    "/reset-password",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Reset password",
+    description="This endpoint is used to get a temporary password mailed to the given address. The answer is the same whether the address is registered or not, and at most one mail is sent per minute",
+    tags=[Tags.Auth],
 )
-async def add_game(
-    gameIn: OwnedGame = Body(
-        example={"game": PydanticObjectId(), "name": "Game Name", "condition": "Good"}
-    ),
-    currentUser: User = Depends(get_current_user),
-):
-    gameAbstract = await GameAbstract.get(gameIn.game)
-    if gameAbstract is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Incorrect username or password",
-        )
-    newGameObject = OwnedGame(
-        id=PydanticObjectId(),
-        game=generate_url("games", gameIn.game),
-        name=gameAbstract.name,
-        condition=gameIn.condition,
-        owner=generate_url("users", currentUser.id),
-        ownerHistory=[generate_url("users", currentUser.id)],
+async def reset_password(body: UserPasswordReset):
+    user = await get_user_by_email(body.email)
+    if user is not None:
+        # generated, hashed and mailed by a background job
+        await request_password_reset(user)
+    return FastJSONResponse(
+        {"detail": "A temporary password was mailed to this address if it is known"},
+        status_code=status.HTTP_202_ACCEPTED,
     )
-    currentUser.games.append(newGameObject)
-    await currentUser.save()
-    return currentUser.games
 
 
 @router.get(
-    "/library",
-    response_model=list[OwnedGame],
+    "/export",
     status_code=status.HTTP_200_OK,
-    tags=[Tags.Library],
-    summary="Get library",
-    description="This endpoint is used to get the current user's library",
-)
-async def get_library(currentUser: User = Depends(get_current_user)):
-    return currentUser.games
-
-
-@router.delete(
-    "/library/{gameID}",
-    tags=[Tags.Library],
-    status_code=status.HTTP_202_ACCEPTED,
-    response_model=list[OwnedGame],
-    summary="Delete game from library",
-    description="This endpoint is used to delete a game from the current user's library",
-)
-async def delete_game(
-    gameID: PydanticObjectId, currentUser: User = Depends(get_current_user)
-):
-    gameAbstract = await GameAbstract.get(gameID)
-    for game in currentUser.games:
-        if game.id == gameID:
-            currentUser.games.remove(game)
-            await currentUser.save()
-            return currentUser.games
-    raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="Game not found",
-    )
-
-
-@router.put(
-    "/library/{gameID}",
-    tags=[Tags.Library],
-    status_code=status.HTTP_202_ACCEPTED,
-    response_model=OwnedGame,
-    summary="Update game in library",
-    description="This endpoint is used to update a game in the current user's library (the only editible data is the condition)",
+    summary="Export all users",
+    description="Admin only. This endpoint streams every user (without their password) as newline delimited json, ordered by id. Pass the id of the last user received as `after` to resume an interrupted export, and `gzip=true` to get a compressed stream",
+    tags=[Tags.Users],
+    response_class=StreamingResponse,
 )
-async def update_game(
-    gameID: PydanticObjectId,
-    gameIn: OwnedGame = Body(example={"condition": "Good"}),
-    currentUser: User = Depends(get_current_user),
+async def export_users(
+    after: Optional[PydanticObjectId] = None,
+    gzip: bool = False,
+    admin: User = Depends(get_current_admin),
 ):
-    for game in currentUser.games:
-        if game.id == gameID:
-            game.condition = gameIn.condition
-            return await currentUser.save()
-    raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="Game not found",
+    return ndjson_export(
+        User.get_motor_collection(),
+        projection={"password": 0},
+        after=after,
+        gzip=gzip,
     )
 
 
@@ -230,8 +224,13 @@ async def update_game(
     tags=[Tags.Users],
 )
 async def get_users(userID: PydanticObjectId):
-    user = await User.get(userID)
-    return UserOut(**user.dict())
+    user = await get_user(userID)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    return FastJSONResponse(output(UserOut, user))
 
 
 # Update
@@ -244,45 +243,53 @@ async def get_users(userID: PydanticObjectId):
     tags=[Tags.Users],
 )
 async def update_user(userID: PydanticObjectId, userIn: UserUpdate):
-    user = await User.get(userID)
+    user = await get_user(userID)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
 
-    if not bcrypt.checkpw(
-        userIn.password.encode("utf-8"), user.password.encode("utf-8")
-    ):
+    if not await passwordHasher.verify(userIn.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect password",
         )
 
-    if userIn.username is not None:
-        user.username = userIn.username
-    if userIn.first_name is not None:
-        user.first_name = userIn.first_name
-    if userIn.last_name is not None:
-        user.last_name = userIn.last_name
-    if userIn.date_of_birth is not None:
-        user.date_of_birth = userIn.date_of_birth
-    if userIn.street_address is not None:
-        user.street_address = userIn.street_address
-    if userIn.games is not None:
-        user.games = userIn.games
-    await user.save()
-    return UserOut(**user.dict())
+    changes = userIn.dict(exclude={"password"}, exclude_none=True)
+    if changes:
+        await user.set(changes)
+    return FastJSONResponse(output(UserOut, user), status_code=status.HTTP_202_ACCEPTED)
 
 
 # Delete
 @router.delete(
     "/{userID}",
-    response_model=list[UserOut],
+    response_model=DeleteConfirmation,
     status_code=status.HTTP_202_ACCEPTED,
     summary="Delete user",
-    description="This endpoint is used to delete a user by ID",
+    description="This endpoint is used to delete a user by ID along with their library and wishlist, it returns a confirmation with a link to the remaining users. Users with games being traded can't be deleted until the trade settles",
     tags=[Tags.Users],
 )
 async def delete_user(userID: PydanticObjectId):
-    user = await User.get(userID)
+    user = await get_user(userID)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    if await OwnedGame.find_one(
+        OwnedGame.owner == user.id, OwnedGame.tradeLock != None
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="User has games being traded",
+        )
     await user.delete()
-    userList: list[UserOut] = []
-    async for user in User.find_all():
-        userList.append(UserOut(**user.dict()))
-    return userList
+    await OwnedGame.find(OwnedGame.owner == user.id).delete()
+    await WishlistEntry.find(WishlistEntry.user == user.id).delete()
+    await holdings_changed(user.id)
+    return FastJSONResponse(
+        DeleteConfirmation(id=userID, collection=generate_url("users")),
+        status_code=status.HTTP_202_ACCEPTED,
+    )
@@ -0,0 +1,142 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Body
+from beanie import PydanticObjectId
+from pymongo.errors import DuplicateKeyError
+from dependencies import (
+    get_current_user,
+    get_user,
+    get_game,
+    generate_url,
+    expand_params,
+    PageParams,
+    paginate,
+)
+from models.userModel import User
+from models.wishlistModel import WishlistEntry, WishlistEntryIn
+from models.pageModel import Page, DeleteConfirmation
+from models import Tags
+from services.responseService import FastJSONResponse
+from services.expandService import Expander
+from services.matchService import holdings_changed
+
+# The games a user wants, what the trade matcher (services/matchService.py)
+# looks for in the libraries of the other users
+router = APIRouter(
+    prefix="/users",
+    responses={
+        404: {"description": "Not found"},
+        500: {"description": "Server Error"},
+    },
+    tags=[Tags.Wishlist],
+)
+
+
+async def wishlist_page(
+    user: User, page: PageParams, resource: str, expander: Expander
+):
+    entries, nextCursor = await paginate(
+        WishlistEntry.find(WishlistEntry.user == user.id), page
+    )
+    nextLink = None
+    if nextCursor is not None:
+        nextLink = generate_url(
+            resource,
+            query={
+                "after": nextCursor,
+                "limit": page.limit,
+                "expand": expander.query(),
+            },
+        )
+    await expander.wishlist(entries)
+    return FastJSONResponse(
+        Page[WishlistEntry].construct(items=entries, count=len(entries), next=nextLink)
+    )
+
+
+@router.post(
+    "/wishlist",
+    response_model=WishlistEntry,
+    status_code=status.HTTP_201_CREATED,
+    summary="Add game to wishlist",
+    description="This endpoint is used to add a game to the current user's wishlist, 409 is returned if it is already there",
+)
+async def add_wish(
+    wishIn: WishlistEntryIn = Body(example={"game": PydanticObjectId()}),
+    currentUser: User = Depends(get_current_user),
+):
+    gameAbstract = await get_game(wishIn.game)
+    if gameAbstract is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Game not found",
+        )
+    entry = WishlistEntry(user=currentUser.id, game=gameAbstract.id)
+    try:
+        await entry.insert()
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="This game is already in your wishlist",
+        )
+    await holdings_changed(currentUser.id)
+    return FastJSONResponse(entry, status_code=status.HTTP_201_CREATED)
+
+
+@router.get(
+    "/wishlist",
+    response_model=Page[WishlistEntry],
+    status_code=status.HTTP_200_OK,
+    summary="Get wishlist",
+    description="This endpoint is used to get the current user's wishlist, one page at a time. Use `expand` to get the games inlined instead of their links",
+)
+async def get_wishlist(
+    page: PageParams = Depends(),
+    expander: Expander = Depends(expand_params("games")),
+    currentUser: User = Depends(get_current_user),
+):
+    return await wishlist_page(currentUser, page, "users/wishlist", expander)
+
+
+@router.delete(
+    "/wishlist/{gameID}",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=DeleteConfirmation,
+    summary="Remove game from wishlist",
+    description="This endpoint is used to remove a game, by the id of the abstract game, from the current user's wishlist",
+)
+async def delete_wish(
+    gameID: PydanticObjectId, currentUser: User = Depends(get_current_user)
+):
+    deleted = await WishlistEntry.get_motor_collection().delete_one(
+        {"user": currentUser.id, "game": gameID}
+    )
+    if deleted.deleted_count == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Game not in wishlist",
+        )
+    await holdings_changed(currentUser.id)
+    return FastJSONResponse(
+        DeleteConfirmation(id=gameID, collection=generate_url("users/wishlist")),
+        status_code=status.HTTP_202_ACCEPTED,
+    )
+
+
+@router.get(
+    "/{userID}/wishlist",
+    response_model=Page[WishlistEntry],
+    status_code=status.HTTP_200_OK,
+    summary="Get a user's wishlist",
+    description="This endpoint is used to get the wishlist of any user, one page at a time. Use `expand` to get the games inlined instead of their links",
+)
+async def get_user_wishlist(
+    userID: PydanticObjectId,
+    page: PageParams = Depends(),
+    expander: Expander = Depends(expand_params("games")),
+):
+    user = await get_user(userID)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    return await wishlist_page(user, page, f"users/{userID}/wishlist", expander)
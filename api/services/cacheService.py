@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from fastapi import Request, Response, status
+from pydantic import BaseModel
+from typing import Any, Hashable, Optional
+from decouple import config
+from services.invalidationBus import invalidationBus
+from services.responseService import dumps
+from services.linkService import base_url
+import hashlib
+import time
+
+
+class TTLCache:
+    """
+    Bounded in-process cache, least recently used entries are evicted once the
+    capacity is reached and entries older than the ttl (seconds) are ignored.
+    """
+
+    def __init__(self, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Users are cached under ("id", id), requests are authenticated by email so
+# ("email", email) maps to the id. Neither can change, so invalidating a user
+# only needs its id, which is all the invalidation bus sends. Every user write
+# bumps a generation number, a read that began before a write may have fetched
+# the old document, so it is only cached if the generation is unchanged
+userCache = TTLCache(
+    capacity=config("USER_CACHE_SIZE", default=10_000, cast=int),
+    ttl=config("USER_CACHE_TTL", default=300, cast=float),
+)
+userGeneration = 0
+
+
+def user_generation() -> int:
+    return userGeneration
+
+
+def cache_user(user, generation: int):
+    if generation != userGeneration:
+        return
+    userCache.set(("id", str(user.id)), user)
+    userCache.set(("email", user.email), str(user.id))
+
+
+def invalidate_user(userId: str):
+    global userGeneration
+    userCache.invalidate(("id", userId))
+    userGeneration += 1
+
+
+# Games are cached as (game, etag, rendered json) under ("game", id). Listings
+# and searches are cached rendered, their keys include a generation number that
+# every game write bumps, so one write makes all of them unreachable at once.
+# Listings contain links, so their keys also include the base url they use
+gameCache = TTLCache(
+    capacity=config("GAME_CACHE_SIZE", default=20_000, cast=int),
+    ttl=config("GAME_CACHE_TTL", default=600, cast=float),
+)
+gameListGeneration = 0
+
+
+def game_list_key(*parts: Hashable) -> tuple:
+    return ("list", gameListGeneration, base_url(), *parts)
+
+
+def invalidate_game(gameId: str):
+    global gameListGeneration
+    gameCache.invalidate(("game", gameId))
+    gameListGeneration += 1
+
+
+# called for writes on this replica and, through the bus, on the others
+invalidationBus.subscribe("User", invalidate_user)
+invalidationBus.subscribe("GameAbstract", invalidate_game)
+
+
+# ------------------------- CONDITIONAL GET ------------------------- #
+
+
+def render_json(model: BaseModel) -> tuple[str, bytes]:
+    """Serialises a response once, returns its ETag and body"""
+    body = dumps(model)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    return etag, body
+
+
+def conditional_response(request: Request, etag: str, body: bytes) -> Response:
+    headers = {"ETag": etag}
+    ifNoneMatch = request.headers.get("if-none-match")
+    if ifNoneMatch is not None and (
+        ifNoneMatch.strip() == "*"
+        or etag in [tag.strip() for tag in ifNoneMatch.split(",")]
+    ):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,127 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from services.metricsService import commandMetrics
+from models.userModel import User
+from models.gameModel import GameAbstract, OwnedGame
+from models.tradeModel import ArchivedTrade, TradeOffer, TradeCycle
+from models.wishlistModel import WishlistEntry
+from models.jobModel import Job
+from decouple import config
+import asyncio
+import threading
+import time
+
+MAX_POOL_SIZE = config("MONGO_MAX_POOL_SIZE", default=100, cast=int)
+MIN_POOL_SIZE = config("MONGO_MIN_POOL_SIZE", default=10, cast=int)
+PING_TIMEOUT = 2  # seconds before a health check gives up on the database
+# the collections of the API, given to init_beanie
+DOCUMENT_MODELS = [
+    User,
+    GameAbstract,
+    OwnedGame,
+    TradeOffer,
+    ArchivedTrade,
+    TradeCycle,
+    WishlistEntry,
+    Job,
+]
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+    Counts the connections of the Mongo pool, pymongo doesn't expose them.
+    The events come from pymongo's threads, hence the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checkedOut = 0
+        self.waiting = 0
+        self.checkoutFailures = 0
+
+    def _add(self, **changes):
+        with self._lock:
+            for name, change in changes.items():
+                setattr(self, name, getattr(self, name) + change)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkoutFailures=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, checkedOut=1)
+
+    def connection_checked_in(self, event):
+        self._add(checkedOut=-1)
+
+    def stats(self) -> dict:
+        return {
+            "open": self.open,
+            "checkedOut": self.checkedOut,
+            "waiting": self.waiting,
+            "checkoutFailures": self.checkoutFailures,
+            "maxPoolSize": MAX_POOL_SIZE,
+            "minPoolSize": MIN_POOL_SIZE,
+            "utilisation": round(self.checkedOut / MAX_POOL_SIZE, 3),
+        }
+
+
+poolMonitor = PoolMonitor()
+
+
+def create_client() -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        config("MONGO_URI"),
+        maxPoolSize=MAX_POOL_SIZE,
+        minPoolSize=MIN_POOL_SIZE,
+        maxIdleTimeMS=config("MONGO_MAX_IDLE_MS", default=300_000, cast=int),
+        # how long a request waits for a free connection before failing
+        waitQueueTimeoutMS=config(
+            "MONGO_WAIT_QUEUE_TIMEOUT_MS", default=5000, cast=int
+        ),
+        connectTimeoutMS=config("MONGO_CONNECT_TIMEOUT_MS", default=5000, cast=int),
+        serverSelectionTimeoutMS=config(
+            "MONGO_SERVER_SELECTION_TIMEOUT_MS", default=5000, cast=int
+        ),
+        event_listeners=[poolMonitor, commandMetrics],
+    )
+
+
+async def ping(client: AsyncIOMotorClient) -> float:
+    """Round trip to the database in milliseconds"""
+    start = time.perf_counter()
+    await asyncio.wait_for(client.admin.command("ping"), PING_TIMEOUT)
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+async def warm_up(client: AsyncIOMotorClient):
+    """
+    Opens the minimum number of connections before the first request, pymongo
+    would otherwise open them lazily in the background. Concurrent pings each
+    need their own connection.
+    """
+    await asyncio.gather(*[ping(client) for _ in range(MIN_POOL_SIZE)])
@@ -0,0 +1,135 @@
+"""
+?expand= support.
+
+Responses reference users and games by link, with ?expand= the referenced
+documents are inlined in place of their link. They are fetched by per request
+BatchLoaders: the references asked for while a response is expanded are
+deduplicated and loaded with one $in query per collection. Documents already
+in the user or game cache are not fetched at all.
+"""
+from beanie.operators import In
+from typing import Awaitable, Callable, Optional
+from models.userModel import User, UserOut, UserOutProjection
+from models.gameModel import GameAbstract, OwnedGameOut
+from models.tradeModel import TradeOffer
+from models.wishlistModel import WishlistEntry
+from services.cacheService import userCache, gameCache
+from services.responseService import output
+import asyncio
+
+
+class BatchLoader:
+    """
+    Dataloader, the load() calls made before the event loop gets back to it
+    are answered by a single call of the batch function. Every key is loaded
+    at most once per loader.
+    """
+
+    def __init__(self, batch: Callable[[list], Awaitable[dict]]):
+        self._batch = batch
+        self._futures: dict = {}
+        self._queue: list = []
+        self._dispatch: Optional[asyncio.Task] = None
+
+    def load(self, key) -> asyncio.Future:
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[key] = loop.create_future()
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                # runs once every task that is ready has queued its keys
+                self._dispatch = loop.create_task(self._run())
+        return future
+
+    async def _run(self):
+        keys, self._queue = self._queue, []
+        try:
+            found = await self._batch(keys)
+        except Exception as exception:
+            for key in keys:
+                self._futures[key].set_exception(exception)
+            return
+        for key in keys:
+            self._futures[key].set_result(found.get(key))
+
+
+async def load_users(ids: list) -> dict:
+    found = {}
+    missing = []
+    for id in ids:
+        user = userCache.get(("id", str(id)))
+        if user is not None:
+            found[id] = output(UserOut, user)
+        else:
+            missing.append(id)
+    if missing:
+        query = User.find(In(User.id, missing)).project(UserOutProjection)
+        async for user in query:
+            found[user.id] = output(UserOut, user)
+    return found
+
+
+async def load_games(ids: list) -> dict:
+    found = {}
+    missing = []
+    for id in ids:
+        entry = gameCache.get(("game", str(id)))
+        if entry is not None:
+            found[id] = entry[0]
+        else:
+            missing.append(id)
+    if missing:
+        async for game in GameAbstract.find(In(GameAbstract.id, missing)):
+            found[game.id] = game
+    return found
+
+
+class Expander:
+    """
+    The references a request asked to expand, and the loaders resolving them.
+    Expanding replaces a link by its document, a deleted document keeps its
+    link.
+    """
+
+    def __init__(self, fields: set[str]):
+        self.fields = fields
+        self.users = BatchLoader(load_users)
+        self.games = BatchLoader(load_games)
+
+    async def _inline(self, model, field: str, loader: BatchLoader):
+        reference = getattr(model, field)
+        if reference is not None:
+            setattr(model, field, await loader.load(reference) or reference)
+
+    def _owned_game(self, game: OwnedGameOut) -> list[Awaitable]:
+        jobs = []
+        if "games" in self.fields:
+            jobs.append(self._inline(game, "game", self.games))
+        if "owner" in self.fields:
+            jobs.append(self._inline(game, "owner", self.users))
+        return jobs
+
+    async def owned_games(self, games: list[OwnedGameOut]):
+        jobs = [job for game in games for job in self._owned_game(game)]
+        await asyncio.gather(*jobs)
+
+    async def trades(self, trades: list[TradeOffer]):
+        jobs = []
+        for trade in trades:
+            for field in ("offerer", "receiver"):
+                if field in self.fields:
+                    jobs.append(self._inline(trade, field, self.users))
+            for game in trade.offererGames + trade.receiverGames:
+                jobs += self._owned_game(game)
+        await asyncio.gather(*jobs)
+
+    async def wishlist(self, entries: list[WishlistEntry]):
+        if "games" in self.fields:
+            await asyncio.gather(
+                *(self._inline(entry, "game", self.games) for entry in entries)
+            )
+
+    def query(self) -> Optional[str]:
+        """The ?expand= value, for the next page link"""
+        return ",".join(sorted(self.fields)) or None
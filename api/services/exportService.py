@@ -0,0 +1,63 @@
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorCollection
+from beanie import PydanticObjectId
+from typing import Optional
+import orjson
+import zlib
+
+BATCH_SIZE = 500
+
+
+def _encode(value):
+    return str(value)  # ObjectId and anything else bson specific
+
+
+async def _ndjson_chunks(
+    collection: AsyncIOMotorCollection,
+    filter: dict,
+    projection: Optional[dict],
+    after: Optional[PydanticObjectId],
+):
+    # sorted by _id so the last _id a client received is a resume token
+    if after is not None:
+        filter = {"$and": [filter, {"_id": {"$gt": after}}]}
+    cursor = collection.find(filter, projection, sort=[("_id", 1)])
+    lines = []
+    async for document in cursor.batch_size(BATCH_SIZE):
+        lines.append(orjson.dumps(document, default=_encode))
+        if len(lines) == BATCH_SIZE:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+async def _gzipped(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def ndjson_export(
+    collection: AsyncIOMotorCollection,
+    filter: Optional[dict] = None,
+    projection: Optional[dict] = None,
+    after: Optional[PydanticObjectId] = None,
+    gzip: bool = False,
+) -> StreamingResponse:
+    """
+    Streams a collection as newline delimited json, one document per line,
+    reading it from the cursor batch by batch so memory use doesn't depend
+    on the size of the collection
+    """
+    chunks = _ndjson_chunks(collection, filter or {}, projection, after)
+    headers = {}
+    if gzip:
+        chunks = _gzipped(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        chunks, media_type="application/x-ndjson", headers=headers
+    )
@@ -0,0 +1,207 @@
+"""
+Checks that the hot queries of the API are served by an index.
+
+The indexes themselves are declared in the `Settings` of the models and
+created by `init_beanie`, this runs `explain()` on the shape of every query
+the API makes on a request path and reports the ones that scan a whole
+collection. It runs at startup and can be run by hand from the api directory:
+
+    python -m services.indexService
+"""
+from beanie import Document, init_beanie
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
+from decouple import config
+from models.userModel import User
+from models.gameModel import GameAbstract, OwnedGame
+from models.tradeModel import ArchivedTrade, TradeOffer, TradeCycle
+from models.wishlistModel import WishlistEntry
+from models.jobModel import Job
+from services.databaseService import DOCUMENT_MODELS
+from datetime import datetime
+from typing import NamedTuple, Optional
+import asyncio
+import sys
+
+# placeholder values, the plan only depends on the shape of the query
+EMAIL = "someone@example.com"
+USER_ID = ObjectId("000000000000000000000000")
+GAME_ID = ObjectId("000000000000000000000001")
+CYCLE_ID = ObjectId("000000000000000000000002")
+
+
+class HotQuery(NamedTuple):
+    name: str
+    model: type[Document]
+    filter: dict
+    sort: Optional[list[tuple[str, int]]] = None
+
+
+HOT_QUERIES = [
+    HotQuery("login / current user by email", User, {"email": EMAIL}),
+    HotQuery(
+        "users by username", User, {}, [("username", ASCENDING), ("_id", ASCENDING)]
+    ),
+    HotQuery(
+        "games by name", GameAbstract, {}, [("name", ASCENDING), ("_id", ASCENDING)]
+    ),
+    HotQuery(
+        "games by publisher",
+        GameAbstract,
+        {"publisher": "Nintendo"},
+        [("_id", ASCENDING)],
+    ),
+    HotQuery(
+        "games by platform", GameAbstract, {"platforms": "NES"}, [("_id", ASCENDING)]
+    ),
+    HotQuery(
+        "games by tags",
+        GameAbstract,
+        {"tags": {"$all": ["RPG", "Action"]}},
+        [("_id", ASCENDING)],
+    ),
+    HotQuery(
+        "games by release date",
+        GameAbstract,
+        {"release_date": {"$gte": "1985-01-01", "$lte": "1995-12-31"}},
+        [("release_date", ASCENDING), ("_id", ASCENDING)],
+    ),
+    HotQuery("game search", GameAbstract, {"$text": {"$search": "mario"}}),
+    HotQuery(
+        "library of a user", OwnedGame, {"owner": USER_ID}, [("_id", ASCENDING)]
+    ),
+    HotQuery("owners of a game", OwnedGame, {"game": GAME_ID}, [("_id", ASCENDING)]),
+    HotQuery(
+        "owners of a game by condition",
+        OwnedGame,
+        {"game": GAME_ID, "condition": "Good"},
+        [("_id", ASCENDING)],
+    ),
+    HotQuery("copies locked by a trade", OwnedGame, {"tradeLock": {"$ne": None}}),
+    HotQuery(
+        "trades made by status",
+        TradeOffer,
+        {"offerer": USER_ID, "status": "pending"},
+        [("timeOfRequest", DESCENDING)],
+    ),
+    HotQuery(
+        "trades received by status",
+        TradeOffer,
+        {"receiver": USER_ID, "status": "pending"},
+        [("timeOfRequest", DESCENDING)],
+    ),
+    HotQuery(
+        "all trades of a user",
+        TradeOffer,
+        {"$or": [{"offerer": USER_ID}, {"receiver": USER_ID}]},
+        [("timeOfRequest", DESCENDING)],
+    ),
+    HotQuery(
+        "stalled trade accepts",
+        TradeOffer,
+        {"status": "pending", "settlingSince": {"$lt": datetime.utcnow()}},
+    ),
+    HotQuery("legs of a trade cycle", TradeOffer, {"cycle": CYCLE_ID}),
+    HotQuery(
+        "pending trades to expire",
+        TradeOffer,
+        {
+            "status": "pending",
+            "timeOfClosing": None,
+            "timeOfRequest": {"$lt": datetime.utcnow()},
+        },
+    ),
+    HotQuery(
+        "closed trades to archive",
+        TradeOffer,
+        {
+            "status": {"$in": ["accepted", "declined", "expired"]},
+            "$or": [
+                {"timeOfClosing": {"$lt": datetime.utcnow()}},
+                {"timeOfClosing": None, "timeOfRequest": {"$lt": datetime.utcnow()}},
+            ],
+        },
+    ),
+    HotQuery(
+        "archived trades of a user",
+        ArchivedTrade,
+        {"$or": [{"offerer": USER_ID}, {"receiver": USER_ID}]},
+        [("timeOfRequest", DESCENDING)],
+    ),
+    HotQuery("pending trade cycles", TradeCycle, {"status": "pending"}),
+    HotQuery(
+        "declined cycle of the same copies",
+        TradeCycle,
+        {"key": f"{GAME_ID},{CYCLE_ID}", "status": "declined"},
+    ),
+    HotQuery(
+        "wishlist of a user", WishlistEntry, {"user": USER_ID}, [("_id", ASCENDING)]
+    ),
+    HotQuery(
+        "due jobs",
+        Job,
+        {
+            "status": {"$in": ["queued", "running"]},
+            "runAt": {"$lte": datetime.utcnow()},
+        },
+        [("runAt", ASCENDING)],
+    ),
+]
+
+
+def plan_stages(plan: dict) -> list[str]:
+    """Every stage of a winning plan, outermost first"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    # slot based (SBE) plans wrap the classic plan in queryPlan
+    children = [plan[key] for key in ("queryPlan", "inputStage") if key in plan]
+    children += plan.get("inputStages", [])
+    for child in children:
+        stages += plan_stages(child)
+    return stages
+
+
+async def explain_hot_queries() -> list[dict]:
+    report = []
+    for query in HOT_QUERIES:
+        cursor = query.model.get_motor_collection().find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        explanation = await cursor.limit(1).explain()
+        stages = plan_stages(explanation["queryPlanner"]["winningPlan"])
+        report.append(
+            {
+                "query": query.name,
+                "collection": query.model.get_motor_collection().name,
+                "stages": stages,
+                "collscan": "COLLSCAN" in stages,
+            }
+        )
+    return report
+
+
+async def verify_indexes():
+    """Raises if any hot query falls back to a collection scan"""
+    scans = [entry for entry in await explain_hot_queries() if entry["collscan"]]
+    if scans:
+        raise RuntimeError(
+            "Hot queries without an index: "
+            + ", ".join(f"{entry['query']} ({entry['collection']})" for entry in scans)
+        )
+
+
+async def main() -> int:
+    client = AsyncIOMotorClient(config("MONGO_URI"))
+    # creates any missing index, like the API does when it starts
+    await init_beanie(database=client.RetroGames, document_models=DOCUMENT_MODELS)
+    report = await explain_hot_queries()
+    for entry in report:
+        flag = "COLLSCAN" if entry["collscan"] else "ok"
+        stages = " > ".join(entry["stages"])
+        print(f"{flag:<9} {entry['collection']:<11} {entry['query']:<32} {stages}")
+    client.close()
+    return 1 if any(entry["collscan"] for entry in report) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
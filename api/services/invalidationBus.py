@@ -0,0 +1,195 @@
+"""
+Broadcasts "document X of model Y changed" between the API replicas so each
+one can drop its cached copy.
+
+Every event carries a version stamp from a hybrid logical clock
+(milliseconds, counter, replica id). A replica remembers the events it has
+applied and only ignores one delivered twice, any other event evicts even if
+it arrives out of order.
+"""
+from pydantic import BaseModel
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+from bson import ObjectId
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# events remembered, forgetting one only means a late duplicate invalidates
+# an entry a second time
+MAX_TRACKED_EVENTS = 100_000
+
+
+class InvalidationEvent(BaseModel):
+    model: str
+    documentId: str
+    version: tuple[int, int, str]  # (milliseconds, counter, replica id)
+
+
+class VersionClock:
+    """Hybrid logical clock, versions only grow even if wall clocks disagree"""
+
+    def __init__(self, replicaId: str):
+        self.replicaId = replicaId
+        self.milliseconds = 0
+        self.counter = 0
+
+    def next(self) -> tuple[int, int, str]:
+        now = int(time.time() * 1000)
+        if now > self.milliseconds:
+            self.milliseconds, self.counter = now, 0
+        else:
+            self.counter += 1
+        return (self.milliseconds, self.counter, self.replicaId)
+
+    def observe(self, version: tuple[int, int, str]):
+        if (version[0], version[1]) > (self.milliseconds, self.counter):
+            self.milliseconds, self.counter = version[0], version[1]
+
+
+class MemoryTransport:
+    """
+    Delivers events to every bus attached to the same transport instance,
+    lets tests run several "replicas" inside one process
+    """
+
+    def __init__(self):
+        self._receivers: list[Callable] = []
+
+    async def start(self, receive: Callable):
+        self._receivers.append(receive)
+
+    async def publish(self, event: InvalidationEvent):
+        for receive in list(self._receivers):
+            await receive(event)
+
+    async def stop(self):
+        self._receivers.clear()
+
+
+class MongoTransport:
+    """
+    Events are inserted in a capped collection that every replica follows
+    with a tailable cursor, works on a standalone server (change streams
+    need a replica set)
+    """
+
+    def __init__(self, database, collectionName="Invalidations", size=8 * 1024**2):
+        self.database = database
+        self.collectionName = collectionName
+        self.size = size
+        self.collection = database[collectionName]
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, receive: Callable):
+        try:
+            await self.database.create_collection(
+                self.collectionName, capped=True, size=self.size
+            )
+            # a tailable cursor on an empty capped collection dies straight away
+            await self.collection.insert_one({"model": None})
+        except CollectionInvalid:
+            pass  # another replica created it
+        self._task = asyncio.create_task(self._tail(receive))
+
+    async def _tail(self, receive: Callable):
+        lastSeen = datetime.utcnow()
+        while True:
+            try:
+                # ObjectIds from different replicas are only roughly ordered,
+                # so a restarted cursor looks back a little and relies on the
+                # version stamps to drop what was already applied
+                since = ObjectId.from_datetime(lastSeen - timedelta(seconds=5))
+                cursor = self.collection.find(
+                    {"_id": {"$gt": since}, "model": {"$ne": None}},
+                    cursor_type=CursorType.TAILABLE_AWAIT,
+                )
+                while cursor.alive:
+                    async for document in cursor:
+                        lastSeen = document["_id"].generation_time.replace(tzinfo=None)
+                        document.pop("_id")
+                        await receive(InvalidationEvent(**document))
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("Invalidation tailer lost its cursor, retrying")
+            await asyncio.sleep(1)
+
+    async def publish(self, event: InvalidationEvent):
+        await self.collection.insert_one(event.dict())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class InvalidationBus:
+    def __init__(self, replicaId: Optional[str] = None):
+        self.replicaId = replicaId or uuid.uuid4().hex
+        self.clock = VersionClock(self.replicaId)
+        self.transport = None
+        self._handlers: dict[str, list[Callable[[str], None]]] = {}
+        self._applied: OrderedDict[tuple, None] = OrderedDict()
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    def subscribe(self, model: str, handler: Callable[[str], None]):
+        """handler(documentId) is called for local and remote changes"""
+        self._handlers.setdefault(model, []).append(handler)
+
+    def _apply(self, event: InvalidationEvent) -> bool:
+        # the version holds the replica id, equal keys are the same event
+        key = (event.model, event.documentId, tuple(event.version))
+        if key in self._applied:
+            return False
+        self._applied[key] = None
+        if len(self._applied) > MAX_TRACKED_EVENTS:
+            self._applied.popitem(last=False)
+        for handler in self._handlers.get(event.model, []):
+            handler(event.documentId)
+        return True
+
+    async def publish(self, model: str, documentId):
+        event = InvalidationEvent(
+            model=model, documentId=str(documentId), version=self.clock.next()
+        )
+        self._apply(event)
+        if self.transport is not None:
+            self.published += 1
+            await self.transport.publish(event)
+
+    async def _receive(self, event: InvalidationEvent):
+        if event.version[2] == self.replicaId:
+            return
+        self.received += 1
+        self.clock.observe(event.version)
+        if not self._apply(event):
+            self.dropped += 1
+
+    async def start(self, transport):
+        self.transport = transport
+        await transport.start(self._receive)
+
+    async def stop(self):
+        if self.transport is not None:
+            await self.transport.stop()
+            self.transport = None
+
+    def stats(self) -> dict:
+        return {
+            "replica": self.replicaId,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+invalidationBus = InvalidationBus()
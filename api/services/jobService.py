@@ -0,0 +1,261 @@
+"""
+Persistent job queue in the Jobs collection, for the work a request shouldn't
+wait for. A taken job is due again after VISIBILITY_TIMEOUT, so jobs run at
+least once and handlers have to be safe to run twice.
+"""
+from beanie import PydanticObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from decouple import config
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from models.jobModel import Job, JobStatus
+from services.metricsService import registry, Counter, Histogram
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+WORKERS = config("JOB_WORKERS", default=4, cast=int)
+MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=8, cast=int)
+VISIBILITY_TIMEOUT = config("JOB_VISIBILITY_TIMEOUT", default=60, cast=float)
+# idle workers look for jobs enqueued by the other replicas this often
+POLL_INTERVAL = config("JOB_POLL_INTERVAL", default=1.0, cast=float)
+BACKOFF_BASE = 2.0  # seconds before the first retry, doubled for every other
+BACKOFF_MAX = 3600.0
+DEPTH_INTERVAL = 10.0  # seconds between counts of the waiting jobs
+
+jobLatency = registry.register(
+    Histogram(
+        "job_latency_seconds",
+        "Time from enqueueing a job to its completion, by kind",
+        ("kind",),
+        (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 3600),
+    )
+)
+jobsFinished = registry.register(
+    Counter(
+        "jobs_finished_total",
+        "Job runs, by kind and outcome (done, retried, failed)",
+        ("kind", "outcome"),
+    )
+)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class JobQueue:
+    def __init__(self):
+        self._handlers: dict[str, Handler] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._running = False
+        self._wakeup = asyncio.Event()
+        # (kind, status) -> jobs, counted every DEPTH_INTERVAL seconds
+        self.depth: dict[tuple[str, str], int] = {}
+
+    def handler(self, kind: str):
+        """Decorator registering the coroutine running the jobs of a kind"""
+
+        def register(function: Handler) -> Handler:
+            self._handlers[kind] = function
+            return function
+
+        return register
+
+    async def enqueue(
+        self, kind: str, payload: dict, key: Optional[str] = None, delay: float = 0
+    ) -> Job:
+        id = PydanticObjectId()
+        job = Job(
+            id=id,
+            kind=kind,
+            key=key or f"{kind}:{id}",
+            payload=payload,
+            runAt=datetime.utcnow() + timedelta(seconds=delay),
+        )
+        try:
+            await job.insert()
+        except DuplicateKeyError:
+            return await Job.find_one(Job.key == job.key)
+        self._wakeup.set()
+        return job
+
+    async def _take(self) -> Optional[Job]:
+        now = datetime.utcnow()
+        taken = await Job.get_motor_collection().find_one_and_update(
+            {
+                "status": {
+                    "$in": [JobStatus.queued.value, JobStatus.running.value]
+                },
+                "runAt": {"$lte": now},
+            },
+            {
+                "$set": {
+                    "status": JobStatus.running.value,
+                    "runAt": now + timedelta(seconds=VISIBILITY_TIMEOUT),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("runAt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        return Job.parse_obj(taken) if taken is not None else None
+
+    async def _finish(self, job: Job, changes: dict):
+        # attempts tells our run apart from a later one by another worker
+        await Job.get_motor_collection().update_one(
+            {
+                "_id": job.id,
+                "status": JobStatus.running.value,
+                "attempts": job.attempts,
+            },
+            {"$set": changes},
+        )
+
+    async def run_next(self) -> bool:
+        """Runs one due job, False if there was none"""
+        job = await self._take()
+        if job is None:
+            return False
+        handler = self._handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for {job.kind} jobs")
+            await asyncio.wait_for(handler(job.payload), VISIBILITY_TIMEOUT)
+        except Exception as exception:
+            error = f"{type(exception).__name__}: {exception}"
+            if job.attempts >= MAX_ATTEMPTS:
+                logger.error("Job %s (%s) failed for good: %s", job.id, job.kind, error)
+                await self._finish(
+                    job,
+                    {
+                        "status": JobStatus.failed.value,
+                        "lastError": error,
+                        "finishedAt": datetime.utcnow(),
+                    },
+                )
+                jobsFinished.inc((job.kind, "failed"))
+            else:
+                backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (job.attempts - 1))
+                backoff *= random.uniform(0.5, 1)  # retries don't come in waves
+                await self._finish(
+                    job,
+                    {
+                        "status": JobStatus.queued.value,
+                        "lastError": error,
+                        "runAt": datetime.utcnow() + timedelta(seconds=backoff),
+                    },
+                )
+                jobsFinished.inc((job.kind, "retried"))
+            return True
+        finishedAt = datetime.utcnow()
+        await self._finish(
+            job, {"status": JobStatus.done.value, "finishedAt": finishedAt}
+        )
+        jobsFinished.inc((job.kind, "done"))
+        jobLatency.observe((job.kind,), (finishedAt - job.createdAt).total_seconds())
+        return True
+
+    async def _work(self):
+        while self._running:
+            try:
+                if await self.run_next():
+                    continue
+            except PyMongoError:
+                logger.exception("Taking a job failed")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def count(self):
+        counts = Job.get_motor_collection().aggregate(
+            [
+                {
+                    "$match": {
+                        "status": {
+                            "$in": [JobStatus.queued.value, JobStatus.running.value]
+                        }
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": {"kind": "$kind", "status": "$status"},
+                        "jobs": {"$sum": 1},
+                    }
+                },
+            ]
+        )
+        self.depth = {
+            (count["_id"]["kind"], count["_id"]["status"]): count["jobs"]
+            async for count in counts
+        }
+
+    async def _count_forever(self):
+        while self._running:
+            try:
+                await self.count()
+            except PyMongoError:
+                logger.exception("Counting the waiting jobs failed")
+            await asyncio.sleep(DEPTH_INTERVAL)
+
+    async def start(self, workers: int = WORKERS):
+        loop = asyncio.get_running_loop()
+        self._running = True
+        self._tasks = [loop.create_task(self._work()) for _ in range(workers)]
+        self._tasks.append(loop.create_task(self._count_forever()))
+
+    async def stop(self):
+        # jobs interrupted here are taken again once their visibility timeout
+        # passed, by this replica after a restart or by another one. A
+        # cancellation arriving as a task wakes up can get lost, the flag still
+        # ends its loop
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+jobQueue = JobQueue()
+
+
+class RecurringJob:
+    """
+    Enqueues a job of a kind every interval seconds, on every replica. The key
+    is the interval window so only one of them runs it.
+    """
+
+    def __init__(self, kind: str, interval: float):
+        self.kind = kind
+        self.interval = interval
+        self._scheduler: Optional[asyncio.Task] = None
+
+    async def enqueue(self) -> Job:
+        window = int(time.time() // self.interval)
+        return await jobQueue.enqueue(
+            self.kind, {"window": window}, key=f"{self.kind}:{window}"
+        )
+
+    async def _schedule_forever(self):
+        while True:
+            try:
+                await self.enqueue()
+            except Exception:
+                logger.exception("Scheduling a %s job failed", self.kind)
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        """Does nothing when the interval is 0"""
+        if self.interval > 0:
+            self._scheduler = asyncio.get_running_loop().create_task(
+                self._schedule_forever()
+            )
+
+    async def stop(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            self._scheduler = None
@@ -0,0 +1,158 @@
+"""
+Expires old pending trades and moves old closed ones to the TradesArchive
+collection, so that Trades stays small. A batch is copied to the archive
+before it is deleted from Trades, find_trade reads both.
+"""
+from beanie import PydanticObjectId
+from pymongo.errors import BulkWriteError
+from decouple import config
+from datetime import datetime, timedelta
+from typing import Optional
+from models.tradeModel import (
+    ArchivedTrade,
+    TradeCycle,
+    TradeOffer,
+    TradeStatus,
+    CLOSED_STATUSES,
+)
+from services.jobService import jobQueue, RecurringJob, VISIBILITY_TIMEOUT
+from services.metricsService import registry, Counter
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+EXPIRY = timedelta(days=config("TRADE_EXPIRY_DAYS", default=30, cast=float))
+ARCHIVE_AGE = timedelta(days=config("TRADE_ARCHIVE_DAYS", default=7, cast=float))
+# seconds, 0 to never sweep
+SWEEP_INTERVAL = config("TRADE_SWEEP_INTERVAL", default=3600, cast=int)
+ARCHIVE_BATCH = 500
+# a sweep with more to archive hands over to a new job before its own times out
+SWEEP_BUDGET = VISIBILITY_TIMEOUT / 2
+DUPLICATE_KEY = 11000
+
+tradesSwept = registry.register(
+    Counter(
+        "trades_swept_total",
+        "Trades expired or moved to the archive by the lifecycle sweep",
+        ("action",),
+    )
+)
+
+
+async def find_trade(id: PydanticObjectId) -> Optional[TradeOffer]:
+    """The trade, from the archive if it was moved there"""
+    trade = await TradeOffer.get(id)
+    if trade is None:
+        trade = await ArchivedTrade.get(id)
+    return trade
+
+
+async def expire_trades(cutoff: datetime) -> int:
+    now = datetime.utcnow()
+    expired = await TradeOffer.get_motor_collection().update_many(
+        {
+            "status": TradeStatus.pending.value,
+            "timeOfClosing": None,
+            "timeOfRequest": {"$lt": cutoff},
+            "settlingSince": None,
+            "cycle": None,
+        },
+        {"$set": {"status": TradeStatus.expired.value, "timeOfClosing": now}},
+    )
+    count = expired.modified_count
+    stale = TradeCycle.find(
+        TradeCycle.status == TradeStatus.pending,
+        TradeCycle.timeOfProposal < cutoff,
+    )
+    async for cycle in stale:
+        claimed = await TradeCycle.get_motor_collection().update_one(
+            {
+                "_id": cycle.id,
+                "status": TradeStatus.pending.value,
+                "settlingSince": None,
+            },
+            {"$set": {"status": TradeStatus.expired.value}},
+        )
+        if claimed.modified_count == 0:
+            continue  # being accepted
+        legs = await TradeOffer.get_motor_collection().update_many(
+            {"cycle": cycle.id, "status": TradeStatus.pending.value},
+            {"$set": {"status": TradeStatus.expired.value, "timeOfClosing": now}},
+        )
+        count += legs.modified_count
+    tradesSwept.inc(("expired",), count)
+    return count
+
+
+def _archivable(cutoff: datetime, skipped: list) -> dict:
+    return {
+        "status": {"$in": [status.value for status in CLOSED_STATUSES]},
+        "$or": [
+            {"timeOfClosing": {"$lt": cutoff}},
+            # closed before timeOfClosing existed
+            {"timeOfClosing": None, "timeOfRequest": {"$lt": cutoff}},
+        ],
+        "_id": {"$nin": skipped},
+    }
+
+
+async def archive_trades(cutoff: datetime, deadline: float) -> bool:
+    """Archives batches until none is left (True) or time.monotonic() > deadline"""
+    trades = TradeOffer.get_motor_collection()
+    # legs of a cycle still settling, its recovery reads them
+    skipped = []
+    while time.monotonic() < deadline:
+        batch = await trades.find(_archivable(cutoff, skipped)).to_list(ARCHIVE_BATCH)
+        if not batch:
+            return True
+        cycleIds = {trade["cycle"] for trade in batch if trade.get("cycle")}
+        if cycleIds:
+            settling = set(
+                await TradeCycle.distinct(
+                    "_id",
+                    {
+                        "_id": {"$in": list(cycleIds)},
+                        "status": TradeStatus.pending.value,
+                    },
+                )
+            )
+            for trade in batch:
+                if trade.get("cycle") in settling:
+                    skipped.append(trade["_id"])
+            batch = [trade for trade in batch if trade.get("cycle") not in settling]
+            if not batch:
+                continue
+        try:
+            await ArchivedTrade.get_motor_collection().insert_many(batch, ordered=False)
+        except BulkWriteError as error:
+            # copied by an interrupted sweep already
+            failures = error.details["writeErrors"]
+            if any(failure["code"] != DUPLICATE_KEY for failure in failures):
+                raise
+        deleted = await trades.delete_many(
+            {"_id": {"$in": [trade["_id"] for trade in batch]}}
+        )
+        tradesSwept.inc(("archived",), deleted.deleted_count)
+    return False
+
+
+@jobQueue.handler("trade_sweep")
+async def sweep(payload: dict):
+    deadline = time.monotonic() + SWEEP_BUDGET
+    now = datetime.utcnow()
+    sweepRound = payload.get("round", 0)
+    if sweepRound == 0:
+        expired = await expire_trades(now - EXPIRY)
+        logger.info("Expired %s pending trades", expired)
+    if not await archive_trades(now - ARCHIVE_AGE, deadline):
+        # more to archive, carried on by a new job
+        nextRound = sweepRound + 1
+        await jobQueue.enqueue(
+            "trade_sweep",
+            {"window": payload["window"], "round": nextRound},
+            key=f"trade_sweep:{payload['window']}:{nextRound}",
+        )
+
+
+tradeSweeper = RecurringJob("trade_sweep", SWEEP_INTERVAL)
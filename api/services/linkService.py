@@ -0,0 +1,62 @@
+"""
+Hypermedia links.
+
+Documents reference each other by ObjectId (models/referenceModel.py), links
+are only built when a response is rendered. They start with the address the
+client used to reach this request: the Host header and, behind nginx, the
+X-Forwarded-Proto header it sets. PUBLIC_URL pins the address instead, for
+deployments where the Host header can't be trusted.
+"""
+from contextvars import ContextVar
+from typing import Optional
+from urllib.parse import urlencode
+from decouple import config
+import re
+
+PUBLIC_URL = config("PUBLIC_URL", default="").rstrip("/")
+# used outside of requests, by scripts and benchmarks
+DEFAULT_BASE_URL = PUBLIC_URL or "http://127.0.0.1:8000"
+_VALID_HOST = re.compile(r"^([A-Za-z0-9.\-]+|\[[0-9A-Fa-f:.]+\])(:[0-9]{1,5})?$")
+
+_baseUrl: ContextVar[str] = ContextVar("baseUrl", default=DEFAULT_BASE_URL)
+
+
+def base_url() -> str:
+    return _baseUrl.get()
+
+
+def generate_url(resource: str, id=None, query: Optional[dict] = None) -> str:
+    url = f"{_baseUrl.get()}/{resource}"
+    if id is not None:
+        url = f"{url}/{id}"
+    if query:
+        params = {key: value for key, value in query.items() if value is not None}
+        url = f"{url}?{urlencode(params, doseq=True)}"
+    return url
+
+
+def request_base_url(scope) -> str:
+    """Base url of an ASGI request, falls back to the default on odd headers"""
+    headers = dict(scope["headers"])
+    scheme = headers.get(b"x-forwarded-proto", b"").decode("latin-1")
+    scheme = scheme.split(",")[0].strip() or scope.get("scheme", "http")
+    host = headers.get(b"host", b"").decode("latin-1")
+    if scheme not in ("http", "https") or not _VALID_HOST.match(host):
+        return DEFAULT_BASE_URL
+    return f"{scheme}://{host}{scope.get('root_path', '')}".rstrip("/")
+
+
+class BaseUrlMiddleware:
+    """Plain ASGI middleware, makes generate_url use the address of the request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or PUBLIC_URL:
+            return await self.app(scope, receive, send)
+        token = _baseUrl.set(request_base_url(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _baseUrl.reset(token)
@@ -0,0 +1,47 @@
+"""
+Outgoing mail, sent by the jobs of services/notificationService.py and never
+inside a request. docker compose runs mailpit as the SMTP server, the mails
+can be read on http://localhost:8025.
+"""
+from decouple import config
+from email.message import EmailMessage
+import asyncio
+import logging
+import smtplib
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = config("SMTP_HOST", default="")  # mails are only logged when empty
+SMTP_PORT = config("SMTP_PORT", default=25, cast=int)
+SMTP_USER = config("SMTP_USER", default="")
+SMTP_PASSWORD = config("SMTP_PASSWORD", default="")
+SMTP_STARTTLS = config("SMTP_STARTTLS", default=False, cast=bool)
+MAIL_FROM = config("MAIL_FROM", default="Retro Games <noreply@retrogames.local>")
+SMTP_TIMEOUT = 10
+
+
+def _send(message: EmailMessage):
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT) as smtp:
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        smtp.send_message(message)
+
+
+def mail_enabled() -> bool:
+    return bool(SMTP_HOST)
+
+
+async def send_mail(to: str, subject: str, body: str):
+    """Raises when the SMTP server refuses the mail, the job is then retried"""
+    if not mail_enabled():
+        logger.info("SMTP_HOST not set, not sending %r to %s", subject, to)
+        return
+    message = EmailMessage()
+    message["From"] = MAIL_FROM
+    message["To"] = to
+    message["Subject"] = subject
+    message.set_content(body)
+    # smtplib blocks
+    await asyncio.to_thread(_send, message)
@@ -0,0 +1,293 @@
+"""
+Multi-party trade matching over libraries and wishlists. The graph of who
+owns and who wants which game is kept in memory, a run rereads the users
+that changed and searches the shortest cycles through them. Found cycles
+are proposed as a TradeCycle and one TradeOffer (leg) per gift.
+"""
+from decouple import config
+from beanie import PydanticObjectId
+from beanie.operators import In
+from pymongo.errors import DuplicateKeyError
+from typing import Hashable, NamedTuple, Optional
+from models.gameModel import OwnedGame, OwnedGameOut, OwnedGameOutProjection
+from models.tradeModel import TradeCycle, TradeOffer, TradeStatus
+from models.wishlistModel import WishlistEntry
+from services.invalidationBus import invalidationBus
+from services.responseService import output
+from services.notificationService import trade_offered
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_CYCLE_LENGTH = config("CYCLE_MAX_LENGTH", default=4, cast=int)
+MATCH_INTERVAL = config("CYCLE_MATCH_INTERVAL", default=600, cast=float)
+# paths expanded per start user before giving up on it
+MAX_EXPANSIONS = 64
+PROPOSAL_MESSAGE = (
+    "Proposed by the trade matcher, every game moves once all of you accept"
+)
+
+
+class Leg(NamedTuple):
+    giver: Hashable
+    receiver: Hashable
+    game: Hashable
+    copy: Hashable
+
+
+async def holdings_changed(*userIds):
+    """Call after a write to the library or wishlist of the users"""
+    for userId in userIds:
+        await invalidationBus.publish("Holdings", userId)
+
+
+class TradeGraph:
+    def __init__(self):
+        self.library: dict = {}  # user -> game -> copy ids
+        self.owners: dict = {}  # game -> user -> copy ids
+        self.wants: dict = {}  # user -> games
+        self.wanters: dict = {}  # game -> users
+        self.dirty: set = set()  # to reread from the database
+        self.changed: set = set()  # to search from on the next run
+        self.loaded = False
+        self._lock = asyncio.Lock()
+        self._matcher: Optional[asyncio.Task] = None
+
+    def set_library(self, user, copies: list[tuple]):
+        """Replaces the copies of user, given as (copy id, game id) pairs"""
+        for game in self.library.pop(user, {}):
+            del self.owners[game][user]
+            if not self.owners[game]:
+                del self.owners[game]
+        games: dict = {}
+        for copy, game in copies:
+            games.setdefault(game, []).append(copy)
+        if games:
+            self.library[user] = games
+        for game, gameCopies in games.items():
+            self.owners.setdefault(game, {})[user] = gameCopies
+        self.changed.add(user)
+
+    def set_wishlist(self, user, games: set):
+        for game in self.wants.pop(user, ()):
+            self.wanters[game].discard(user)
+            if not self.wanters[game]:
+                del self.wanters[game]
+        if games:
+            self.wants[user] = set(games)
+        for game in games:
+            self.wanters.setdefault(game, set()).add(user)
+        self.changed.add(user)
+
+    def gives_to(self, user) -> set:
+        """Users wanting a game user owns"""
+        receivers = set().union(*(self.wanters.get(g, ()) for g in self.library[user]))
+        receivers.discard(user)
+        return receivers
+
+    def gets_from(self, user) -> set:
+        """Users owning a game user wants"""
+        givers = set().union(*(self.owners.get(g, ()) for g in self.wants[user]))
+        givers.discard(user)
+        return givers
+
+    def _cycle_from(self, start, excluded: set, givesTo: dict) -> Optional[list]:
+        """Shortest cycle through start avoiding excluded users, or None"""
+        closers = self.gets_from(start) - excluded
+        if not closers:
+            return None
+        budget = MAX_EXPANSIONS
+        paths = [[start]]
+        for length in range(2, MAX_CYCLE_LENGTH + 1):
+            longer = []
+            for path in paths:
+                last = path[-1]
+                receivers = givesTo.get(last)
+                if receivers is None:
+                    receivers = givesTo[last] = self.gives_to(last)
+                if not receivers.isdisjoint(closers):
+                    closing = (receivers & closers).difference(path)
+                    if closing:
+                        return path + [min(closing)]
+                if length == MAX_CYCLE_LENGTH or budget <= 0:
+                    continue
+                for user in receivers:
+                    if user in excluded or user in path or user not in self.library:
+                        continue
+                    longer.append(path + [user])
+                    budget -= 1
+                    if budget <= 0:
+                        break
+            paths = longer
+        return None
+
+    def _legs(self, cycle: list) -> list[Leg]:
+        legs = []
+        for giver, receiver in zip(cycle, cycle[1:] + cycle[:1]):
+            game = min(self.library[giver].keys() & self.wants[receiver])
+            legs.append(Leg(giver, receiver, game, self.library[giver][game][0]))
+        return legs
+
+    def find_cycles(self, excluded: set, starts: Optional[set] = None) -> list:
+        """
+        Disjoint cycles, as lists of legs, through the start users (every user
+        by default). Users in excluded are left out.
+        """
+        excluded = set(excluded)
+        givesTo: dict = {}  # memo for this run, the graph doesn't change during it
+        cycles = []
+        for start in self.wants if starts is None else starts:
+            if start in excluded or start not in self.wants:
+                continue
+            if start not in self.library:
+                continue
+            cycle = self._cycle_from(start, excluded, givesTo)
+            if cycle is not None:
+                cycles.append(self._legs(cycle))
+                excluded.update(cycle)
+        return cycles
+
+    def mark_dirty(self, userId: str):
+        """Invalidation bus handler"""
+        self.dirty.add(PydanticObjectId(userId))
+
+    async def build(self):
+        self.library, self.owners, self.wants, self.wanters = {}, {}, {}, {}
+        self.dirty.clear()
+        copies: dict = {}
+        async for copy in OwnedGame.get_motor_collection().find(
+            {}, {"owner": 1, "game": 1}
+        ):
+            copies.setdefault(copy["owner"], []).append((copy["_id"], copy["game"]))
+        for user, userCopies in copies.items():
+            self.set_library(user, userCopies)
+        wants: dict = {}
+        async for entry in WishlistEntry.get_motor_collection().find(
+            {}, {"user": 1, "game": 1}
+        ):
+            wants.setdefault(entry["user"], set()).add(entry["game"])
+        for user, games in wants.items():
+            self.set_wishlist(user, games)
+        self.loaded = True
+
+    async def sync(self):
+        """Rereads the libraries and wishlists of the dirty users"""
+        users, self.dirty = list(self.dirty), set()
+        if not users:
+            return
+        copies: dict = {user: [] for user in users}
+        async for copy in OwnedGame.get_motor_collection().find(
+            {"owner": {"$in": users}}, {"owner": 1, "game": 1}
+        ):
+            copies[copy["owner"]].append((copy["_id"], copy["game"]))
+        wants: dict = {user: set() for user in users}
+        async for entry in WishlistEntry.get_motor_collection().find(
+            {"user": {"$in": users}}, {"user": 1, "game": 1}
+        ):
+            wants[entry["user"]].add(entry["game"])
+        for user in users:
+            self.set_library(user, copies[user])
+            self.set_wishlist(user, wants[user])
+
+    async def match(self, full: bool = False) -> list[TradeCycle]:
+        """
+        Proposes the cycles through the users changed since the last run,
+        through every user if full
+        """
+        async with self._lock:
+            if not self.loaded:
+                await self.build()
+                full = True
+            await self.sync()
+            busy = await TradeCycle.distinct(
+                "participants", {"status": TradeStatus.pending.value}
+            )
+            starts, self.changed = (None if full else self.changed), set()
+            # CPU bound, keep the event loop serving requests meanwhile
+            cycles = await asyncio.to_thread(self.find_cycles, set(busy), starts)
+            proposed = []
+            for legs in cycles:
+                cycle = await propose(legs)
+                if cycle is None:
+                    # stale copies, look at these users again next run
+                    self.dirty.update(leg.giver for leg in legs)
+                else:
+                    proposed.append(cycle)
+            return proposed
+
+    async def _match_forever(self):
+        while True:
+            await asyncio.sleep(MATCH_INTERVAL)
+            try:
+                proposed = await self.match()
+                logger.info("Trade matcher proposed %d cycles", len(proposed))
+            except Exception:
+                logger.exception("Trade matching failed")
+
+    async def start(self):
+        await self.build()
+        if MATCH_INTERVAL > 0:
+            self._matcher = asyncio.get_running_loop().create_task(
+                self._match_forever()
+            )
+
+    async def stop(self):
+        if self._matcher is not None:
+            self._matcher.cancel()
+            self._matcher = None
+
+
+async def propose(legs: list[Leg]) -> Optional[TradeCycle]:
+    """
+    Inserts the legs then their cycle, None if a copy changed owner since the
+    graph was read or the same cycle is pending or was declined. Legs left
+    without a cycle by a crash are deleted by recover_stalled_trades.
+    """
+    copies = {
+        copy.id: copy
+        for copy in await OwnedGame.find(In(OwnedGame.id, [leg.copy for leg in legs]))
+        .project(OwnedGameOutProjection)
+        .to_list()
+    }
+    for leg in legs:
+        copy = copies.get(leg.copy)
+        if copy is None or copy.owner != leg.giver:
+            return None
+    tradeIds = [PydanticObjectId() for _ in legs]
+    cycle = TradeCycle(
+        key=",".join(sorted(str(leg.copy) for leg in legs)),
+        participants=[leg.giver for leg in legs],
+        trades=tradeIds,
+    )
+    if await TradeCycle.find_one(
+        TradeCycle.key == cycle.key, TradeCycle.status == TradeStatus.declined
+    ):
+        return None
+    await TradeOffer.insert_many(
+        [
+            TradeOffer(
+                id=tradeId,
+                offerer=leg.giver,
+                receiver=leg.receiver,
+                offererMessage=PROPOSAL_MESSAGE,
+                offererGames=[output(OwnedGameOut, copies[leg.copy])],
+                receiverGames=[],
+                cycle=cycle.id,
+            )
+            for tradeId, leg in zip(tradeIds, legs)
+        ]
+    )
+    try:
+        await cycle.insert()
+    except DuplicateKeyError:
+        # pending already, proposed by another replica
+        await TradeOffer.find(In(TradeOffer.id, tradeIds)).delete()
+        return None
+    for tradeId in tradeIds:
+        await trade_offered(tradeId)
+    return cycle
+
+
+tradeGraph = TradeGraph()
+invalidationBus.subscribe("Holdings", tradeGraph.mark_dirty)
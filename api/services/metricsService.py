@@ -0,0 +1,299 @@
+"""
+Prometheus style metrics, rendered in the text exposition format on /metrics.
+
+The few metric types the API needs are implemented here instead of pulling in
+a client library. Recording a value is a dict lookup and a few additions
+under a lock, the lock is needed because the Mongo command events come from
+motor's threads. benchmarks/metricsOverhead.py measures what it costs.
+"""
+from pymongo import monitoring
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Optional
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelNames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            formatted = _format_labels(self.labelNames, labels)
+            lines.append(f"{self.name}{formatted} {value}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Summary(Metric):
+    """Count and sum only, quantiles are left to the Prometheus server"""
+
+    type = "summary"
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            count, total = self._values.get(labels, (0, 0))
+            self._values[labels] = (count + 1, total + value)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            values = list(self._values.items())
+        for labels, (count, total) in values:
+            formatted = _format_labels(self.labelNames, labels)
+            lines.append(f"{self.name}_count{formatted} {count}")
+            lines.append(f"{self.name}_sum{formatted} {total}")
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelNames: tuple = (), buckets=()):
+        super().__init__(name, help, labelNames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: tuple, value: float):
+        # counts are kept per bucket and only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            values = [
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._values.items()
+            ]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                formatted = _format_labels(self.labelNames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{formatted} {cumulative}")
+            formatted = _format_labels(self.labelNames, labels)
+            lines.append(f"{self.name}_count{formatted} {cumulative}")
+            lines.append(f"{self.name}_sum{formatted} {total}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Read when scraped, for numbers other services already keep"""
+
+    def __init__(self, name, help, type, labelNames, collect: Callable[[], dict]):
+        super().__init__(name, help, labelNames)
+        self.type = type
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for labels, value in self.collect().items():
+            formatted = _format_labels(self.labelNames, labels)
+            lines.append(f"{self.name}{formatted} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requestLatency = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time to answer a request, by route template",
+        ("method", "route"),
+        LATENCY_BUCKETS,
+    )
+)
+requestsTotal = registry.register(
+    Counter("http_requests_total", "Answered requests", ("method", "route", "status"))
+)
+requestsInFlight = registry.register(
+    Gauge("http_requests_in_flight", "Requests being answered right now")
+)
+responseSize = registry.register(
+    Summary(
+        "http_response_size_bytes", "Size of the response bodies", ("method", "route")
+    )
+)
+requestCommands = registry.register(
+    Histogram(
+        "http_request_mongo_commands",
+        "Mongo commands sent while answering a request",
+        ("method", "route"),
+        COMMAND_COUNT_BUCKETS,
+    )
+)
+mongoCommandDuration = registry.register(
+    Histogram(
+        "mongo_command_duration_seconds",
+        "Duration of the Mongo commands, by collection and command",
+        ("collection", "command"),
+        MONGO_BUCKETS,
+    )
+)
+mongoCommandFailures = registry.register(
+    Counter(
+        "mongo_command_failures_total",
+        "Mongo commands that failed",
+        ("collection", "command"),
+    )
+)
+
+
+# ------------------------- REQUESTS ------------------------- #
+
+# commands counted for the request running in the current context, motor
+# copies the context into the thread that runs the command
+_currentCommands: ContextVar[Optional[list]] = ContextVar(
+    "currentCommands", default=None
+)
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware, cheaper than BaseHTTPMiddleware which wraps every
+    response in a stream. Requests are labelled by route template
+    ("/games/{game_id}") so ids don't create a series each.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        response = {"status": 500, "size": 0}
+        commands = [0]
+        token = _currentCommands.set(commands)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        requestsInFlight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            requestsInFlight.dec()
+            _currentCommands.reset(token)
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            requestLatency.observe(labels, time.perf_counter() - start)
+            requestsTotal.inc((*labels, response["status"]))
+            responseSize.observe(labels, response["size"])
+            requestCommands.observe(labels, commands[0])
+
+
+# ------------------------- MONGO ------------------------- #
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every command sent by the client it is registered on"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: dict[tuple, tuple[str, str]] = {}
+
+    def started(self, event):
+        if event.command_name == "getMore":
+            collection = event.command.get("collection", "")
+        else:
+            collection = event.command.get(event.command_name)
+            if not isinstance(collection, str):
+                collection = ""  # admin commands like ping
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (
+                collection,
+                event.command_name,
+            )
+        commands = _currentCommands.get()
+        if commands is not None:
+            commands[0] += 1
+
+    def _finished(self, event) -> Optional[tuple[str, str]]:
+        with self._lock:
+            return self._started.pop((event.connection_id, event.request_id), None)
+
+    def succeeded(self, event):
+        labels = self._finished(event)
+        if labels is not None:
+            mongoCommandDuration.observe(labels, event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        labels = self._finished(event)
+        if labels is not None:
+            mongoCommandDuration.observe(labels, event.duration_micros / 1_000_000)
+            mongoCommandFailures.inc(labels)
+
+
+commandMetrics = CommandMetrics()
@@ -0,0 +1,170 @@
+"""
+Data migrations, run once by the API when it starts: a finished migration is
+recorded in the Migrations collection and skipped afterwards. They can also be
+run again by hand from the api directory:
+
+    python -m services.migrationService
+"""
+from beanie import PydanticObjectId, Document, init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import OperationFailure
+from decouple import config
+from datetime import datetime
+from typing import Awaitable, Callable
+from models.userModel import User
+from models.gameModel import GameAbstract, OwnedGame
+from models.tradeModel import TradeOffer, TradeCycle
+import asyncio
+
+BATCH_SIZE = 500
+MIGRATIONS = "Migrations"
+
+
+def _migrations():
+    return User.get_motor_collection().database[MIGRATIONS]
+
+
+async def run_once(name: str, migration: Callable[[], Awaitable]) -> bool:
+    """Runs a migration unless it finished before, False if it was skipped"""
+    if await _migrations().find_one({"_id": name}) is not None:
+        return False
+    await migration()
+    await _finished(name)
+    return True
+
+
+async def _finished(name: str):
+    await _migrations().update_one(
+        {"_id": name}, {"$set": {"finishedAt": datetime.utcnow()}}, upsert=True
+    )
+
+
+async def migrate_embedded_libraries():
+    """
+    Moves libraries stored as an embedded `games` list on the user documents
+    into the OwnedGames collection. Safe to run again, users that were
+    already migrated no longer have the field and are skipped.
+    """
+    users = User.get_motor_collection()
+    ownedGames = OwnedGame.get_motor_collection()
+    cursor = users.find({"games": {"$exists": True}}, {"games": 1})
+    async for user in cursor.batch_size(BATCH_SIZE):
+        writes = []
+        for game in user["games"]:
+            game = dict(game)
+            game["_id"] = game.pop("id", None) or PydanticObjectId()
+            game["owner"] = game.get("owner") or user["_id"]
+            game["ownerHistory"] = game.get("ownerHistory") or [user["_id"]]
+            # upsert by id so a migration interrupted halfway can be rerun
+            writes.append(ReplaceOne({"_id": game["_id"]}, game, upsert=True))
+        for start in range(0, len(writes), BATCH_SIZE):
+            await ownedGames.bulk_write(writes[start : start + BATCH_SIZE])
+        await users.update_one({"_id": user["_id"]}, {"$unset": {"games": ""}})
+
+
+# References used to be stored as full links ("http://127.0.0.1:8000/users/<id>"),
+# these are the fields that held one, trade snapshots are owned game documents
+SNAPSHOT_FIELDS = ["game", "owner", "ownerHistory"]
+REFERENCE_FIELDS = {
+    User: ["tradeHistory"],
+    OwnedGame: SNAPSHOT_FIELDS,
+    TradeOffer: ["offerer", "receiver"]
+    + [f"offererGames.{field}" for field in SNAPSHOT_FIELDS]
+    + [f"receiverGames.{field}" for field in SNAPSHOT_FIELDS],
+}
+
+
+def _to_reference(value):
+    if isinstance(value, str):
+        return ObjectId(value.rstrip("/").rsplit("/", 1)[-1])
+    if isinstance(value, list):
+        return [_to_reference(item) for item in value]
+    return value
+
+
+def _convert(document: dict, fields: list[str]) -> dict:
+    """The $set turning every link of a document into an ObjectId"""
+    converted = {}
+    for field in fields:
+        top, _, nested = field.partition(".")
+        if top not in document:
+            continue
+        if nested:
+            converted[top] = [
+                {**snapshot, nested: _to_reference(snapshot[nested])}
+                if nested in snapshot
+                else snapshot
+                for snapshot in converted.get(top, document[top])
+            ]
+        else:
+            converted[top] = _to_reference(document[top])
+    return converted
+
+
+async def migrate_collection(model: type[Document], fields: list[str]) -> int:
+    """
+    Converts the links of one collection in batches of BATCH_SIZE, returns how
+    many documents were converted. The API keeps serving while it runs: each
+    update only applies if the fields still hold what was read, a document the
+    API changed in between is left to its new value (or to the next run).
+    """
+    collection = model.get_motor_collection()
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field.partition(".")[0]: 1 for field in fields}
+    migrated = 0
+    writes = []
+    async for document in collection.find(query, projection).batch_size(BATCH_SIZE):
+        writes.append(UpdateOne(document, {"$set": _convert(document, fields)}))
+        if len(writes) == BATCH_SIZE:
+            result = await collection.bulk_write(writes, ordered=False)
+            migrated += result.modified_count
+            writes = []
+    if writes:
+        result = await collection.bulk_write(writes, ordered=False)
+        migrated += result.modified_count
+    return migrated
+
+
+async def migrate_references() -> dict[str, int]:
+    """
+    Stores every reference as an ObjectId. Safe to run again while older
+    replicas are still writing links, converted documents no longer match
+    the query and are skipped.
+    """
+    return {
+        model.get_motor_collection().name: await migrate_collection(model, fields)
+        for model, fields in REFERENCE_FIELDS.items()
+    }
+
+
+async def drop_cycle_key_index():
+    """
+    The unique index on the cycle key also covered closed cycles, it is
+    replaced by one on the pending cycles only
+    """
+    try:
+        await TradeCycle.get_motor_collection().drop_index("cycle_key")
+    except OperationFailure:
+        pass  # created after the change
+
+
+async def main():
+    client = AsyncIOMotorClient(config("MONGO_URI"))
+    await init_beanie(
+        database=client.RetroGames,
+        document_models=[User, GameAbstract, OwnedGame, TradeOffer, TradeCycle],
+    )
+    await migrate_embedded_libraries()
+    await _finished("embedded_libraries")
+    for collection, migrated in (await migrate_references()).items():
+        print(f"{collection:<11} {migrated} documents converted to ObjectId references")
+    await _finished("references")
+    await drop_cycle_key_index()
+    await _finished("cycle_key_index")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+"""
+Side effects of requests that run as background jobs (services/jobService.py):
+password reset mails, and the trade history bookkeeping and mails of trade
+offers, accepts and declines. Each enqueue function is called by the request,
+the handler below it runs on a worker. Handlers may run more than once.
+Links in the mails start with the address of the request that enqueued them.
+"""
+from beanie import PydanticObjectId
+from beanie.operators import In
+from decouple import config
+from models.userModel import User
+from models.tradeModel import TradeCycle, TradeOffer
+from services.jobService import jobQueue
+from services.mailService import send_mail, mail_enabled
+from services.passwordService import passwordHasher
+from services.invalidationBus import invalidationBus
+from services.linkService import base_url
+from services.lifecycleService import find_trade
+import logging
+import secrets
+import time
+
+logger = logging.getLogger(__name__)
+
+# a user gets at most one reset mail per window, whatever the requests
+RESET_WINDOW = config("PASSWORD_RESET_WINDOW", default=60, cast=int)
+
+
+async def request_password_reset(user: User):
+    window = int(time.time() // RESET_WINDOW)
+    await jobQueue.enqueue(
+        "password_reset",
+        {"user": str(user.id)},
+        key=f"password_reset:{user.id}:{window}",
+    )
+
+
+@jobQueue.handler("password_reset")
+async def reset_password(payload: dict):
+    user = await User.get(PydanticObjectId(payload["user"]))
+    if user is None:
+        return
+    if not mail_enabled():
+        # the user couldn't learn the new password, keep the old one
+        logger.warning("SMTP_HOST not set, password of %s not reset", user.email)
+        return
+    temporary = secrets.token_urlsafe(12)
+    hashed = await passwordHasher.hash(temporary)
+    # mail first, a failed save leaves the old password working and the retry
+    # mails another one
+    await send_mail(
+        user.email,
+        "Your temporary Retro Games password",
+        f"Hello {user.username},\n\n"
+        f"Your temporary password is {temporary}\n"
+        "Log in with it and change it with PATCH /users/change-password.\n",
+    )
+    await user.set({User.password: hashed})
+
+
+async def _users(*ids) -> dict:
+    users = await User.find(In(User.id, list(ids))).to_list()
+    return {user.id: user for user in users}
+
+
+async def trade_offered(tradeID: PydanticObjectId):
+    await jobQueue.enqueue(
+        "trade_offered",
+        {"trade": str(tradeID), "baseUrl": base_url()},
+        key=f"trade_offered:{tradeID}",
+    )
+
+
+@jobQueue.handler("trade_offered")
+async def record_offer(payload: dict):
+    trade = await find_trade(PydanticObjectId(payload["trade"]))
+    if trade is None:
+        return
+    # $addToSet, running this twice doesn't list the trade twice
+    await User.get_motor_collection().update_many(
+        {"_id": {"$in": [trade.offerer, trade.receiver]}},
+        {"$addToSet": {"tradeHistory": trade.id}},
+    )
+    for userId in (trade.offerer, trade.receiver):
+        await invalidationBus.publish("User", userId)
+
+    users = await _users(trade.offerer, trade.receiver)
+    offerer, receiver = users.get(trade.offerer), users.get(trade.receiver)
+    if offerer is None or receiver is None:
+        return
+    if trade.cycle is not None:
+        subject = "A trade cycle was found for your wishlist"
+    else:
+        subject = f"{offerer.username} offered you a trade"
+    await send_mail(
+        receiver.email,
+        subject,
+        f"Hello {receiver.username},\n\n{trade.offererMessage}\n\n"
+        f"See the offer at {payload['baseUrl']}/trades/{trade.id}\n",
+    )
+
+
+async def trade_answered(trade: TradeOffer):
+    """Mails the outcome of an accepted or declined trade"""
+    answered = trade.cycle or trade.id  # a cycle is only reported once
+    await jobQueue.enqueue(
+        "trade_answered",
+        {"trade": str(trade.id), "baseUrl": base_url()},
+        key=f"trade_answered:{answered}:{trade.status.value}",
+    )
+
+
+@jobQueue.handler("trade_answered")
+async def mail_answer(payload: dict):
+    # a retried job can come after the trade was archived
+    trade = await find_trade(PydanticObjectId(payload["trade"]))
+    if trade is None:
+        return
+    recipients = [trade.offerer]
+    link = f"{payload['baseUrl']}/trades/{trade.id}"
+    if trade.cycle is not None:
+        cycle = await TradeCycle.get(trade.cycle)
+        if cycle is not None:
+            recipients = cycle.participants
+            link = f"{payload['baseUrl']}/trades/cycles/{cycle.id}"
+    for user in (await _users(*recipients)).values():
+        await send_mail(
+            user.email,
+            f"Your trade was {trade.status.value}",
+            f"Hello {user.username},\n\nSee the trade at {link}\n",
+        )
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from decouple import config
+import asyncio
+import bcrypt
+import time
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small thread pool (bcrypt releases the GIL) so hashing
+    never blocks the event loop. When more than `workers + queueSize` calls are
+    waiting the request is rejected with a 429 instead of piling up, a 503
+    would make nginx take the replica out.
+    """
+
+    def __init__(self, rounds: int, workers: int, queueSize: int):
+        self.rounds = rounds
+        self.workers = workers
+        self.maxPending = workers + queueSize
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+
+    async def _run(self, function, *args):
+        if self._pending >= self.maxPending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many password operations in progress, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, function, *args
+            )
+        finally:
+            self._pending -= 1
+            elapsed = time.perf_counter() - start
+            self.completed += 1
+            self.totalSeconds += elapsed
+            self.maxSeconds = max(self.maxSeconds, elapsed)
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(
+            bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(self.rounds)
+        )
+        return hashed.decode("utf-8")
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(
+            bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8")
+        )
+
+    def needs_rehash(self, hashed: str) -> bool:
+        # bcrypt hashes look like $2b$12$<salt+hash>, the 12 being the cost
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            "queueDepth": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "averageSeconds": self.totalSeconds / self.completed
+            if self.completed
+            else 0.0,
+            "maxSeconds": self.maxSeconds,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+passwordHasher = PasswordHasher(
+    rounds=config("BCRYPT_ROUNDS", default=12, cast=int),
+    workers=config("PASSWORD_HASH_WORKERS", default=4, cast=int),
+    queueSize=config("PASSWORD_HASH_QUEUE", default=64, cast=int),
+)
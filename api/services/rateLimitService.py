@@ -0,0 +1,277 @@
+"""
+Admission control in front of the routes: a token bucket per client and a
+cap on the requests in flight per route class, both answered 429 with
+Retry-After.
+"""
+from decouple import config
+from jose import jwt, JWTError
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from starlette.routing import Match
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from services.metricsService import registry, Counter
+import ipaddress
+import json
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+RATE = config("RATE_LIMIT_RATE", default=20, cast=float)  # tokens per second
+BURST = config("RATE_LIMIT_BURST", default=100, cast=float)  # bucket size
+SECRET_KEY = config("SECRET_KEY")
+ALGORITHM = config("ALGORITHM")
+# buckets kept by MemoryBucketStore, a forgotten bucket starts full again
+MAX_TRACKED_CLIENTS = 100_000
+# not limited, the health checks of docker and nginx hit them all the time
+EXEMPT_PATHS = {"/healthz", "/readyz", "/metrics"}
+# addresses or networks whose X-Real-IP header is trusted, comma separated
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(proxy.strip())
+    for proxy in config("TRUSTED_PROXIES", default="").split(",")
+    if proxy.strip()
+]
+
+
+class RouteLimit(NamedTuple):
+    routeClass: str
+    cost: float  # tokens taken per request
+
+
+# requests of a class in flight on one replica
+CONCURRENCY = {
+    "auth": config("CONCURRENCY_AUTH", default=32, cast=int),
+    "search": config("CONCURRENCY_SEARCH", default=32, cast=int),
+    "listing": config("CONCURRENCY_LISTING", default=64, cast=int),
+    "bulk": config("CONCURRENCY_BULK", default=4, cast=int),
+    "default": config("CONCURRENCY_DEFAULT", default=512, cast=int),
+}
+DEFAULT_LIMIT = RouteLimit("default", 1)
+ROUTE_LIMITS = {
+    # bcrypt
+    ("POST", "/users/token"): RouteLimit("auth", 10),
+    ("POST", "/users/register"): RouteLimit("auth", 10),
+    ("PATCH", "/users/change-password"): RouteLimit("auth", 10),
+    ("POST", "/users/reset-password"): RouteLimit("auth", 10),
+    ("GET", "/games/search/{search_term}"): RouteLimit("search", 5),
+    ("GET", "/games"): RouteLimit("listing", 2),
+    ("GET", "/users"): RouteLimit("listing", 2),
+    ("GET", "/games/export"): RouteLimit("bulk", 20),
+    ("GET", "/users/export"): RouteLimit("bulk", 20),
+    ("GET", "/trades/export"): RouteLimit("bulk", 20),
+    ("POST", "/users/library/batch"): RouteLimit("bulk", 5),
+    ("POST", "/trades/cycles/match"): RouteLimit("bulk", 20),
+}
+
+rejections = registry.register(
+    Counter(
+        "admission_rejections_total",
+        "Requests answered 429, by route class and reason",
+        ("route_class", "reason"),
+    )
+)
+
+
+class MemoryBucketStore:
+    """Buckets of this process only, for a single replica and for tests"""
+
+    def __init__(self):
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def start(self):
+        pass
+
+    async def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        """Takes cost tokens, returns 0 or the seconds until they are available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > MAX_TRACKED_CLIENTS:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def stop(self):
+        self._buckets.clear()
+
+
+class MongoBucketStore:
+    """
+    One document per client, refilled and taken from by a single pipeline
+    update timed with the clock of the server, so the replicas don't have to
+    agree on the time. Idle buckets are dropped by a TTL index.
+    """
+
+    def __init__(self, database, collectionName="RateLimits", idleSeconds=3600):
+        self.collection = database[collectionName]
+        self.idleSeconds = idleSeconds
+
+    async def start(self):
+        await self.collection.create_index(
+            "updated", name="bucket_idle", expireAfterSeconds=self.idleSeconds
+        )
+
+    async def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        # a new bucket starts full
+        updated = {"$ifNull": ["$updated", "$$NOW"]}
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", updated]}, 1000]}
+        refill = {"$multiply": [elapsed, rate]}
+        tokens = {"$add": [{"$ifNull": ["$tokens", burst]}, refill]}
+        refilled = {"$min": [burst, tokens]}
+        enough = {"$gte": ["$tokens", cost]}
+        taken = {"$cond": [enough, {"$subtract": ["$tokens", cost]}, "$tokens"]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": "$$NOW"}},
+                {"$set": {"admitted": enough, "tokens": taken}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["admitted"]:
+            return 0.0
+        return (cost - bucket["tokens"]) / rate
+
+    async def stop(self):
+        pass
+
+
+def client_key(scope) -> str:
+    """Email of a valid bearer token, else the client address"""
+    headers = dict(scope["headers"])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            email = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+        except JWTError:
+            email = None  # forged or expired, limited by address instead
+        if email:
+            return f"user:{email}"
+    address = scope["client"][0] if scope.get("client") else ""
+    # set by nginx, anyone reaching a replica directly could forge it
+    if is_trusted_proxy(address):
+        address = headers.get(b"x-real-ip", b"").decode("latin-1") or address
+    return f"ip:{address}"
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        peer = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(peer in network for network in TRUSTED_PROXIES)
+
+
+class AdmissionControl:
+    def __init__(self):
+        self.store = None  # requests are let through until start()
+        self.inFlight = {routeClass: 0 for routeClass in CONCURRENCY}
+        self._routes: Optional[list] = None
+
+    def limit_of(self, scope) -> tuple[RouteLimit, Optional[object]]:
+        """The limit of the route the request will be routed to, and the route"""
+        if self._routes is None:
+            self._routes = [
+                (route, ROUTE_LIMITS[(method, route.path)])
+                for route in scope["app"].routes
+                for method in getattr(route, "methods", None) or ()
+                if (method, route.path) in ROUTE_LIMITS
+            ]
+        for route, limit in self._routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return limit, route
+        return DEFAULT_LIMIT, None
+
+    async def admit(self, limit: RouteLimit, key: str) -> tuple[float, str]:
+        """
+        Reserves a slot of the route class, returns (0, "") when admitted,
+        else the seconds to wait and why. Admitted requests call release().
+        """
+        if self.inFlight[limit.routeClass] >= CONCURRENCY[limit.routeClass]:
+            return 1.0, "concurrency"
+        self.inFlight[limit.routeClass] += 1
+        try:
+            wait = await self.store.take(key, limit.cost, RATE, BURST)
+        except PyMongoError:
+            # the limits are not worth an outage
+            logger.exception("Rate limit store unavailable, request admitted")
+            wait = 0.0
+        if wait > 0:
+            self.release(limit)
+            return wait, "rate"
+        return 0.0, ""
+
+    def release(self, limit: RouteLimit):
+        self.inFlight[limit.routeClass] -= 1
+
+    async def start(self, store):
+        await store.start()
+        self.store = store
+
+    async def stop(self):
+        if self.store is not None:
+            await self.store.stop()
+            self.store = None
+
+
+admissionControl = AdmissionControl()
+
+
+class AdmissionMiddleware:
+    """
+    Plain ASGI middleware, rejects before the request is routed. Rejections
+    are 429 rather than 503, nginx would take the replica out of rotation on
+    a 503.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"] in EXEMPT_PATHS
+            or admissionControl.store is None
+        ):
+            return await self.app(scope, receive, send)
+        limit, route = admissionControl.limit_of(scope)
+        wait, reason = await admissionControl.admit(limit, client_key(scope))
+        if wait > 0:
+            if route is not None:
+                scope["route"] = route  # labels the metrics of the rejection
+            rejections.inc((limit.routeClass, reason))
+            return await reject(send, wait, reason)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admissionControl.release(limit)
+
+
+async def reject(send, wait: float, reason: str):
+    if reason == "rate":
+        detail = "Too many requests, slow down"
+    else:
+        detail = "Too many requests of this kind are being answered, try again"
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
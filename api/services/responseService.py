@@ -0,0 +1,59 @@
+"""
+Fast path for json responses. Handlers build their output models without
+validating them again and return a FastJSONResponse, which dumps the model
+once and encodes it with orjson. References become links with the base url
+of the current request.
+"""
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic.json import ENCODERS_BY_TYPE
+from bson import ObjectId
+from typing import Any, TypeVar
+from models.referenceModel import Reference
+from services.linkService import base_url
+import orjson
+
+T = TypeVar("T", bound=BaseModel)
+
+
+def render_reference(reference: Reference) -> str:
+    return f"{base_url()}/{reference.resource}/{reference}"
+
+
+# the responses FastAPI still serialises itself go through jsonable_encoder
+for reference in Reference.__subclasses__():
+    ENCODERS_BY_TYPE[reference] = render_reference
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.dict(by_alias=True)
+    if isinstance(value, Reference):
+        return render_reference(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    # orjson already handles dates, datetimes and enums the way pydantic does
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def output(model: type[T], document: BaseModel) -> T:
+    """
+    The output model of a document, without validating its fields again. Only
+    the fields of the output model are copied, so nothing else can leak.
+    """
+    return model.construct(
+        **{
+            name: getattr(document, name)
+            for name in model.__fields__
+            if hasattr(document, name)
+        }
+    )
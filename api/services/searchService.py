@@ -0,0 +1,111 @@
+from models.gameModel import GameAbstract
+from models.searchModel import SearchResults
+import unicodedata
+import re
+
+BUCKET_SIZE = 25
+# result list -> field of the games it holds
+BUCKETS = {
+    "nameResults": "name",
+    "tagResults": "tags",
+    "platformResults": "platforms",
+    "publisherResults": "publisher",
+}
+
+_token_pattern = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    """Case and diacritic folding, "Pokémon" and "POKEMON" both become "pokemon" """
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return stripped.casefold()
+
+
+def words(text: str) -> list[str]:
+    return _token_pattern.findall(fold(text))
+
+
+def tokenize(text: str) -> set[str]:
+    return set(words(text))
+
+
+def _letter_variants() -> dict[str, str]:
+    """The latin letters folding to each ascii letter, "e": "eÈÉÊËèéêë..." """
+    variants: dict[str, str] = {}
+    for code in range(0xC0, 0x250):
+        folded = fold(chr(code))
+        if len(folded) == 1 and folded.isascii() and folded.isalpha():
+            variants[folded] = variants.get(folded, folded) + chr(code)
+    return variants
+
+
+_variants = _letter_variants()
+# word characters of the latin scripts, tokens only match whole words
+_WORD = f"0-9a-z_{chr(0xC0)}-{chr(0x24F)}"
+
+
+def word_pattern(tokens: set[str]) -> str:
+    """Regex matching a value with a word among the folded tokens"""
+    alternatives = "|".join(
+        "".join(
+            f"[{_variants[char]}]" if char in _variants else re.escape(char)
+            for char in token
+        )
+        for token in sorted(tokens)
+    )
+    return f"(?:^|[^{_WORD}])(?:{alternatives})(?:[^{_WORD}]|$)"
+
+
+def _text_stages(query: str) -> list[dict]:
+    return [
+        {"$match": {"$text": {"$search": query}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+
+
+def _bucket(field: str, pattern: str) -> list[dict]:
+    """Best text matches whose field has a word of the search"""
+    return [
+        {"$match": {field: {"$regex": pattern, "$options": "i"}}},
+        {"$sort": {"score": -1, "_id": 1}},
+        {"$limit": BUCKET_SIZE},
+        {"$project": {"score": 0}},
+    ]
+
+
+async def search_games(search_term: str) -> SearchResults:
+    """
+    Ranked search over name, tags, platforms and publisher with the
+    game_text_search index, in one aggregation: the text matches are split
+    into a bucket per field, each ranked by textScore.
+    """
+    tokens = tokenize(search_term)
+    if not tokens:
+        return SearchResults(
+            nameResults=[],
+            tagResults=[],
+            platformResults=[],
+            publisherResults=[],
+            total=0,
+        )
+    # only the folded tokens are sent so the raw input can't inject phrases
+    # ("...") or negations (-word) into the text query
+    query = " ".join(sorted(tokens))
+    pattern = word_pattern(tokens)
+    pipeline = _text_stages(query) + [
+        {
+            "$facet": {
+                bucket: _bucket(field, pattern)
+                for bucket, field in BUCKETS.items()
+            }
+        }
+    ]
+    (facets,) = await GameAbstract.aggregate(pipeline).to_list()
+    results = {
+        bucket: [GameAbstract.parse_obj(game) for game in facets[bucket]]
+        for bucket in BUCKETS
+    }
+    return SearchResults(
+        **results, total=sum(len(games) for games in results.values())
+    )
@@ -0,0 +1,231 @@
+"""
+In-memory prefix index behind /games/suggest. Every word suffix of the folded
+name and publisher of a game is kept in a sorted list, matches are ranked by
+the number of owned copies, recounted shortly after library writes. Writes on
+other replicas reach it through the invalidation bus.
+"""
+from decouple import config
+from typing import Optional
+from models.gameModel import GameAbstract, OwnedGame
+from models.referenceModel import GameRef
+from models.searchModel import GameSuggestion
+from services.searchService import words
+from services.invalidationBus import invalidationBus
+import asyncio
+import bisect
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_SUGGESTIONS = 25
+REFRESH_INTERVAL = config("SUGGEST_REFRESH", default=300, cast=float)
+# seconds a recount waits for a burst of library writes to settle
+RECOUNT_DELAY = config("SUGGEST_RECOUNT_DELAY", default=2, cast=float)
+# rankings remembered at most, they are all forgotten when it is reached
+MEMO_SIZE = 50_000
+
+
+def keys_of(*texts: str) -> set[str]:
+    keys = set()
+    for text in texts:
+        textWords = words(text)
+        keys.update(" ".join(textWords[start:]) for start in range(len(textWords)))
+    return keys
+
+
+def prefixes_of(keys: set[str]) -> set[str]:
+    return {key[:length] for key in keys for length in range(1, len(key) + 1)}
+
+
+class SuggestIndex:
+    def __init__(self):
+        # two parallel lists sorted by key, the game id of _keys[i] is _keyGames[i]
+        self._keys: list[str] = []
+        self._keyGames: list[str] = []
+        self._games: dict[str, tuple[str, str]] = {}  # game id -> (name, publisher)
+        self._gameKeys: dict[str, set[str]] = {}
+        self._rank: dict[str, tuple] = {}  # game id -> sort key, most owned first
+        self._byRank: list[str] = []  # game ids, most owned first
+        self.copies: dict[str, int] = {}  # game id -> owned copies
+        self._memo: dict[str, list[str]] = {}  # prefix -> ranked game ids
+        self._refresher: Optional[asyncio.Task] = None
+        self._rereads: set[asyncio.Task] = set()
+        self._holdingsChanged = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def _rank_of(self, gameId: str) -> tuple:
+        return (-self.copies.get(gameId, 0), *self._games[gameId], gameId)
+
+    def load(self, games: dict[str, tuple[str, str]]):
+        """Replaces the whole index, games maps ids to (name, publisher)"""
+        self._gameKeys = {gameId: keys_of(*texts) for gameId, texts in games.items()}
+        entries = sorted(
+            (key, gameId) for gameId, keys in self._gameKeys.items() for key in keys
+        )
+        self._keys = [key for key, _ in entries]
+        self._keyGames = [gameId for _, gameId in entries]
+        self._games = games
+        self.rerank()
+
+    def rerank(self):
+        self._rank = {gameId: self._rank_of(gameId) for gameId in self._games}
+        self._byRank = sorted(self._games, key=self._rank.__getitem__)
+        self._memo.clear()
+
+    def add(self, game: GameAbstract):
+        gameId = str(game.id)
+        self.remove(gameId)
+        self._games[gameId] = (game.name, game.publisher)
+        self._rank[gameId] = rank = self._rank_of(gameId)
+        bisect.insort(self._byRank, gameId, key=self._rank.__getitem__)
+        self._gameKeys[gameId] = keys = keys_of(game.name, game.publisher)
+        for key in keys:
+            index = bisect.bisect_right(self._keys, key)
+            self._keys.insert(index, key)
+            self._keyGames.insert(index, gameId)
+        for prefix in prefixes_of(keys):
+            ranked = self._memo.get(prefix)
+            if ranked is None:
+                continue
+            if len(ranked) < MAX_SUGGESTIONS or rank < self._rank[ranked[-1]]:
+                bisect.insort(ranked, gameId, key=self._rank.__getitem__)
+                del ranked[MAX_SUGGESTIONS:]
+
+    def remove(self, gameId: str):
+        if gameId not in self._games:
+            return
+        keys = self._gameKeys.pop(gameId)
+        for key in keys:
+            start = bisect.bisect_left(self._keys, key)
+            end = bisect.bisect_right(self._keys, key, lo=start)
+            index = start + self._keyGames[start:end].index(gameId)
+            del self._keys[index]
+            del self._keyGames[index]
+        for prefix in prefixes_of(keys):
+            ranked = self._memo.get(prefix)
+            if ranked is None or gameId not in ranked:
+                continue
+            if len(ranked) < MAX_SUGGESTIONS:
+                ranked.remove(gameId)  # every match was ranked, none is missing
+            else:
+                del self._memo[prefix]
+        index = bisect.bisect_left(
+            self._byRank, self._rank[gameId], key=self._rank.__getitem__
+        )
+        del self._byRank[index]
+        del self._games[gameId]
+        del self._rank[gameId]
+
+    def _ranked(self, prefix: str) -> list[str]:
+        ranked = self._memo.get(prefix)
+        if ranked is None:
+            start = bisect.bisect_left(self._keys, prefix)
+            end = bisect.bisect_left(self._keys, prefix + "\uffff", lo=start)
+            # walking takes about MAX_SUGGESTIONS * games / matches steps,
+            # ranking the matches about as many steps as there are matches
+            if (end - start) ** 2 > MAX_SUGGESTIONS * len(self._keys):
+                ranked = self._walk(prefix)
+            else:
+                ranked = heapq.nsmallest(
+                    MAX_SUGGESTIONS,
+                    set(self._keyGames[start:end]),
+                    key=self._rank.__getitem__,
+                )
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[prefix] = ranked
+        return ranked
+
+    def _walk(self, prefix: str) -> list[str]:
+        ranked = []
+        for gameId in self._byRank:
+            if any(key.startswith(prefix) for key in self._gameKeys[gameId]):
+                ranked.append(gameId)
+                if len(ranked) == MAX_SUGGESTIONS:
+                    break
+        return ranked
+
+    def suggest(self, query: str, limit: int) -> list[GameSuggestion]:
+        """The most owned games with a name or publisher word starting with query"""
+        prefix = " ".join(words(query))
+        if not prefix:
+            return []
+        return [
+            GameSuggestion.construct(
+                game=GameRef(gameId),
+                name=self._games[gameId][0],
+                publisher=self._games[gameId][1],
+                copies=self.copies.get(gameId, 0),
+            )
+            for gameId in self._ranked(prefix)[:limit]
+        ]
+
+    async def build(self):
+        games = GameAbstract.get_motor_collection().find(
+            {}, {"name": 1, "publisher": 1}
+        )
+        self.load(
+            {
+                str(game["_id"]): (game["name"], game["publisher"])
+                async for game in games
+            }
+        )
+        await self.count_copies()
+
+    async def count_copies(self):
+        counts = OwnedGame.get_motor_collection().aggregate(
+            [{"$group": {"_id": "$game", "copies": {"$sum": 1}}}]
+        )
+        self.copies = {str(count["_id"]): count["copies"] async for count in counts}
+        self.rerank()
+
+    async def _reread(self, gameId: str):
+        game = await GameAbstract.get(GameRef(gameId))
+        if game is None:
+            self.remove(gameId)
+        else:
+            self.add(game)
+
+    def reread(self, gameId: str):
+        """Invalidation bus handler, rereads the game in the background"""
+        if self._refresher is not None:
+            task = asyncio.get_running_loop().create_task(self._reread(gameId))
+            self._rereads.add(task)
+            task.add_done_callback(self._rereads.discard)
+
+    def recount(self, userId: str):
+        """Invalidation bus handler for library writes"""
+        self._holdingsChanged.set()
+
+    async def _refresh_copies(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._holdingsChanged.wait(), REFRESH_INTERVAL)
+                await asyncio.sleep(RECOUNT_DELAY)
+            except asyncio.TimeoutError:
+                pass  # the periodic count catches bulk writes nobody published
+            # cleared first, writes made while counting trigger another count
+            self._holdingsChanged.clear()
+            try:
+                await self.count_copies()
+            except Exception:
+                logger.exception("Counting owned copies for suggestions failed")
+
+    async def start(self):
+        await self.build()
+        self._refresher = asyncio.get_running_loop().create_task(
+            self._refresh_copies()
+        )
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+
+suggestIndex = SuggestIndex()
+invalidationBus.subscribe("GameAbstract", suggestIndex.reread)
+invalidationBus.subscribe("Holdings", suggestIndex.recount)
@@ -0,0 +1,394 @@
+"""
+Ownership transfer engine for trades. Without multi document transactions an
+accept is a sequence of conditional updates (claim the trade, move and lock
+each side, mark it accepted) that moves every game or none. Interrupted
+accepts are repaired by recover_stalled_trades.
+"""
+from fastapi import HTTPException, status
+from beanie import PydanticObjectId
+from beanie.operators import In
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
+from decouple import config
+from models.gameModel import OwnedGame
+from models.tradeModel import TradeCycle, TradeOffer, TradeStatus
+from services.matchService import holdings_changed
+from services.lifecycleService import find_trade
+from services.jobService import jobQueue, RecurringJob
+
+# a settling trade older than this is assumed to belong to a dead process
+SETTLE_TIMEOUT = timedelta(seconds=config("TRADE_SETTLE_TIMEOUT", default=60, cast=int))
+# seconds between recoveries, 0 to only recover at startup
+RECOVERY_INTERVAL = config("TRADE_RECOVERY_INTERVAL", default=60, cast=int)
+
+
+async def _claim(
+    tradeID: PydanticObjectId, receiver: PydanticObjectId, newStatus: dict
+):
+    return await TradeOffer.get_motor_collection().find_one_and_update(
+        {
+            "_id": tradeID,
+            "receiver": receiver,
+            "status": TradeStatus.pending.value,
+            "settlingSince": None,
+            "cycle": None,
+        },
+        newStatus,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _explain_claim_failure(
+    tradeID: PydanticObjectId, receiver: PydanticObjectId
+) -> TradeOffer:
+    """Raises the reason of the failed claim, returns the trade of cycle legs"""
+    trade = await find_trade(tradeID)
+    if trade is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Trade not found",
+        )
+    if trade.receiver != receiver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not the receiver of this trade",
+        )
+    if trade.status != TradeStatus.pending:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="This trade is not pending",
+        )
+    if trade.cycle is not None:
+        return trade
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="This trade is already being accepted",
+    )
+
+
+async def _move(
+    trade: TradeOffer, ids: list, fromUser: PydanticObjectId, toUser: PydanticObjectId
+) -> bool:
+    result = await OwnedGame.get_motor_collection().update_many(
+        {"_id": {"$in": ids}, "owner": fromUser, "tradeLock": None},
+        {
+            "$set": {"owner": toUser, "tradeLock": trade.id},
+            "$push": {"ownerHistory": toUser},
+        },
+    )
+    return result.modified_count == len(ids)
+
+
+async def _move_back(
+    trade: TradeOffer, ids: list, fromUser: PydanticObjectId, toUser: PydanticObjectId
+):
+    await OwnedGame.get_motor_collection().update_many(
+        {"_id": {"$in": ids}, "owner": toUser, "tradeLock": trade.id},
+        {
+            "$set": {"owner": fromUser},
+            "$unset": {"tradeLock": ""},
+            "$pop": {"ownerHistory": 1},
+        },
+    )
+
+
+async def _release_locks(trade: TradeOffer):
+    await OwnedGame.get_motor_collection().update_many(
+        {"tradeLock": trade.id}, {"$unset": {"tradeLock": ""}}
+    )
+
+
+async def _undo(trade: TradeOffer):
+    """Moves back whatever an accept of the trade moved, safe to repeat"""
+    offererIds = [game.id for game in trade.offererGames]
+    receiverIds = [game.id for game in trade.receiverGames]
+    await _move_back(trade, offererIds, trade.offerer, trade.receiver)
+    await _move_back(trade, receiverIds, trade.receiver, trade.offerer)
+    await _release_locks(trade)
+
+
+async def _roll_back(trade: TradeOffer):
+    """Rolls back a stalled accept unless it finishes first"""
+    # clearing the claim first makes the accept fail to finalize, whatever it
+    # moves from then on it undoes itself
+    claimed = await TradeOffer.get_motor_collection().find_one_and_update(
+        {
+            "_id": trade.id,
+            "status": TradeStatus.pending.value,
+            "settlingSince": trade.settlingSince,
+        },
+        {"$set": {"settlingSince": None}},
+    )
+    if claimed is not None:
+        await _undo(trade)
+
+
+async def accept_trade(
+    tradeID: PydanticObjectId, receiver: PydanticObjectId
+) -> TradeOffer:
+    claimed = await _claim(
+        tradeID, receiver, {"$set": {"settlingSince": datetime.utcnow()}}
+    )
+    if claimed is None:
+        leg = await _explain_claim_failure(tradeID, receiver)
+        return await _accept_leg(leg, receiver)
+    trade = TradeOffer.parse_obj(claimed)
+
+    offererIds = [game.id for game in trade.offererGames]
+    receiverIds = [game.id for game in trade.receiverGames]
+    moved = await _move(trade, offererIds, trade.offerer, trade.receiver)
+    if moved:
+        moved = await _move(trade, receiverIds, trade.receiver, trade.offerer)
+    if not moved:
+        await _undo(trade)
+        await TradeOffer.get_motor_collection().update_one(
+            {"_id": trade.id, "settlingSince": trade.settlingSince},
+            {"$set": {"settlingSince": None}},
+        )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Some of the games in this trade changed owner since it was offered",
+        )
+
+    accepted = await TradeOffer.get_motor_collection().find_one_and_update(
+        {"_id": trade.id, "settlingSince": trade.settlingSince},
+        {
+            "$set": {
+                "status": TradeStatus.accepted.value,
+                "settlingSince": None,
+                "timeOfClosing": datetime.utcnow(),
+            }
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if accepted is None:
+        # the claim timed out and recover_stalled_trades rolled it back, maybe
+        # before the games above moved
+        await _undo(trade)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="This trade took too long to accept, try again",
+        )
+    await _release_locks(trade)
+    await holdings_changed(trade.offerer, trade.receiver)
+    return TradeOffer.parse_obj(accepted)
+
+
+async def decline_trade(
+    tradeID: PydanticObjectId, receiver: PydanticObjectId
+) -> TradeOffer:
+    declined = await _claim(
+        tradeID,
+        receiver,
+        {
+            "$set": {
+                "status": TradeStatus.declined.value,
+                "timeOfClosing": datetime.utcnow(),
+            }
+        },
+    )
+    if declined is None:
+        leg = await _explain_claim_failure(tradeID, receiver)
+        await _decline_cycle(leg.cycle)
+        return await TradeOffer.get(leg.id)
+    return TradeOffer.parse_obj(declined)
+
+
+async def _accept_leg(leg: TradeOffer, receiver: PydanticObjectId) -> TradeOffer:
+    accepted = await TradeCycle.get_motor_collection().find_one_and_update(
+        {"_id": leg.cycle, "status": TradeStatus.pending.value},
+        {"$addToSet": {"accepted": receiver}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if accepted is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="This trade is not pending",
+        )
+    cycle = TradeCycle.parse_obj(accepted)
+    if set(cycle.accepted) >= set(cycle.participants):
+        await _settle_cycle(cycle)
+    return await TradeOffer.get(leg.id)
+
+
+async def _decline_cycle(cycleID: PydanticObjectId):
+    declined = await TradeCycle.get_motor_collection().update_one(
+        {
+            "_id": cycleID,
+            "status": TradeStatus.pending.value,
+            "settlingSince": None,
+        },
+        {"$set": {"status": TradeStatus.declined.value}},
+    )
+    if declined.modified_count == 0:
+        cycle = await TradeCycle.get(cycleID)
+        if cycle is None or cycle.status != TradeStatus.pending:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="This trade is not pending",
+            )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="This trade is already being accepted",
+        )
+    await _finish_legs(cycleID, TradeStatus.declined)
+
+
+async def _finish_legs(
+    cycleID: PydanticObjectId, newStatus: TradeStatus, settlingSince=None
+) -> int:
+    """Closes the pending legs, only those still claimed at settlingSince if given"""
+    query = {"cycle": cycleID, "status": TradeStatus.pending.value}
+    if settlingSince is not None:
+        query["settlingSince"] = settlingSince
+    result = await TradeOffer.get_motor_collection().update_many(
+        query,
+        {
+            "$set": {
+                "status": newStatus.value,
+                "settlingSince": None,
+                "timeOfClosing": datetime.utcnow(),
+            }
+        },
+    )
+    return result.modified_count
+
+
+async def _settle_cycle(cycle: TradeCycle):
+    claimed = await TradeCycle.get_motor_collection().find_one_and_update(
+        {
+            "_id": cycle.id,
+            "status": TradeStatus.pending.value,
+            "settlingSince": None,
+        },
+        {"$set": {"settlingSince": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if claimed is None:
+        return  # the accept of another participant is settling it
+    settlingSince = claimed["settlingSince"]
+    legs = await TradeOffer.find(In(TradeOffer.id, cycle.trades)).to_list()
+    await TradeOffer.get_motor_collection().update_many(
+        {"cycle": cycle.id, "status": TradeStatus.pending.value},
+        {"$set": {"settlingSince": settlingSince}},
+    )
+
+    for index, leg in enumerate(legs):
+        ids = [game.id for game in leg.offererGames]
+        if not await _move(leg, ids, leg.offerer, leg.receiver):
+            for movedLeg in legs[: index + 1]:
+                await _undo(movedLeg)
+            await TradeCycle.get_motor_collection().update_one(
+                {"_id": cycle.id},
+                {"$set": {"status": TradeStatus.declined.value, "settlingSince": None}},
+            )
+            await _finish_legs(cycle.id, TradeStatus.declined)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Some of the games in this trade cycle changed owner since it was proposed, the cycle is declined",
+            )
+
+    # legs first, recover_stalled_trades completes a cycle with an accepted leg
+    if not await _finish_legs(cycle.id, TradeStatus.accepted, settlingSince):
+        # recover_stalled_trades rolled it back, maybe before the moves above
+        for leg in legs:
+            await _undo(leg)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="This trade took too long to accept, try again",
+        )
+    accepted = await TradeCycle.get_motor_collection().update_one(
+        {"_id": cycle.id, "settlingSince": settlingSince},
+        {"$set": {"status": TradeStatus.accepted.value, "settlingSince": None}},
+    )
+    for leg in legs:
+        await _release_locks(leg)
+    await holdings_changed(*cycle.participants)
+    if accepted.modified_count == 0:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="This trade took too long to accept, try again",
+        )
+
+
+async def _recover_cycle(cycle: TradeCycle):
+    # claimed like _roll_back claims a trade, so a slow settle can't finish it
+    claimed = await TradeCycle.get_motor_collection().find_one_and_update(
+        {
+            "_id": cycle.id,
+            "status": TradeStatus.pending.value,
+            "settlingSince": cycle.settlingSince,
+        },
+        {"$set": {"settlingSince": None}},
+    )
+    if claimed is None:
+        return  # the settle finished meanwhile
+    if await TradeOffer.find(
+        TradeOffer.cycle == cycle.id, TradeOffer.status == TradeStatus.accepted
+    ).count():
+        # every game had moved, finish marking it accepted
+        await _finish_legs(cycle.id, TradeStatus.accepted)
+        newStatus = TradeStatus.accepted
+    else:
+        await TradeOffer.get_motor_collection().update_many(
+            {"cycle": cycle.id, "status": TradeStatus.pending.value},
+            {"$set": {"settlingSince": None}},
+        )
+        async for leg in TradeOffer.find(TradeOffer.cycle == cycle.id):
+            await _undo(leg)
+        newStatus = TradeStatus.pending
+    await TradeCycle.get_motor_collection().update_one(
+        {"_id": cycle.id},
+        {"$set": {"status": newStatus.value, "settlingSince": None}},
+    )
+    if newStatus == TradeStatus.pending:
+        try:
+            await _settle_cycle(cycle)  # everyone had accepted it already
+        except HTTPException:
+            pass
+
+
+async def recover_stalled_trades():
+    """Finishes or rolls back trades whose accept was interrupted"""
+    stalledCycles = TradeCycle.find(
+        TradeCycle.status == TradeStatus.pending,
+        TradeCycle.settlingSince < datetime.utcnow() - SETTLE_TIMEOUT,
+    )
+    async for cycle in stalledCycles:
+        await _recover_cycle(cycle)
+    stalled = TradeOffer.find(
+        TradeOffer.status == TradeStatus.pending,
+        TradeOffer.settlingSince < datetime.utcnow() - SETTLE_TIMEOUT,
+        TradeOffer.cycle == None,  # legs are recovered with their cycle
+    )
+    async for trade in stalled:
+        await _roll_back(trade)
+    # legs of a proposal that died before inserting their cycle
+    cycleIds = await TradeOffer.distinct(
+        "cycle",
+        {
+            "status": TradeStatus.pending.value,
+            "cycle": {"$ne": None},
+            "timeOfRequest": {"$lt": datetime.utcnow() - SETTLE_TIMEOUT},
+        },
+    )
+    if cycleIds:
+        proposed = await TradeCycle.distinct("_id", {"_id": {"$in": cycleIds}})
+        orphans = set(cycleIds) - set(proposed)
+        if orphans:
+            await TradeOffer.find(In(TradeOffer.cycle, list(orphans))).delete()
+    # accepted trades that died before releasing their locks
+    for tradeID in await OwnedGame.distinct("tradeLock", {"tradeLock": {"$ne": None}}):
+        trade = await TradeOffer.get(tradeID)
+        if trade is None or trade.status == TradeStatus.accepted:
+            await OwnedGame.get_motor_collection().update_many(
+                {"tradeLock": tradeID}, {"$unset": {"tradeLock": ""}}
+            )
+
+
+@jobQueue.handler("trade_recovery")
+async def recovery(payload: dict):
+    await recover_stalled_trades()
+
+
+tradeRecovery = RecurringJob("trade_recovery", RECOVERY_INTERVAL)
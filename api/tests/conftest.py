@@ -0,0 +1,119 @@
+"""
+The tests run the app against mongomock, so they need no Mongo server:
+
+    pip install -r requirements-test.txt
+    python -m pytest
+"""
+import os
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("INVALIDATION_TRANSPORT", "memory")
+os.environ.setdefault("INDEX_CHECK", "False")
+os.environ.setdefault("RATE_LIMIT_STORE", "off")
+os.environ.setdefault("CYCLE_MATCH_INTERVAL", "0")
+os.environ.setdefault("TRADE_SWEEP_INTERVAL", "0")
+os.environ.setdefault("TRADE_RECOVERY_INTERVAL", "0")
+
+import mongomock_motor
+import motor.motor_asyncio
+
+motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+
+import pytest
+import uuid
+from fastapi.testclient import TestClient
+from main import app
+from models.userModel import User
+
+ADDRESS = {
+    "street": "1 Main St",
+    "city": "Springfield",
+    "state": "OR",
+    "zipcode": "97477",
+    "country": "USA",
+}
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def run(client):
+    """Runs a coroutine function on the loop of the app"""
+    return client.portal.call
+
+
+@pytest.fixture
+def make_user(client, run):
+    """Registers a user, returns its id and the headers authenticating it"""
+
+    def make_user(admin: bool = False):
+        name = uuid.uuid4().hex[:12]
+        response = client.post(
+            "/users/register",
+            json={
+                "username": name,
+                "email": f"{name}@example.com",
+                "password": "password",
+                "street_address": ADDRESS,
+            },
+        )
+        assert response.status_code == 201, response.text
+        userId = response.json()["id"]
+        if admin:
+
+            async def promote():
+                user = await User.get(userId)
+                user.isAdmin = True
+                await user.save()
+
+            run(promote)
+        token = client.post(
+            "/users/token",
+            data={"username": f"{name}@example.com", "password": "password"},
+        ).json()["access_token"]
+        return userId, {"Authorization": f"Bearer {token}"}
+
+    return make_user
+
+
+@pytest.fixture
+def make_game(client):
+    def make_game(**fields):
+        game = {
+            "name": "Super Mario Bros",
+            "publisher": "Nintendo",
+            "release_date": "1985-09-13",
+            "platforms": ["NES"],
+            "tags": ["Action"],
+        }
+        game.update(fields)
+        response = client.post("/games", json=game)
+        assert response.status_code == 201, response.text
+        body = response.json()
+        return body.get("id") or body["_id"]
+
+    return make_game
+
+
+@pytest.fixture
+def add_copy(client):
+    """Adds a copy of a game to the library of a user, returns the copy"""
+
+    def add_copy(headers: dict, gameId: str, condition: str = "Good"):
+        response = client.post(
+            "/users/library",
+            json={"game": gameId, "condition": condition},
+            headers=headers,
+        )
+        assert response.status_code == 201, response.text
+        return response.json()
+
+    return add_copy
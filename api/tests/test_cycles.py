@@ -0,0 +1,135 @@
+from beanie import PydanticObjectId
+from beanie.operators import In
+from datetime import datetime
+from models.tradeModel import TradeCycle, TradeOffer, TradeStatus
+from services import tradeService
+from services.matchService import Leg, TradeGraph, propose
+from services.tradeService import SETTLE_TIMEOUT
+import pytest
+
+
+def test_shortest_cycle_through_the_changed_users():
+    graph = TradeGraph()
+    # a gives x to b, b gives y to c, c gives z to a, d also gives x to b
+    graph.set_library("a", [("a1", "x")])
+    graph.set_library("b", [("b1", "y")])
+    graph.set_library("c", [("c1", "z")])
+    graph.set_library("d", [("d1", "x")])
+    graph.set_wishlist("a", {"z"})
+    graph.set_wishlist("b", {"x"})
+    graph.set_wishlist("c", {"y"})
+    (cycle,) = graph.find_cycles(set(), {"a"})
+    assert cycle == [
+        Leg("a", "b", "x", "a1"),
+        Leg("b", "c", "y", "b1"),
+        Leg("c", "a", "z", "c1"),
+    ]
+    assert graph.find_cycles({"c"}, {"a"}) == []
+
+
+@pytest.fixture
+def swap(client, make_user, make_game, add_copy):
+    """Two users owning the game the other one wants, and the admin headers"""
+    firstGame, secondGame = make_game(name="Zelda"), make_game(name="Metroid")
+    users = []
+    for owned, wanted in ((firstGame, secondGame), (secondGame, firstGame)):
+        userId, headers = make_user()
+        add_copy(headers, owned)
+        response = client.post(
+            "/users/wishlist", json={"game": wanted}, headers=headers
+        )
+        assert response.status_code == 201, response.text
+        users.append((userId, headers))
+    _, admin = make_user(admin=True)
+    return users, admin
+
+
+def match(client, admin, users, full: bool = False) -> list:
+    """The cycles proposed to the users"""
+    response = client.post(f"/trades/cycles/match?full={full}", headers=admin)
+    assert response.status_code == 200, response.text
+    ids = {userId for userId, _ in users}
+    return [
+        cycle
+        for cycle in response.json()
+        if {link.rsplit("/", 1)[-1] for link in cycle["participants"]} == ids
+    ]
+
+
+def test_declined_cycle_is_not_proposed_again(client, run, swap):
+    users, admin = swap
+    (cycle,) = match(client, admin, users)
+    cycleId = PydanticObjectId(cycle["_id"])
+    legs = run(TradeOffer.find(TradeOffer.cycle == cycleId).to_list)
+    assert len(legs) == 2 and all(leg.status == TradeStatus.pending for leg in legs)
+    receiverHeaders = dict(users)[str(legs[0].receiver)]
+    response = client.post(f"/trades/decline/{legs[0].id}", headers=receiverHeaders)
+    assert response.status_code == 200, response.text
+    assert run(TradeCycle.get, PydanticObjectId(cycle["_id"])).status == "declined"
+    assert match(client, admin, users, full=True) == []
+
+
+def test_expired_cycle_is_proposed_again(client, run, swap):
+    users, admin = swap
+
+    async def partial_index():
+        # mongomock drops the partial filter of the indexes beanie creates
+        cycles = TradeCycle.get_motor_collection()
+        await cycles.drop_index("pending_cycle_key")
+        await cycles.create_index(
+            "key",
+            name="pending_cycle_key",
+            unique=True,
+            partialFilterExpression={"status": TradeStatus.pending.value},
+        )
+
+    run(partial_index)
+    (cycle,) = match(client, admin, users)
+
+    async def expire():
+        await TradeCycle.find_one(
+            TradeCycle.id == PydanticObjectId(cycle["_id"])
+        ).update({"$set": {"status": TradeStatus.expired.value}})
+
+    run(expire)
+    (again,) = match(client, admin, users, full=True)
+    assert again["_id"] != cycle["_id"]
+
+
+def test_pending_cycle_is_proposed_once(client, run, swap):
+    users, admin = swap
+    (cycle,) = match(client, admin, users)
+    existing = run(TradeCycle.get, PydanticObjectId(cycle["_id"]))
+    legs = run(TradeOffer.find(In(TradeOffer.id, existing.trades)).to_list)
+    again = [
+        Leg(leg.offerer, leg.receiver, leg.offererGames[0].game, leg.offererGames[0].id)
+        for leg in legs
+    ]
+    before = run(TradeOffer.find(In(TradeOffer.offerer, existing.participants)).count)
+    assert run(propose, again) is None
+    # the legs inserted before the cycle were deleted again
+    after = run(TradeOffer.find(In(TradeOffer.offerer, existing.participants)).count)
+    assert after == before
+
+
+def test_recovery_deletes_legs_without_a_cycle(client, run, swap):
+    users, _ = swap
+    (first, _), (second, _) = users
+
+    async def orphan():
+        leg = TradeOffer(
+            id=PydanticObjectId(),
+            offerer=PydanticObjectId(first),
+            receiver=PydanticObjectId(second),
+            offererMessage="",
+            offererGames=[],
+            receiverGames=[],
+            cycle=PydanticObjectId(),
+            timeOfRequest=datetime.utcnow() - 2 * SETTLE_TIMEOUT,
+        )
+        await leg.insert()
+        return leg.id
+
+    legId = run(orphan)
+    run(tradeService.recover_stalled_trades)
+    assert run(TradeOffer.get, legId) is None
@@ -0,0 +1,124 @@
+from models.gameModel import GameAbstract
+from models.userModel import User
+from services.cacheService import userCache, gameCache
+from services.expandService import BatchLoader
+import asyncio
+import pytest
+
+
+def test_batch_loader_loads_concurrent_keys_once(run):
+    batches = []
+
+    async def batch(keys):
+        batches.append(keys)
+        return {key: key * 2 for key in keys if key != 3}
+
+    async def load():
+        loader = BatchLoader(batch)
+        first = await asyncio.gather(*(loader.load(key) for key in (1, 2, 1, 3)))
+        again = await asyncio.gather(loader.load(2), loader.load(4))
+        return first, again
+
+    first, again = run(load)
+    assert first == [2, 4, 2, None]
+    assert again == [4, 8]
+    assert batches == [[1, 2, 3], [4]]
+
+
+def test_batch_loader_fails_every_key_of_a_failed_batch(run):
+    async def batch(keys):
+        raise RuntimeError("database down")
+
+    async def load():
+        loader = BatchLoader(batch)
+        return await asyncio.gather(
+            loader.load(1), loader.load(2), return_exceptions=True
+        )
+
+    assert all(isinstance(result, RuntimeError) for result in run(load))
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """The ids each model's find was asked for, by model"""
+    asked = {User: [], GameAbstract: []}
+    for model in asked:
+        original = model.find
+
+        def find(*args, model=model, original=original, **kwargs):
+            asked[model].append(args)
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(model, "find", find)
+    return asked
+
+
+@pytest.fixture
+def library(client, make_user, make_game, add_copy):
+    userId, headers = make_user()
+    games = [make_game() for _ in range(3)]
+    for game in games + games[:1]:
+        add_copy(headers, game)
+    return userId, headers, games
+
+
+def test_expand_loads_each_collection_once(client, library, queries):
+    userId, headers, games = library
+    userCache.clear()
+    gameCache.clear()
+    response = client.get(
+        "/users/library", params={"expand": "games,owner"}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+    copies = response.json()["items"]
+    assert len(copies) == 4
+    assert {copy["game"]["_id"] for copy in copies} == set(games)
+    assert {copy["owner"]["id"] for copy in copies} == {userId}
+    # the authenticated user is cached by then, the games need one $in query
+    assert len(queries[GameAbstract]) == 1
+    assert queries[User] == []
+
+
+def test_expand_loads_many_owners_at_once(
+    client, make_user, make_game, add_copy, queries
+):
+    game = make_game()
+    owners = set()
+    for _ in range(3):
+        userId, headers = make_user()
+        add_copy(headers, game)
+        add_copy(headers, game)
+        owners.add(userId)
+    userCache.clear()
+    response = client.get(f"/games/{game}/owners", params={"expand": "owner"})
+    assert response.status_code == 200, response.text
+    assert {copy["owner"]["id"] for copy in response.json()["items"]} == owners
+    assert len(queries[User]) == 1
+
+
+def test_expand_reuses_cached_documents(client, library, queries):
+    userId, headers, games = library
+    client.get(f"/users/{userId}")
+    for game in games:
+        client.get(f"/games/{game}")
+    response = client.get(
+        f"/users/{userId}/library", params={"expand": "games,owner"}
+    )
+    assert response.status_code == 200, response.text
+    assert {copy["game"]["_id"] for copy in response.json()["items"]} == set(games)
+    assert queries == {User: [], GameAbstract: []}
+
+
+def test_expand_without_fields_keeps_links(client, library):
+    userId, headers, _ = library
+    copies = client.get(f"/users/{userId}/library").json()["items"]
+    assert all(copy["owner"].endswith(f"/users/{userId}") for copy in copies)
+
+
+def test_unknown_expand_field_is_refused(client, library):
+    userId, _, _ = library
+    response = client.get(
+        f"/users/{userId}/library", params={"expand": "owner,trades,friends"}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Can't expand friends, trades"
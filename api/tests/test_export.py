@@ -0,0 +1,51 @@
+from typing import Optional
+from services import exportService
+import gzip
+import orjson
+import pytest
+
+
+def export(client, url: str, headers: Optional[dict] = None, **params) -> list[dict]:
+    """Reads a gzipped export as sent, decompressing it here"""
+    params["gzip"] = "true"
+    with client.stream("GET", url, params=params, headers=headers) as response:
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Content-Type"] == "application/x-ndjson"
+        body = gzip.decompress(b"".join(response.iter_raw()))
+    assert body.endswith(b"\n")
+    return [orjson.loads(line) for line in body.splitlines()]
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(exportService, "BATCH_SIZE", 2)
+
+
+def test_user_export_resumes_after_the_last_id(client, make_user):
+    _, adminHeaders = make_user(admin=True)
+    created = [make_user()[0] for _ in range(5)]
+    users = export(client, "/users/export", adminHeaders)
+    ids = [user["_id"] for user in users]
+    assert ids == sorted(ids)
+    assert set(created) <= set(ids)
+    assert all("password" not in user for user in users)
+
+    # an export interrupted after the third of the new users
+    resumed = export(client, "/users/export", adminHeaders, after=created[2])
+    assert [user["_id"] for user in resumed] == ids[ids.index(created[2]) + 1 :]
+
+
+def test_user_export_is_admin_only(client, make_user):
+    _, headers = make_user()
+    assert client.get("/users/export", headers=headers).status_code == 403
+    assert client.get("/users/export").status_code == 401
+
+
+def test_game_export_resumes_after_the_last_id(client, make_game):
+    created = [make_game() for _ in range(3)]
+    games = export(client, "/games/export")
+    ids = [game["_id"] for game in games]
+    assert ids == sorted(ids) and set(created) <= set(ids)
+    resumed = export(client, "/games/export", after=ids[-2])
+    assert [game["_id"] for game in resumed] == ids[-1:]
@@ -0,0 +1,41 @@
+GAME = {
+    "name": "Tetris",
+    "publisher": "Nintendo",
+    "release_date": "1989-06-14",
+    "platforms": ["Game Boy"],
+    "tags": ["Puzzle"],
+}
+
+
+def test_unchanged_game_is_not_sent_again(client, make_game):
+    gameId = make_game(**GAME)
+    response = client.get(f"/games/{gameId}")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    response = client.get(f"/games/{gameId}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_update_changes_the_etag(client, make_game):
+    gameId = make_game(**GAME)
+    etag = client.get(f"/games/{gameId}").headers["ETag"]
+    response = client.put(f"/games/{gameId}", json={**GAME, "name": "Tetris DX"})
+    assert response.status_code == 202, response.text
+    response = client.get(f"/games/{gameId}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["name"] == "Tetris DX"
+
+
+def test_deleted_game_is_not_served_from_the_cache(client, make_game):
+    gameId = make_game(**GAME)
+    assert client.get(f"/games/{gameId}").status_code == 200
+    assert client.delete(f"/games/{gameId}").status_code == 202
+    assert client.get(f"/games/{gameId}").status_code == 404
+
+
+def test_update_of_unknown_game(client):
+    response = client.put("/games/63a1f0c2e4b0a1b2c3d4e5f6", json=GAME)
+    assert response.status_code == 404
@@ -0,0 +1,21 @@
+from services.databaseService import DOCUMENT_MODELS
+from services.indexService import HOT_QUERIES, plan_stages
+
+
+def test_hot_queries_run_on_initialised_models():
+    # an ArchivedTrade unknown to init_beanie would query the Trades collection
+    for query in HOT_QUERIES:
+        assert query.model in DOCUMENT_MODELS, query.name
+
+
+def test_plan_stages():
+    plan = {
+        "queryPlan": {
+            "stage": "FETCH",
+            "inputStage": {
+                "stage": "OR",
+                "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}],
+            },
+        }
+    }
+    assert plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
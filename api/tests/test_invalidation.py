@@ -0,0 +1,43 @@
+from services.invalidationBus import InvalidationBus, InvalidationEvent, MemoryTransport
+import asyncio
+
+
+def event(milliseconds: int, counter: int, replica: str) -> InvalidationEvent:
+    return InvalidationEvent(
+        model="User", documentId="1", version=(milliseconds, counter, replica)
+    )
+
+
+def test_out_of_order_events_from_two_replicas_evict():
+    bus = InvalidationBus("c")
+    evicted = []
+    bus.subscribe("User", evicted.append)
+
+    async def deliver():
+        await bus._receive(event(2000, 0, "a"))
+        # written by b before a's write but delivered after it
+        await bus._receive(event(1000, 0, "b"))
+        await bus._receive(event(1000, 1, "a"))
+        # delivered twice, by a tailer that restarted
+        await bus._receive(event(2000, 0, "a"))
+
+    asyncio.run(deliver())
+    assert evicted == ["1", "1", "1"]
+    assert bus.dropped == 1
+
+
+def test_replicas_share_invalidations():
+    transport = MemoryTransport()
+    first, second = InvalidationBus("a"), InvalidationBus("b")
+    evicted = {"a": [], "b": []}
+    first.subscribe("User", evicted["a"].append)
+    second.subscribe("User", evicted["b"].append)
+
+    async def write():
+        await first.start(transport)
+        await second.start(transport)
+        await first.publish("User", "1")
+        await second.publish("User", "2")
+
+    asyncio.run(write())
+    assert evicted == {"a": ["1", "2"], "b": ["1", "2"]}
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from models.jobModel import Job, JobStatus
+from services import jobService
+from services.jobService import RecurringJob, jobQueue
+import pytest
+
+
+@pytest.fixture
+def queue(run):
+    """The job queue without its workers, so the test runs the jobs"""
+    run(jobQueue.stop)
+    run(Job.delete_all)
+    calls = []
+
+    @jobQueue.handler("test")
+    async def handle(payload: dict):
+        calls.append(payload)
+        if payload.get("fail"):
+            raise RuntimeError("broken")
+
+    yield calls
+    del jobQueue._handlers["test"]
+    run(Job.delete_all)
+    run(jobQueue.start)
+
+
+def due_now(run, job: Job):
+    """Moves the job to the past, as if its delay or timeout had passed"""
+
+    async def move():
+        await Job.find_one(Job.id == job.id).update(
+            {"$set": {"runAt": datetime.utcnow() - timedelta(seconds=1)}}
+        )
+
+    run(move)
+
+
+def test_same_key_is_enqueued_once(run, queue):
+    first = run(jobQueue.enqueue, "test", {"n": 1}, "test:once")
+    second = run(jobQueue.enqueue, "test", {"n": 2}, "test:once")
+    assert first.id == second.id
+    assert run(jobQueue.run_next)
+    assert not run(jobQueue.run_next)
+    assert queue == [{"n": 1}]
+
+
+def test_job_of_a_dead_worker_runs_again(run, queue):
+    job = run(jobQueue.enqueue, "test", {})
+    # taken by a worker that dies before finishing it
+    taken = run(jobQueue._take)
+    assert taken.id == job.id and taken.status == JobStatus.running
+    assert not run(jobQueue.run_next)  # invisible until the timeout
+    due_now(run, job)
+    assert run(jobQueue.run_next)
+    finished = run(Job.get, job.id)
+    assert finished.status == JobStatus.done and finished.attempts == 2
+    # the dead worker finishing late doesn't change the outcome
+    run(jobQueue._finish, taken, {"status": JobStatus.failed.value})
+    assert run(Job.get, job.id).status == JobStatus.done
+
+
+def test_failing_job_is_retried_then_given_up(run, queue, monkeypatch):
+    monkeypatch.setattr(jobService, "MAX_ATTEMPTS", 2)
+    job = run(jobQueue.enqueue, "test", {"fail": True})
+    assert run(jobQueue.run_next)
+    retried = run(Job.get, job.id)
+    assert retried.status == JobStatus.queued
+    assert retried.lastError == "RuntimeError: broken"
+    assert retried.runAt > datetime.utcnow()
+    assert not run(jobQueue.run_next)  # backing off
+    due_now(run, job)
+    assert run(jobQueue.run_next)
+    failed = run(Job.get, job.id)
+    assert failed.status == JobStatus.failed and failed.attempts == 2
+    assert len(queue) == 2
+
+
+def test_recurring_job_runs_once_per_interval(run, queue):
+    recurring = RecurringJob("test", 3600)
+    first = run(recurring.enqueue)
+    assert run(recurring.enqueue).id == first.id
+    assert first.payload == {"window": first.payload["window"]}
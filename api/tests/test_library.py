@@ -0,0 +1,151 @@
+from beanie import PydanticObjectId
+from beanie.operators import In
+from models.gameModel import OwnedGame
+from models.wishlistModel import WishlistEntry
+from routers import libraryRouter, usersRouter
+from services.migrationService import run_once
+
+
+def lock(run, copyId: str):
+    async def lock():
+        await OwnedGame.find_one(OwnedGame.id == PydanticObjectId(copyId)).update(
+            {"$set": {"tradeLock": PydanticObjectId()}}
+        )
+
+    run(lock)
+
+
+def test_locked_copy_is_not_updated(client, run, make_user, make_game, add_copy):
+    _, headers = make_user()
+    copy = add_copy(headers, make_game())
+    lock(run, copy["id"])
+    response = client.put(
+        f"/users/library/{copy['id']}", json={"condition": "Poor"}, headers=headers
+    )
+    assert response.status_code == 409
+
+    async def condition():
+        return (await OwnedGame.get(copy["id"])).condition
+
+    assert run(condition) == "Good"
+
+
+def test_update_of_another_users_copy(client, make_user, make_game, add_copy):
+    _, owner = make_user()
+    _, other = make_user()
+    copy = add_copy(owner, make_game())
+    response = client.put(
+        f"/users/library/{copy['id']}", json={"condition": "Poor"}, headers=other
+    )
+    assert response.status_code == 404
+    response = client.put(
+        f"/users/library/{copy['id']}", json={"condition": "Poor"}, headers=owner
+    )
+    assert response.status_code == 202
+    assert response.json()["condition"] == "Poor"
+
+
+def test_migrations_run_once(run):
+    runs = []
+
+    async def migration():
+        runs.append(1)
+
+    assert run(run_once, "test_migration", migration)
+    assert not run(run_once, "test_migration", migration)
+    assert runs == [1]
+
+
+def test_batch_skips_locked_copies(client, run, make_user, make_game, add_copy):
+    _, headers = make_user()
+    gameId = make_game()
+    locked, free = add_copy(headers, gameId), add_copy(headers, gameId)
+    lock(run, locked["id"])
+    response = client.post(
+        "/users/library/batch",
+        json=[
+            {"op": "update", "id": locked["id"], "condition": "Poor"},
+            {"op": "remove", "id": locked["id"]},
+            {"op": "update", "id": free["id"], "condition": "Poor"},
+        ],
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == [409, 409, 202]
+    assert body["summary"] == {"added": 0, "updated": 1, "removed": 0, "failed": 2}
+    assert run(OwnedGame.get, PydanticObjectId(locked["id"])).condition == "Good"
+
+
+def test_batch_reports_copies_locked_before_the_write(
+    client, run, make_user, make_game, add_copy, monkeypatch
+):
+    _, headers = make_user()
+    gameId = make_game()
+    updated, removed = add_copy(headers, gameId), add_copy(headers, gameId)
+
+    class LockingWriter(libraryRouter.BulkWriter):
+        async def commit(self):
+            # a trade locks both copies between the read and the write
+            ids = [PydanticObjectId(copy["id"]) for copy in (updated, removed)]
+            await OwnedGame.find(In(OwnedGame.id, ids)).update(
+                {"$set": {"tradeLock": PydanticObjectId()}}
+            )
+            await super().commit()
+
+    monkeypatch.setattr(libraryRouter, "BulkWriter", LockingWriter)
+    response = client.post(
+        "/users/library/batch",
+        json=[
+            {"op": "update", "id": updated["id"], "condition": "Poor"},
+            {"op": "remove", "id": removed["id"]},
+        ],
+        headers=headers,
+    )
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == [409, 409]
+    assert body["summary"] == {"added": 0, "updated": 0, "removed": 0, "failed": 2}
+    assert run(OwnedGame.get, PydanticObjectId(updated["id"])).condition == "Good"
+    assert run(OwnedGame.get, PydanticObjectId(removed["id"])) is not None
+
+
+def test_locked_copy_is_not_deleted(client, run, make_user, make_game, add_copy):
+    _, headers = make_user()
+    copy = add_copy(headers, make_game())
+    lock(run, copy["id"])
+    response = client.delete(f"/users/library/{copy['id']}", headers=headers)
+    assert response.status_code == 409
+    assert run(OwnedGame.get, PydanticObjectId(copy["id"])) is not None
+
+
+def test_deleting_a_user_removes_their_holdings(
+    client, run, make_user, make_game, add_copy, monkeypatch
+):
+    userId, headers = make_user()
+    copy = add_copy(headers, make_game())
+    wanted = make_game()
+    assert client.post(
+        "/users/wishlist", json={"game": wanted}, headers=headers
+    ).status_code == 201
+    changed = []
+
+    async def holdings_changed(*userIds):
+        changed.extend(str(id) for id in userIds)
+
+    monkeypatch.setattr(usersRouter, "holdings_changed", holdings_changed)
+    lock(run, copy["id"])
+    response = client.delete(f"/users/{userId}")
+    assert response.status_code == 409, response.text
+    assert client.get(f"/users/{userId}").status_code == 200
+
+    async def unlock():
+        await OwnedGame.find_one(OwnedGame.id == PydanticObjectId(copy["id"])).update(
+            {"$set": {"tradeLock": None}}
+        )
+
+    run(unlock)
+    assert client.delete(f"/users/{userId}").status_code == 202
+    owner = PydanticObjectId(userId)
+    assert run(OwnedGame.find(OwnedGame.owner == owner).count) == 0
+    assert run(WishlistEntry.find(WishlistEntry.user == owner).count) == 0
+    assert changed == [userId]
@@ -0,0 +1,77 @@
+from beanie import PydanticObjectId
+from datetime import datetime, timedelta
+from models.tradeModel import ArchivedTrade, TradeCycle, TradeOffer, TradeStatus
+from services.lifecycleService import archive_trades, expire_trades, find_trade
+import time
+
+NOW = datetime.utcnow()
+OLD = NOW - timedelta(days=60)
+
+
+def insert_trade(run, **fields) -> TradeOffer:
+    trade = TradeOffer(
+        id=PydanticObjectId(),
+        offerer=PydanticObjectId(),
+        receiver=PydanticObjectId(),
+        offererMessage="",
+        offererGames=[],
+        receiverGames=[],
+        **fields,
+    )
+    run(trade.insert)
+    return trade
+
+
+def status(run, trade: TradeOffer) -> TradeStatus:
+    return run(find_trade, trade.id).status
+
+
+def test_old_pending_trades_expire(run):
+    old = insert_trade(run, timeOfRequest=OLD)
+    recent = insert_trade(run)
+    settling = insert_trade(run, timeOfRequest=OLD, settlingSince=NOW)
+    run(expire_trades, NOW - timedelta(days=30))
+    assert status(run, old) == TradeStatus.expired
+    assert run(find_trade, old.id).timeOfClosing is not None
+    assert status(run, recent) == TradeStatus.pending
+    # being accepted, left to the accept
+    assert status(run, settling) == TradeStatus.pending
+
+
+def test_old_cycles_expire_with_their_legs(run):
+    cycleId = PydanticObjectId()
+    leg = insert_trade(run, timeOfRequest=OLD, cycle=cycleId)
+    cycle = TradeCycle(
+        id=cycleId,
+        key=str(cycleId),
+        participants=[leg.offerer, leg.receiver],
+        trades=[leg.id],
+        timeOfProposal=OLD,
+    )
+    run(cycle.insert)
+    run(expire_trades, NOW - timedelta(days=30))
+    assert run(TradeCycle.get, cycleId).status == TradeStatus.expired
+    assert status(run, leg) == TradeStatus.expired
+
+
+def test_closed_trades_move_to_the_archive(run):
+    closed = insert_trade(run, status=TradeStatus.declined, timeOfClosing=OLD)
+    # closed before timeOfClosing existed
+    older = insert_trade(run, status=TradeStatus.accepted, timeOfRequest=OLD)
+    recent = insert_trade(run, status=TradeStatus.declined, timeOfClosing=NOW)
+    pending = insert_trade(run, timeOfRequest=OLD)
+    # copied by a sweep that died before deleting it
+    run(ArchivedTrade.get_motor_collection().insert_one, closed.dict(by_alias=True))
+    assert run(archive_trades, NOW - timedelta(days=7), time.monotonic() + 60)
+    for trade in (closed, older):
+        assert run(TradeOffer.get, trade.id) is None
+        assert run(ArchivedTrade.get, trade.id) is not None
+        assert run(find_trade, trade.id).status != TradeStatus.pending
+    for trade in (recent, pending):
+        assert run(TradeOffer.get, trade.id) is not None
+
+
+def test_archive_stops_at_the_deadline(run):
+    closed = insert_trade(run, status=TradeStatus.declined, timeOfClosing=OLD)
+    assert not run(archive_trades, NOW - timedelta(days=7), time.monotonic() - 1)
+    assert run(TradeOffer.get, closed.id) is not None
@@ -0,0 +1,31 @@
+from bson import ObjectId
+from services.migrationService import _convert, _migrations, SNAPSHOT_FIELDS
+
+USER = ObjectId()
+GAME = ObjectId()
+
+
+def test_links_become_object_ids():
+    document = {
+        "offerer": f"http://127.0.0.1:8000/users/{USER}",
+        "receiver": USER,
+        "offererGames": [
+            {"game": f"http://127.0.0.1:8000/games/{GAME}/", "name": "Tetris"},
+            {"name": "No game"},
+        ],
+    }
+    fields = ["offerer", "receiver"] + [
+        f"offererGames.{field}" for field in SNAPSHOT_FIELDS
+    ]
+    assert _convert(document, fields) == {
+        "offerer": USER,
+        "receiver": USER,
+        "offererGames": [{"game": GAME, "name": "Tetris"}, {"name": "No game"}],
+    }
+
+
+def test_startup_records_the_migrations(client, run):
+    async def finished():
+        return {marker["_id"] async for marker in _migrations().find()}
+
+    assert {"embedded_libraries", "references"} <= run(finished)
@@ -0,0 +1,64 @@
+from beanie import PydanticObjectId
+from datetime import datetime, timedelta
+from models.tradeModel import ArchivedTrade, TradeOffer, TradeStatus
+from tests.test_pagination import walk
+import pytest
+
+
+@pytest.fixture
+def trades(run, make_user):
+    """Trades of a user as offerer, as receiver and archived, by name"""
+    userId, headers = make_user()
+    user, other = PydanticObjectId(userId), PydanticObjectId()
+    start = datetime.utcnow() - timedelta(hours=1)
+
+    def trade(model, offerer, receiver, status, minutes):
+        return model(
+            id=PydanticObjectId(),
+            offerer=offerer,
+            receiver=receiver,
+            offererMessage="",
+            offererGames=[],
+            receiverGames=[],
+            status=status,
+            timeOfRequest=start + timedelta(minutes=minutes),
+        )
+
+    made = {
+        "offered": trade(TradeOffer, user, other, TradeStatus.pending, 1),
+        "received": trade(TradeOffer, other, user, TradeStatus.declined, 2),
+        "receivedPending": trade(TradeOffer, other, user, TradeStatus.pending, 3),
+        "archived": trade(ArchivedTrade, other, user, TradeStatus.accepted, 0),
+        "notMine": trade(TradeOffer, other, other, TradeStatus.pending, 4),
+    }
+    for made_trade in made.values():
+        run(made_trade.insert)
+    names = {str(made_trade.id): name for name, made_trade in made.items()}
+    return headers, names
+
+
+def listed(client, trades, query: str) -> list[str]:
+    headers, names = trades
+    pages = walk(client, f"/trades/myTrades?limit=2&{query}", headers)
+    return [names[trade["_id"]] for page in pages for trade in page]
+
+
+def test_both_roles_newest_first(client, trades):
+    assert listed(client, trades, "") == ["receivedPending", "received", "offered"]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("role=offerer", ["offered"]),
+        ("role=receiver", ["receivedPending", "received"]),
+        ("status=pending", ["receivedPending", "offered"]),
+        ("status=pending&role=receiver", ["receivedPending"]),
+        ("status=declined&role=offerer", []),
+        ("archived=true", ["archived"]),
+        ("archived=true&role=receiver&status=accepted", ["archived"]),
+        ("archived=true&role=offerer", []),
+    ],
+)
+def test_filters(client, trades, query, expected):
+    assert listed(client, trades, query) == expected
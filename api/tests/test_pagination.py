@@ -0,0 +1,80 @@
+import uuid
+
+
+def walk(client, url: str, headers=None) -> list[list[dict]]:
+    """Every page of a listing, following the next links"""
+    pages = []
+    while url is not None:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        pages.append(body["items"])
+        url = body["next"] and body["next"].replace("http://testserver", "")
+    return pages
+
+
+def test_games_by_id_walk_every_page(client, make_game):
+    publisher = uuid.uuid4().hex
+    ids = [make_game(name=f"Game {number}", publisher=publisher) for number in range(5)]
+    pages = walk(client, f"/games?publisher={publisher}&limit=2")
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [game["_id"] for page in pages for game in page] == ids
+
+
+def test_games_by_name_descending(client, make_game):
+    publisher = uuid.uuid4().hex
+    for name in ("Contra", "Metroid", "Kirby", "Zelda"):
+        make_game(name=name, publisher=publisher)
+    pages = walk(client, f"/games?publisher={publisher}&sort=name&order=desc&limit=3")
+    assert [len(page) for page in pages] == [3, 1]
+    names = [game["name"] for page in pages for game in page]
+    assert names == ["Zelda", "Metroid", "Kirby", "Contra"]
+
+
+def test_users_second_page(client, make_user):
+    for _ in range(3):
+        make_user()
+    pages = walk(client, "/users?limit=2")
+    assert len(pages) >= 2
+    ids = [user["id"] for page in pages for user in page]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_invalid_cursor(client):
+    assert client.get("/games?after=garbage").status_code == 400
+
+
+def test_game_owners_walk_every_page(client, make_user, make_game, add_copy):
+    game = make_game()
+    copies = []
+    for condition in ("Good", "Mint", "Good", "Poor", "Good"):
+        _, headers = make_user()
+        copies.append(add_copy(headers, game, condition))
+    pages = walk(client, f"/games/{game}/owners?limit=2")
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [copy["id"] for page in pages for copy in page] == [
+        copy["id"] for copy in copies
+    ]
+
+
+def test_game_owners_by_condition(client, make_user, make_game, add_copy):
+    game = make_game()
+    good = []
+    for condition in ("Good", "Mint", "Good", "Poor", "Good"):
+        _, headers = make_user()
+        copy = add_copy(headers, game, condition)
+        if condition == "Good":
+            good.append(copy["id"])
+    response = client.get(f"/games/{game}/owners?condition=Good&limit=2&expand=owner")
+    assert response.status_code == 200, response.text
+    # the next link keeps the filter and the expansion
+    assert "condition=Good" in response.json()["next"]
+    assert "expand=owner" in response.json()["next"]
+    pages = walk(client, f"/games/{game}/owners?condition=Good&limit=2&expand=owner")
+    assert [len(page) for page in pages] == [2, 1]
+    copies = [copy for page in pages for copy in page]
+    assert [copy["id"] for copy in copies] == good
+    assert all(copy["condition"] == "Good" for copy in copies)
+    assert all(isinstance(copy["owner"], dict) for copy in copies)
+    assert walk(client, f"/games/{game}/owners?condition=Boxed") == [[]]
@@ -0,0 +1,23 @@
+from fastapi import HTTPException
+from services.passwordService import PasswordHasher
+import asyncio
+
+
+def test_full_queue_is_answered_429():
+    hasher = PasswordHasher(rounds=4, workers=1, queueSize=0)
+
+    async def hash_twice():
+        return await asyncio.gather(
+            hasher.hash("password"), hasher.hash("password"), return_exceptions=True
+        )
+
+    try:
+        hashed, rejected = asyncio.run(hash_twice())
+    finally:
+        hasher.shutdown()
+    assert isinstance(rejected, HTTPException)
+    # a 503 would make nginx take the replica out of rotation
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "1"
+    assert hasher.rejected == 1
+
@@ -0,0 +1,82 @@
+from services import rateLimitService
+from services.rateLimitService import (
+    MemoryBucketStore,
+    admissionControl,
+    client_key,
+)
+import asyncio
+import ipaddress
+import pytest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic time of the buckets, moved by hand"""
+    now = [1000.0]
+    monkeypatch.setattr(rateLimitService.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_refills_at_the_rate(clock):
+    store = MemoryBucketStore()
+
+    async def take(cost):
+        return await store.take("ip:1.2.3.4", cost, rate=10, burst=20)
+
+    assert asyncio.run(take(15)) == 0
+    # 5 tokens left, 10 more after a second
+    assert asyncio.run(take(10)) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert asyncio.run(take(10)) == 0
+    clock[0] += 60
+    # never more than the burst
+    assert asyncio.run(take(20)) == 0
+    assert asyncio.run(take(1)) == pytest.approx(0.1)
+
+
+def test_buckets_are_per_client(clock):
+    store = MemoryBucketStore()
+
+    async def take(key):
+        return await store.take(key, 10, rate=1, burst=10)
+
+    assert asyncio.run(take("ip:1.2.3.4")) == 0
+    assert asyncio.run(take("ip:1.2.3.4")) > 0
+    assert asyncio.run(take("ip:5.6.7.8")) == 0
+
+
+def scope(peer: str, realIp: str) -> dict:
+    return {"client": (peer, 4321), "headers": [(b"x-real-ip", realIp.encode())]}
+
+
+def test_real_ip_is_only_read_from_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(
+        rateLimitService, "TRUSTED_PROXIES", [ipaddress.ip_network("172.28.0.10")]
+    )
+    assert client_key(scope("172.28.0.10", "1.2.3.4")) == "ip:1.2.3.4"
+    # a client of a published port picking its own bucket
+    assert client_key(scope("172.28.0.1", "1.2.3.4")) == "ip:172.28.0.1"
+    assert client_key(scope("testclient", "1.2.3.4")) == "ip:testclient"
+
+
+def test_login_burst_is_answered_429(client, run, monkeypatch):
+    monkeypatch.setattr(rateLimitService, "RATE", 1)
+    monkeypatch.setattr(rateLimitService, "BURST", 30)
+
+    def login():
+        return client.post(
+            "/users/token", data={"username": "nobody", "password": "wrong"}
+        )
+
+    run(admissionControl.start, MemoryBucketStore())
+    try:
+        # a login costs 10 tokens
+        statuses = [login().status_code for _ in range(3)]
+        response = login()
+        health = client.get("/healthz")
+    finally:
+        run(admissionControl.stop)
+    assert 429 not in statuses
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert health.status_code == 200
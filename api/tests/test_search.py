@@ -0,0 +1,98 @@
+import uuid
+import re
+from beanie import PydanticObjectId
+from models.gameModel import GameAbstract
+from services import searchService
+from services.searchService import tokenize, word_pattern
+
+# the weights of game_text_search
+WEIGHTS = {"name": 10, "publisher": 5, "tags": 3, "platforms": 3}
+
+
+def text_score(tokens: set[str], game: dict) -> int:
+    def matches(values: list[str]) -> bool:
+        return any(not tokens.isdisjoint(tokenize(value)) for value in values)
+
+    fields = {
+        "name": [game["name"]],
+        "publisher": [game["publisher"]],
+        "tags": [tag.value for tag in game["tags"]],
+        "platforms": game["platforms"],
+    }
+    return sum(
+        weight for field, weight in WEIGHTS.items() if matches(fields[field])
+    )
+
+
+def fake_text_stages(games: list[GameAbstract]):
+    """game_text_search over the games, mongomock has no $text"""
+
+    def text_stages(query: str) -> list[dict]:
+        tokens = set(query.split())
+        scores = {game.id: text_score(tokens, game.dict()) for game in games}
+        scores = {id: score for id, score in scores.items() if score}
+        return [
+            {"$match": {"_id": {"$in": list(scores)}}},
+            {
+                "$addFields": {
+                    "score": {
+                        "$switch": {
+                            "branches": [
+                                {"case": {"$eq": ["$_id", id]}, "then": score}
+                                for id, score in scores.items()
+                            ],
+                            "default": 0,
+                        }
+                    }
+                }
+            },
+        ]
+
+    return text_stages
+
+
+def game(**fields) -> GameAbstract:
+    defaults = {
+        "publisher": "Nintendo",
+        "release_date": "1990-01-01",
+        "platforms": ["NES"],
+        "tags": ["RPG"],
+    }
+    return GameAbstract(id=PydanticObjectId(), **{**defaults, **fields})
+
+
+def test_every_bucket_is_filled(client, run, monkeypatch, make_user):
+    word = uuid.uuid4().hex
+    # outscore the name matches, 5 + 3 + 3 against 10
+    games = [
+        game(
+            name=f"Other {number}",
+            publisher=f"{word} Games",
+            platforms=[f"{word} Console"],
+            tags=["Action"],
+        )
+        for number in range(searchService.BUCKET_SIZE * 4 + 10)
+    ]
+    games += [game(name=f"{word} {number}") for number in range(3)]
+    run(GameAbstract.insert_many, games)
+    monkeypatch.setattr(searchService, "_text_stages", fake_text_stages(games))
+
+    _, headers = make_user()
+    response = client.get(f"/games/search/action {word.upper()}", headers=headers)
+    results = response.json()
+    assert sorted(game["name"] for game in results["nameResults"]) == [
+        f"{word} 0",
+        f"{word} 1",
+        f"{word} 2",
+    ]
+    for bucket in ("tagResults", "platformResults", "publisherResults"):
+        assert len(results[bucket]) == searchService.BUCKET_SIZE
+    assert results["total"] == 3 + 3 * searchService.BUCKET_SIZE
+
+
+def test_folding():
+    assert tokenize("Pokémon RED") == {"pokemon", "red"}
+    pattern = word_pattern(tokenize("pokemon"))
+    assert re.search(pattern, "POKÉMON Blue", re.IGNORECASE)
+    assert re.search(pattern, "Super Pokémon", re.IGNORECASE)
+    assert not re.search(pattern, "Pokemons", re.IGNORECASE)
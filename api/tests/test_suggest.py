@@ -0,0 +1,49 @@
+from services import suggestService
+import time
+import uuid
+import pytest
+
+
+@pytest.fixture
+def word():
+    """A word no other game uses, so only this test's games match it"""
+    return "q" + uuid.uuid4().hex[:8]
+
+
+def suggested(client, q: str) -> list[tuple[str, int]]:
+    response = client.get("/games/suggest", params={"q": q})
+    assert response.status_code == 200, response.text
+    return [(game["name"], game["copies"]) for game in response.json()]
+
+
+def test_prefixes_match_word_suffixes(client, make_game, word):
+    make_game(name=f"The Legend of {word.title()}", publisher=f"{word}soft")
+    make_game(name=f"Légende {word}", publisher="Nintendo")
+    legend = f"The Legend of {word.title()}"
+    assert {name for name, _ in suggested(client, word[:5])} == {
+        legend,
+        f"Légende {word}",
+    }
+    assert suggested(client, f"legend of {word[:3]}") == [(legend, 0)]
+    assert suggested(client, f"{word}so") == [(legend, 0)]
+    # folded, and only from the start of a word
+    assert suggested(client, f"legende {word}") == [(f"Légende {word}", 0)]
+    assert suggested(client, f"egend of {word}") == []
+    assert suggested(client, f"{word[1:]}") == []
+
+
+def test_new_copies_are_counted_soon(
+    client, make_user, make_game, add_copy, word, monkeypatch
+):
+    monkeypatch.setattr(suggestService, "RECOUNT_DELAY", 0)
+    rare = make_game(name=f"{word} Rare")
+    common = make_game(name=f"{word} Common")
+    _, headers = make_user()
+    add_copy(headers, rare)
+    for _ in range(2):
+        add_copy(headers, common)
+    expected = [(f"{word} Common", 2), (f"{word} Rare", 1)]
+    deadline = time.monotonic() + 5
+    while suggested(client, word) != expected and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert suggested(client, word) == expected
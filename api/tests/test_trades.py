@@ -0,0 +1,196 @@
+from beanie import PydanticObjectId
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from models.gameModel import OwnedGame
+from models.tradeModel import TradeOffer, TradeStatus
+from services import tradeService
+from services.tradeService import SETTLE_TIMEOUT
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def trade(client, make_user, make_game, add_copy):
+    """A pending trade of a copy for a copy, with both users"""
+    offerer, offererHeaders = make_user()
+    receiver, receiverHeaders = make_user()
+    offered = add_copy(offererHeaders, make_game())
+    asked = add_copy(receiverHeaders, make_game(name="Sonic the Hedgehog"))
+    response = client.post(
+        f"/trades/request/{receiver}",
+        json={
+            "offererMessage": "Swap?",
+            "offererGames": [offered],
+            "receiverGames": [asked],
+        },
+        headers=offererHeaders,
+    )
+    assert response.status_code == 201, response.text
+    return {
+        "id": response.json()["_id"],
+        "offerer": offerer,
+        "receiver": receiver,
+        "receiverHeaders": receiverHeaders,
+        "offered": offered["id"],
+        "asked": asked["id"],
+    }
+
+
+def copy(run, id: str) -> OwnedGame:
+    return run(OwnedGame.get, PydanticObjectId(id))
+
+
+def assert_owned(run, id: str, owner: str, history: int):
+    game = copy(run, id)
+    assert str(game.owner) == owner
+    assert game.tradeLock is None
+    assert len(game.ownerHistory) == history
+
+
+def test_accept_moves_both_sides(client, run, trade):
+    response = client.post(
+        f"/trades/accept/{trade['id']}", headers=trade["receiverHeaders"]
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == TradeStatus.accepted.value
+    assert_owned(run, trade["offered"], trade["receiver"], 2)
+    assert_owned(run, trade["asked"], trade["offerer"], 2)
+
+
+def test_concurrent_accepts_move_the_games_once(run, trade):
+    receiver = PydanticObjectId(trade["receiver"])
+
+    async def accept_twice():
+        return await asyncio.gather(
+            tradeService.accept_trade(PydanticObjectId(trade["id"]), receiver),
+            tradeService.accept_trade(PydanticObjectId(trade["id"]), receiver),
+            return_exceptions=True,
+        )
+
+    results = run(accept_twice)
+    accepted = [result for result in results if isinstance(result, TradeOffer)]
+    refused = [result for result in results if isinstance(result, HTTPException)]
+    assert len(accepted) == 1 and len(refused) == 1
+    assert refused[0].status_code in (403, 409)
+    assert_owned(run, trade["offered"], trade["receiver"], 2)
+    assert_owned(run, trade["asked"], trade["offerer"], 2)
+
+
+def test_accept_rolls_back_when_a_game_moved(client, run, trade):
+    async def lock():
+        await OwnedGame.find_one(
+            OwnedGame.id == PydanticObjectId(trade["asked"])
+        ).update({"$set": {"tradeLock": PydanticObjectId()}})
+
+    run(lock)
+    response = client.post(
+        f"/trades/accept/{trade['id']}", headers=trade["receiverHeaders"]
+    )
+    assert response.status_code == 409
+    # the offered copy had moved already, it is back with its owner
+    assert_owned(run, trade["offered"], trade["offerer"], 1)
+    offer = run(TradeOffer.get, PydanticObjectId(trade["id"]))
+    assert offer.status == TradeStatus.pending
+    assert offer.settlingSince is None
+
+
+def test_recovery_rolls_back_a_stalled_accept(client, run, trade):
+    async def stall():
+        # an accept that died after moving the offered copy
+        stalled = await TradeOffer.get(PydanticObjectId(trade["id"]))
+        stalled.settlingSince = datetime.utcnow() - 2 * SETTLE_TIMEOUT
+        await stalled.save()
+        await tradeService._move(
+            stalled, [stalled.offererGames[0].id], stalled.offerer, stalled.receiver
+        )
+
+    run(stall)
+    response = client.post(
+        f"/trades/accept/{trade['id']}", headers=trade["receiverHeaders"]
+    )
+    assert response.status_code == 409
+    run(tradeService.recovery, {})
+    assert_owned(run, trade["offered"], trade["offerer"], 1)
+    response = client.post(
+        f"/trades/accept/{trade['id']}", headers=trade["receiverHeaders"]
+    )
+    assert response.status_code == 200, response.text
+    assert_owned(run, trade["offered"], trade["receiver"], 2)
+
+
+@pytest.mark.parametrize("stage", ["before moving", "after moving"])
+def test_recovery_overtaking_a_slow_accept(client, run, trade, monkeypatch, stage):
+    # every claim counts as stalled, recovery runs in the middle of the accept
+    monkeypatch.setattr(tradeService, "SETTLE_TIMEOUT", timedelta(seconds=-1))
+    move = tradeService._move
+    moves = []
+
+    async def slow_move(*args):
+        moves.append(args)
+        if stage == "before moving" and len(moves) == 1:
+            await tradeService.recover_stalled_trades()
+        moved = await move(*args)
+        if stage == "after moving" and len(moves) == 2:
+            await tradeService.recover_stalled_trades()
+        return moved
+
+    monkeypatch.setattr(tradeService, "_move", slow_move)
+    response = client.post(
+        f"/trades/accept/{trade['id']}", headers=trade["receiverHeaders"]
+    )
+    assert response.status_code == 409, response.text
+    assert_owned(run, trade["offered"], trade["offerer"], 1)
+    assert_owned(run, trade["asked"], trade["receiver"], 1)
+    offer = run(TradeOffer.get, PydanticObjectId(trade["id"]))
+    assert offer.status == TradeStatus.pending
+    assert offer.settlingSince is None
+
+    monkeypatch.setattr(tradeService, "_move", move)
+    response = client.post(
+        f"/trades/accept/{trade['id']}", headers=trade["receiverHeaders"]
+    )
+    assert response.status_code == 200, response.text
+    assert_owned(run, trade["offered"], trade["receiver"], 2)
+
+
+def test_slow_accept_cannot_finish_a_recovered_trade(run, trade, monkeypatch):
+    monkeypatch.setattr(tradeService, "SETTLE_TIMEOUT", timedelta(seconds=-1))
+    move, moveBack = tradeService._move, tradeService._move_back
+    moved, undoing = asyncio.Event(), asyncio.Event()
+    moves = []
+
+    async def slow_move(*args):
+        result = await move(*args)
+        moves.append(args)
+        if len(moves) == 2:
+            moved.set()
+            await undoing.wait()  # finalize while recovery moves the games back
+        return result
+
+    async def slow_move_back(*args):
+        undoing.set()
+        await asyncio.sleep(0.05)
+        await moveBack(*args)
+
+    async def recover():
+        await moved.wait()
+        await tradeService.recover_stalled_trades()
+
+    monkeypatch.setattr(tradeService, "_move", slow_move)
+    monkeypatch.setattr(tradeService, "_move_back", slow_move_back)
+
+    async def race():
+        return await asyncio.gather(
+            tradeService.accept_trade(
+                PydanticObjectId(trade["id"]), PydanticObjectId(trade["receiver"])
+            ),
+            recover(),
+            return_exceptions=True,
+        )
+
+    accepted, _ = run(race)
+    assert isinstance(accepted, HTTPException) and accepted.status_code == 409
+    assert_owned(run, trade["offered"], trade["offerer"], 1)
+    assert_owned(run, trade["asked"], trade["receiver"], 1)
+    offer = run(TradeOffer.get, PydanticObjectId(trade["id"]))
+    assert offer.status == TradeStatus.pending
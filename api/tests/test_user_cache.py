@@ -0,0 +1,109 @@
+from beanie import PydanticObjectId
+from models.userModel import User
+from services.invalidationBus import invalidationBus
+from services.cacheService import TTLCache, userCache
+from dependencies import get_user
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(capacity=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(capacity=2, ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_cached_reads_skip_mongo(client, make_user, monkeypatch):
+    userId, headers = make_user()
+    assert client.get(f"/users/{userId}").status_code == 200
+    reads = []
+    original = User.get
+
+    async def counted_get(*args, **kwargs):
+        reads.append(args)
+        return await original(*args, **kwargs)
+
+    async def counted_find_one(*args, **kwargs):
+        raise AssertionError("authenticated user read from Mongo")
+
+    monkeypatch.setattr(User, "get", counted_get)
+    monkeypatch.setattr(User, "find_one", counted_find_one)
+    assert client.get(f"/users/{userId}").status_code == 200
+    assert client.get("/users/wishlist", headers=headers).status_code == 200
+    assert reads == []
+
+
+def test_writes_invalidate_the_cached_user(client, make_user):
+    userId, _ = make_user()
+    client.get(f"/users/{userId}")
+    response = client.patch(
+        f"/users/{userId}", json={"password": "password", "username": "renamed"}
+    )
+    assert response.status_code == 202, response.text
+    assert client.get(f"/users/{userId}").json()["username"] == "renamed"
+
+
+def test_cached_users_are_copies(client, run, make_user):
+    userId, _ = make_user()
+
+    async def mutate():
+        user = await get_user(userId)
+        user.username = "mutated"
+        return (await get_user(userId)).username
+
+    assert run(mutate) != "mutated"
+    assert userCache.get(("id", userId)).username != "mutated"
+
+
+def test_updates_keep_concurrent_trade_history(client, run, make_user):
+    userId, _ = make_user()
+    client.get(f"/users/{userId}")  # cached before the trade is recorded
+    tradeId = PydanticObjectId()
+
+    async def record_trade():
+        await User.get_motor_collection().update_one(
+            {"_id": PydanticObjectId(userId)}, {"$addToSet": {"tradeHistory": tradeId}}
+        )
+
+    run(record_trade)
+    response = client.patch(
+        f"/users/{userId}",
+        json={
+            "password": "password",
+            "username": "renamed",
+            "date_of_birth": "1990-05-04",
+        },
+    )
+    assert response.status_code == 202, response.text
+    user = run(User.get, PydanticObjectId(userId))
+    assert user.username == "renamed"
+    assert str(user.date_of_birth) == "1990-05-04"
+    assert tradeId in user.tradeHistory
+
+
+def test_reads_overtaken_by_a_write_are_not_cached(client, run, make_user, monkeypatch):
+    userId, _ = make_user()
+    userCache.invalidate(("id", userId))
+    original = User.get
+
+    async def overtaken_get(*args, **kwargs):
+        user = await original(*args, **kwargs)
+        # a write lands between the read and filling the cache
+        await invalidationBus.publish("User", user.id)
+        return user
+
+    monkeypatch.setattr(User, "get", overtaken_get)
+    assert run(get_user, PydanticObjectId(userId)) is not None
+    assert userCache.get(("id", userId)) is None
+    monkeypatch.setattr(User, "get", original)
+    run(get_user, PydanticObjectId(userId))
+    assert userCache.get(("id", userId)) is not None